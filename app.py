@@ -2,6 +2,9 @@ import streamlit as st
 from config.auth_manager import AuthManager
 from config.layout import configurar_interface, inicializar_sessao
 from rag.rag_manager import RAGManager
+from rag.model_pool import PoolEsgotado
+from chat.chat_manager import exibir_stream, exibir_metricas, avisar_pool_esgotado
+from rag.registry import aquecer, estatisticas
 import pandas as pd
 
 # ========== PÁGINA PERGUNTA ==========
@@ -11,7 +14,11 @@ def pagina_pergunta():
     pergunta = st.text_area("Digite sua pergunta:", height=100)
     if st.button("Enviar"):
         with st.spinner("Buscando resposta..."):
-            resposta, fontes, score = rag.responder_pergunta(pergunta, return_score=True)
+            metricas = {}
+            try:
+                resposta, fontes, score = rag.responder_pergunta(pergunta, return_score=True, stream=True, metricas=metricas)
+            except PoolEsgotado:
+                avisar_pool_esgotado()
             lista = None
             uf_nome = None
 
@@ -34,16 +41,21 @@ def pagina_pergunta():
                 st.markdown(f"### {titulo}")
                 st.table(df_tabela)
             else:
-                st.markdown(f"**Resposta:**\n\n{resposta}")
+                # Resposta em streaming: o texto aparece conforme os tokens saem do modelo
+                area = st.empty()
+                exibir_stream(resposta, lambda texto, parcial: area.markdown(f"**Resposta:**\n\n{texto}{'▌' if parcial else ''}"))
 
             st.markdown("---")
             st.markdown(f"**Fontes:** {', '.join(fontes)}")
             st.markdown(f"**Confiabilidade estimada:** {round(score * 100, 1)}%")
+            exibir_metricas(metricas)
 
 # ========== PÁGINA ESTATÍSTICAS ==========
 def pagina_estatisticas():
     st.title("📊 Estatísticas")
     st.info("Página de estatísticas. (Cole aqui o código de estatísticas.py)")
+    st.subheader("Instâncias dos modelos")
+    st.dataframe(pd.DataFrame(estatisticas()))
 
 # ========== PÁGINA HISTÓRICO ==========
 def pagina_historico():
@@ -58,6 +70,13 @@ def pagina_auditoria():
 # ========== APP PRINCIPAL ==========
 configurar_interface()
 inicializar_sessao()
+# Modelos e índice são carregados uma vez por processo (o primeiro rerun espera; os demais não)
+# Sem índice publicado ainda, só a página de perguntas fica indisponível (login e demais páginas seguem)
+try:
+    with st.spinner("Carregando modelos e índice..."):
+        aquecer()
+except FileNotFoundError as e:
+    st.warning(f"Índice ainda não disponível; rode a indexação antes de fazer perguntas. ({e})")
 auth = AuthManager()
 
 if not st.session_state.logged_in:
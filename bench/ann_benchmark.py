@@ -0,0 +1,91 @@
+"""
+Compara os tipos de índice (flat, ivf_flat, hnsw, ivf_pq) e as codificações
+compactadas (float16, sq8, pq, com e sem re-rank exato): recall@k contra o
+flat exato, latência p50/p99 por consulta e tamanho do índice.
+
+    python -m bench.ann_benchmark                       # vetores do índice atual (via cache de embeddings)
+    python -m bench.ann_benchmark --sintetico 50000 --dim 4096
+
+As consultas são vetores do corpus com ruído gaussiano, uma por vez (como no app).
+"""
+import time
+import argparse
+import numpy as np
+from rag.ann_index import DEFAULT_INDEX_CONFIG, construir_index, aplicar_parametros_busca, tamanho_index, buscar, recall_at_k
+
+GRADE = [
+    ("flat", {}, [{}]),
+    ("ivf_flat", {}, [{"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}]),
+    ("hnsw", {"hnsw_m": 32}, [{"ef_search": 32}, {"ef_search": 64}, {"ef_search": 128}]),
+    ("ivf_pq", {}, [{"nprobe": 16}, {"nprobe": 64}]),
+    ("flat", {"codificacao": "float16"}, [{}]),
+    ("flat", {"codificacao": "sq8"}, [{}, {"rerank_fator": 4}]),
+    ("flat", {"codificacao": "pq"}, [{}, {"rerank_fator": 4}, {"rerank_fator": 10}]),
+]
+
+def vetores_do_indice_atual():
+    from rag.index_manager import carregar_index, carregar_index_meta, modelo_embedding_do_indice
+    from rag.embedding_cache import EmbeddingCache
+
+    _, _, meta, _ = carregar_index()
+    # O cache é por modelo: o de embedding com que o índice foi feito, não o de geração
+    cache = EmbeddingCache(modelo_embedding_do_indice(carregar_index_meta()))
+    vetores, _, faltando = cache.buscar(meta.chunk_hashes())
+    if not len(vetores):
+        raise SystemExit("❌ Nenhum vetor do índice atual no cache de embeddings; use --sintetico.")
+    if faltando:
+        print(f"⚠️ {len(faltando)} vetores do índice não estão no cache; usando os {len(vetores)} disponíveis.")
+    return vetores
+
+def medir(index, consultas, k, vetores=None, rerank_fator=0):
+    latencias, resultados = [], []
+    for q in consultas:
+        inicio = time.perf_counter()
+        _, I = buscar(index, q[None, :], k, vetores, rerank_fator)
+        latencias.append(time.perf_counter() - inicio)
+        resultados.append(I[0])
+    return np.array(resultados), np.array(latencias) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sintetico", type=int, help="Número de vetores aleatórios (em vez do índice atual).")
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.sintetico:
+        vetores = rng.standard_normal((args.sintetico, args.dim)).astype("float32")
+    else:
+        vetores = vetores_do_indice_atual()
+    n, dim = vetores.shape
+    escala = float(np.std(vetores)) * 0.1
+    consultas = vetores[rng.choice(n, min(args.consultas, n), replace=False)]
+    consultas = (consultas + rng.normal(0, escala, consultas.shape)).astype("float32")
+    print(f"📦 {n} vetores x {dim} dims, {len(consultas)} consultas, k={args.k}\n")
+    print(f"{'índice':<10} {'parâmetros':<28} {'build (s)':>9} {'tamanho (MB)':>12} {'recall@k':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+
+    referencia = None
+    for tipo, params_build, variacoes in GRADE:
+        config = dict(DEFAULT_INDEX_CONFIG, index_type=tipo, **params_build)
+        inicio = time.perf_counter()
+        index, config = construir_index(vetores, config)
+        build = time.perf_counter() - inicio
+        tamanho = tamanho_index(index) / 2**20
+        if config["index_type"] != tipo or config["codificacao"] != params_build.get("codificacao", "float32"):
+            print(f"{tipo:<10} (corpus pequeno: virou {config['index_type']}/{config['codificacao']}; pulando)")
+            continue
+        for params in variacoes:
+            aplicar_parametros_busca(index, dict(config, **params))
+            resultados, latencias = medir(index, consultas, args.k, vetores, params.get("rerank_fator", 0))
+            if referencia is None:
+                referencia = resultados
+            rotulo = ",".join(f"{k}={v}" for k, v in dict(params_build, **params).items()) or "-"
+            print(
+                f"{tipo:<10} {rotulo:<28} {build:>9.2f} {tamanho:>12.1f} {recall_at_k(resultados, referencia):>9.3f} "
+                f"{np.percentile(latencias, 50):>9.2f} {np.percentile(latencias, 99):>9.2f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Mede partida a frio e memória por processo ao abrir o índice FAISS:
+pickle antigo x formato nativo em memória x nativo mapeado (mmap), para um
+índice flat e um IVF.
+
+    python -m bench.index_load --n 20000 --dim 4096 --processos 3
+
+Cada leitura roda num processo novo. RssAnon é memória privada do processo;
+RssFile são páginas do arquivo no page cache, compartilhadas entre processos.
+A coluna "leitura" mostra o que ler_faiss conseguiu: nos IVF, só as listas
+invertidas são mapeadas ("mmap_listas"), e em FAISS sem suporte o mmap vira
+carga em memória ("memoria"), o que aparece como memória privada.
+"""
+import os
+import sys
+import time
+import json
+import pickle
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import faiss
+
+def _rss_kb():
+    campos = {}
+    with open("/proc/self/status") as f:
+        for linha in f:
+            if linha.startswith(("VmRSS", "RssAnon", "RssFile")):
+                nome, valor = linha.split(":")
+                campos[nome] = int(valor.split()[0])
+    return campos
+
+def _medir(modo, path, dim):
+    sys.path.insert(0, os.getcwd())
+    from rag.ann_index import ler_faiss_com_modo
+
+    antes = _rss_kb()
+    inicio = time.perf_counter()
+    if modo == "pickle":
+        with open(path, "rb") as f:
+            index = pickle.load(f)
+        leitura = "pickle"
+    else:
+        index, leitura = ler_faiss_com_modo(path, mmap=(modo == "mmap"))
+    carga = time.perf_counter() - inicio
+    q = np.random.default_rng(1).standard_normal((1, dim)).astype("float32")
+    inicio = time.perf_counter()
+    index.search(q, 20)
+    busca = time.perf_counter() - inicio
+    depois = _rss_kb()
+    print(json.dumps({
+        "modo": modo,
+        "leitura": leitura,
+        "carga_s": round(carga, 3),
+        "primeira_busca_s": round(busca, 3),
+        "rss_anon_mb": round((depois["RssAnon"] - antes["RssAnon"]) / 1024, 1),
+        "rss_file_mb": round((depois["RssFile"] - antes["RssFile"]) / 1024, 1),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--processos", type=int, default=3, help="Leituras (processos) por modo.")
+    parser.add_argument("--nlist", type=int, default=None, help="Listas do IVF (padrão: 4·√n).")
+    parser.add_argument("--_medir", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._medir:
+        _medir(args._medir[0], args._medir[1], args.dim)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vetores = np.random.default_rng(0).standard_normal((args.n, args.dim)).astype("float32")
+        nlist = args.nlist or max(1, int(4 * np.sqrt(args.n)))
+        indices = {"flat": faiss.IndexFlatL2(args.dim), "ivf": faiss.IndexIVFFlat(faiss.IndexFlatL2(args.dim), args.dim, nlist)}
+        indices["ivf"].train(vetores)
+        for index in indices.values():
+            index.add(vetores)
+        del vetores
+
+        for tipo, index in indices.items():
+            pickle_path = os.path.join(tmp, f"{tipo}_pickle.index")
+            nativo_path = os.path.join(tmp, f"{tipo}_nativo.index")
+            with open(pickle_path, "wb") as f:
+                pickle.dump(index, f)
+            faiss.write_index(index, nativo_path)
+            print(f"📦 {tipo}: {args.n} vetores x {args.dim} dims: {os.path.getsize(nativo_path) / 2**20:.0f} MB em disco")
+
+            for modo, path in [("pickle", pickle_path), ("nativo", nativo_path), ("mmap", nativo_path)]:
+                for _ in range(args.processos):
+                    saida = subprocess.run(
+                        [sys.executable, "-m", "bench.index_load", "--dim", str(args.dim), "--_medir", modo, path],
+                        capture_output=True, text=True, check=True
+                    ).stdout.strip().splitlines()[-1]
+                    r = json.loads(saida)
+                    print(
+                        f"{tipo:>4} {r['modo']:>7} | leitura {r['leitura']:>11} | carga {r['carga_s']:>7.3f}s | "
+                        f"1ª busca {r['primeira_busca_s']:>6.3f}s | privada {r['rss_anon_mb']:>8.1f} MB | "
+                        f"page cache {r['rss_file_mb']:>8.1f} MB"
+                    )
+
+if __name__ == "__main__":
+    main()
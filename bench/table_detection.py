@@ -0,0 +1,134 @@
+"""
+Compara a detecção de tabelas antiga (extrair_tabelas_generico original,
+quatro re.split por linha) com o detector de passada única.
+
+    python -m bench.table_detection                   # texto sintético de portarias
+    python -m bench.table_detection --paginas 5000
+    python -m bench.table_detection --arquivo portarias.txt   # páginas separadas por \\f
+
+Confere também que, sem continuação entre páginas, as tabelas são idênticas.
+"""
+import re
+import time
+import random
+import argparse
+from rag.table_detection import detectar_tabelas
+
+def extrair_tabelas_legado(texto, max_colunas=10, min_colunas=2):
+    """Implementação original, mantida aqui só como referência do benchmark."""
+    linhas = texto.split('\n')
+    tabelas = []
+    bloco = []
+    padrao_linha_tabela = re.compile(r"^\s*(\d+\.|\.\s*|\|\s*|[A-Z]{2}\s*\.)")
+    for linha in linhas:
+        if padrao_linha_tabela.match(linha) and len(linha.split()) >= min_colunas:
+            bloco.append(linha)
+        else:
+            if len(bloco) >= 2:
+                tabelas.append(list(bloco))
+            bloco = []
+    if len(bloco) >= 2:
+        tabelas.append(list(bloco))
+
+    tabelas_estruturadas = []
+    for tab in tabelas:
+        delimitadores = [r'\s{2,}', r'\t', r'\|', r'\.']
+        melhor_delim = None
+        max_cols = 0
+        for delim in delimitadores:
+            cols = [re.split(delim, l.strip()) for l in tab]
+            num_cols = max(len(c) for c in cols)
+            if num_cols > max_cols:
+                melhor_delim = delim
+                max_cols = num_cols
+        if melhor_delim:
+            rows = [list(map(str.strip, re.split(melhor_delim, l.strip()))) for l in tab]
+            header = None
+            if any(re.search('[A-Za-z]', cel) for cel in rows[0]):
+                header = rows[0]
+                rows = rows[1:]
+            else:
+                header = [f"Coluna_{i+1}" for i in range(len(rows[0]))]
+            if len(header) <= max_colunas:
+                tabelas_estruturadas.append({'header': header, 'rows': rows})
+    return tabelas_estruturadas
+
+PARAGRAFOS = [
+    "O SECRETÁRIO, no uso das atribuições que lhe confere o art. 5º do Decreto nº 9.745, resolve:",
+    "Art. 1º Designar os servidores abaixo relacionados para compor a comissão de que trata esta Portaria.",
+    "Parágrafo único. A comissão terá prazo de 60 (sessenta) dias para conclusão dos trabalhos.",
+    "Art. 2º Esta Portaria entra em vigor na data de sua publicação.",
+]
+NOMES = ["MARIA DA SILVA", "JOÃO PEREIRA", "ANA SOUZA", "CARLOS LIMA", "PAULA COSTA"]
+
+def linha_tabela(rng):
+    return f"| {rng.choice(NOMES)} | {rng.randint(100000, 999999)} | SR/{rng.randint(1, 27):02d} |"
+
+def pagina_sintetica(rng, n_pagina, continua_tabela):
+    """Página de portaria: maioria de texto corrido, algumas listas e tabelas (às vezes cortadas no fim)."""
+    linhas = []
+    if continua_tabela:
+        linhas.append("| Nome | Matrícula | Lotação |")
+        linhas.extend(linha_tabela(rng) for _ in range(rng.randint(1, 6)))
+    for _ in range(rng.randint(15, 40)):
+        linhas.append(rng.choice(PARAGRAFOS))
+        if rng.random() < 0.3:
+            linhas.append("")
+    if rng.random() < 0.2:
+        for i in range(rng.randint(2, 8)):
+            linhas.append(f"{i+1}.  {rng.choice(NOMES)}  SIAPE {rng.randint(1000000, 9999999)}  Portaria {rng.randint(1, 999)}/2024")
+        linhas.append(rng.choice(PARAGRAFOS))
+    cortada = rng.random() < 0.3
+    if cortada:
+        linhas.append("| Nome | Matrícula | Lotação |")
+        linhas.extend(linha_tabela(rng) for _ in range(rng.randint(2, 12)))
+    linhas.append("")
+    linhas.append(str(n_pagina))
+    return "\n".join(linhas), cortada
+
+def medir(funcao, repeticoes):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paginas", type=int, default=2000, help="Páginas sintéticas.")
+    parser.add_argument("--arquivo", help="Texto real, com páginas separadas por form feed (\\f).")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.arquivo:
+        with open(args.arquivo, "r", encoding="utf-8") as f:
+            paginas = f.read().split("\f")
+    else:
+        rng = random.Random(0)
+        paginas, cortada = [], False
+        for i in range(args.paginas):
+            pagina, cortada = pagina_sintetica(rng, i + 1, cortada)
+            paginas.append(pagina)
+    n_linhas = sum(p.count("\n") + 1 for p in paginas)
+    print(f"📄 {len(paginas)} páginas, {n_linhas} linhas, {sum(map(len, paginas)) / 2**20:.1f} MB\n")
+
+    t_legado, legado = medir(lambda: [t for p in paginas for t in extrair_tabelas_legado(p)], args.repeticoes)
+    t_novo, novo = medir(lambda: list(detectar_tabelas(paginas, multipagina=False)), args.repeticoes)
+    t_multi, multi = medir(lambda: list(detectar_tabelas(paginas)), args.repeticoes)
+
+    iguais = [{"header": t["header"], "rows": t["rows"]} for t in novo] == legado
+    entre_paginas = sum(1 for t in multi if t["paginas"][0] != t["paginas"][1])
+
+    print(f"{'detector':<24} {'tempo (s)':>10} {'linhas/s':>12} {'tabelas':>8}")
+    for nome, t, tabelas in (
+        ("legado", t_legado, legado),
+        ("passada única", t_novo, novo),
+        ("passada única + multipág", t_multi, multi),
+    ):
+        print(f"{nome:<24} {t:>10.3f} {n_linhas / t:>12.0f} {len(tabelas):>8}")
+    print(f"\n⚡ Speedup: {t_legado / t_novo:.1f}x | resultados idênticos ao legado: {'sim' if iguais else 'NÃO'}")
+    print(f"📑 Tabelas que atravessam páginas (modo multipágina): {entre_paginas}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import streamlit as st
-import pickle
 import json
-import numpy as np
-from llama_cpp import Llama
 from chat.web_search import busca_google
 from chat.cache_manager import CacheManager
+from rag.ann_index import buscar, buscar_filtrado
+from rag.dim_reduction import aplicar_reducao
+from rag.generations import diretorio_atual
+from rag.query_cache import cache_de_perguntas
+from rag.prefix_cache import cache_de_prefixos
+from rag.model_pool import PoolEsgotado
+from rag.embedding_engine import extrair_embedding
 from datetime import datetime
+from contextlib import nullcontext
 import os
+import time
 import tiktoken
 import re
 import pandas as pd
@@ -17,9 +23,20 @@ LLAMA_MAX_TOKENS = 1500
 
 from preprocessing.ufs import NOME_PARA_UF
 
-def load_model_path():
+def load_model_config():
     with open("config/model_config.json") as f:
-        return "./models/" + json.load(f)["model_name"]
+        return json.load(f)
+
+def load_model_path():
+    return "./models/" + load_model_config()["model_name"]
+
+def load_embedding_model_name():
+    """GGUF dos embeddings (índice e perguntas); sem embedding_model_name, o próprio modelo de geração."""
+    config = load_model_config()
+    return config.get("embedding_model_name") or config["model_name"]
+
+def load_embedding_model_path():
+    return "./models/" + load_embedding_model_name()
 
 def contar_tokens(texto):
     try:
@@ -40,6 +57,125 @@ def remove_repetidas(text):
             linhas.append(l)
     return '\n'.join(linhas[:10])
 
+class RemovedorRepetidas:
+    """
+    remove_repetidas aplicado conforme o texto chega: cada linha completa é
+    aceita ou encerra a resposta (linha repetida ou limite de linhas), então
+    dá para parar a geração cedo. O resultado final é o mesmo de remove_repetidas.
+    """
+
+    def __init__(self, max_linhas=10):
+        self.max_linhas = max_linhas
+        self.linhas = []
+        self._vistas = set()
+        self._parcial = ""
+        self.parado = False
+
+    def _linha(self, linha):
+        l = linha.strip()
+        if not l:
+            return
+        if l in self._vistas:
+            self.parado = True
+            return
+        self._vistas.add(l)
+        self.linhas.append(l)
+        if len(self.linhas) >= self.max_linhas:
+            self.parado = True
+
+    def adicionar(self, pedaco):
+        """Acrescenta um pedaço do texto gerado; False quando a geração já pode parar."""
+        self._parcial += pedaco
+        while "\n" in self._parcial and not self.parado:
+            linha, self._parcial = self._parcial.split("\n", 1)
+            self._linha(linha)
+        return not self.parado
+
+    @property
+    def texto(self):
+        """Texto para exibir agora: linhas aceitas mais a linha ainda incompleta."""
+        parcial = "" if self.parado else self._parcial.strip()
+        return "\n".join(self.linhas + ([parcial] if parcial else []))
+
+    def finalizar(self):
+        if not self.parado:
+            self._linha(self._parcial)
+        self._parcial = ""
+        return "\n".join(self.linhas)
+
+def gerar_stream(llm, prompt, metricas=None, max_linhas=10, prefixo=None, **kwargs):
+    """
+    Gera a resposta token a token, devolvendo o texto parcial a cada pedaço; o
+    último valor é o texto final. Com `max_linhas`, passa pelo filtro de
+    remove_repetidas (para na primeira linha repetida); com None, o texto sai
+    como o modelo gerou, igual à chamada sem stream. `llm` pode ser um
+    pool do registro (a instância fica emprestada até o fim) ou um Llama.
+    `metricas` recebe ttft_ms (tempo até o primeiro token), tokens, total_ms e finish_reason.
+    Com `prefixo` (início fixo do prompt), o estado dele vem do cache de
+    prefixos e prefill_poupado diz quantos tokens não foram reavaliados.
+    """
+    metricas = {} if metricas is None else metricas
+    metricas.update(ttft_ms=None, tokens=0, finish_reason=None, prefill_poupado=0)
+    filtro = RemovedorRepetidas(max_linhas) if max_linhas else None
+    texto = ""
+    emprestar = getattr(llm, "emprestar", None)
+    inicio = time.perf_counter()
+    with (emprestar() if emprestar else nullcontext(llm)) as instancia:
+        if prefixo and prompt.startswith(prefixo):
+            metricas["prefill_poupado"] = cache_de_prefixos().preparar(instancia, prefixo, prompt)
+        partes = instancia(prompt, stream=True, **kwargs)
+        try:
+            for parte in partes:
+                escolha = parte["choices"][0]
+                if metricas["ttft_ms"] is None:
+                    metricas["ttft_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+                metricas["tokens"] += 1
+                metricas["finish_reason"] = escolha.get("finish_reason") or metricas["finish_reason"]
+                if filtro is None:
+                    texto += escolha.get("text", "")
+                    yield texto
+                    continue
+                continuar = filtro.adicionar(escolha.get("text", ""))
+                yield filtro.texto
+                if not continuar:
+                    metricas["finish_reason"] = metricas["finish_reason"] or "interrompida"
+                    break
+        finally:
+            partes.close()
+    metricas["total_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+    yield filtro.finalizar() if filtro is not None else texto.strip()
+
+def avisar_pool_esgotado():
+    st.warning("Muitas perguntas em andamento; tente novamente em instantes.")
+    st.stop()
+
+def exibir_stream(resposta, renderizar):
+    """
+    Consome a resposta de gerar_stream (ou um texto pronto) chamando
+    renderizar(texto, parcial) a cada pedaço, com parcial=False no texto
+    final, que é o retorno. Sem instância livre no pool: aviso e st.stop().
+    """
+    if isinstance(resposta, str):
+        renderizar(resposta, False)
+        return resposta
+    texto = ""
+    try:
+        for texto in resposta:
+            renderizar(texto, True)
+    except PoolEsgotado:
+        avisar_pool_esgotado()
+    renderizar(texto, False)
+    return texto
+
+def exibir_metricas(metricas):
+    """Legenda com tempo até o primeiro token, tokens gerados e prefill reaproveitado."""
+    if metricas.get("ttft_ms") is None:
+        return
+    st.caption(
+        f"Primeiro token em {metricas['ttft_ms'] / 1000:.1f}s · {metricas['tokens']} tokens em "
+        f"{metricas['total_ms'] / 1000:.1f}s · {metricas['prefill_poupado']} tokens de prefill reaproveitados"
+    )
+
 def resposta_repetitiva(final_text):
     tokens = final_text.lower().split()
     if not tokens:
@@ -178,20 +314,29 @@ def busca_tabela_estruturada(pergunta, nome_csv_parcial="portaria_dpmf-srgps-mps
 
 class ChatManager:
     def __init__(self):
-        self.llm = Llama(
-            model_path=load_model_path(),
-            n_ctx=LLAMA_N_CTX,
-            embedding=True,
-            max_tokens=LLAMA_MAX_TOKENS
-        )
-        self.index = self.load_pickle("db/faiss.index")
-        self.documents = self.load_pickle("db/documents.pkl")
-        self.meta = self.load_pickle("db/meta.pkl")
+        # Modelos e índice vêm do registro do processo (import tardio: rag.registry importa este módulo)
+        from rag.registry import obter_modelo_geracao, obter_modelo_embedding, obter_retriever
+        from rag.index_manager import verificar_modelo_embedding
+        # Os mesmos pools do RAGManager: geração e embedding, cada um carregado uma vez por processo
+        self.llm = obter_modelo_geracao()
+        self.llm_embedding = obter_modelo_embedding()
+        # Uma geração só (e já carregada) para índice, documentos, re-rank e redução
+        self.geracao = obter_retriever("./db").geracao()
+        verificar_modelo_embedding(diretorio_atual("./db"), load_embedding_model_name(), self.llm_embedding.n_embd())
+        self.index, self.documents, self.meta, self.emb_dim = self.geracao.index, self.geracao.docs, self.geracao.meta, self.geracao.emb_dim
+        self.vetores_exatos, self.rerank_fator = self.geracao.vetores_exatos, self.geracao.rerank_fator
+        self.reducao = self.geracao.reducao
         self.cache = CacheManager(ttl=300)
 
-    def load_pickle(self, path):
-        with open(path, "rb") as f:
-            return pickle.load(f)
+    def prefixo_fixo(self, system_prompt, use_advanced, user_full_prompt):
+        """
+        Parte do prompt que não muda entre perguntas (vai para o cache de
+        prefixos). Prompt editado no modo avançado não entra: cada edição
+        viraria um estado novo no cache.
+        """
+        if use_advanced:
+            return None
+        return f"{system_prompt.strip()}\n\n"
 
     def build_prompt(self, contexto, user_prompt, system_prompt, use_advanced, user_full_prompt):
         if not isinstance(contexto, str):
@@ -205,7 +350,7 @@ class ChatManager:
         return prompt
 
     def run_chat_interface(self):
-        all_tags = sorted({t for m in self.meta for t in m["tags"]})
+        all_tags = self.meta.tags()
         selected_tags = st.multiselect("Filtrar por tags", all_tags)
         query = st.text_input("Pergunta:")
 
@@ -232,11 +377,11 @@ class ChatManager:
 
         if selected_tags:
             if st.button("Mostrar todos os chunks das tags selecionadas (debug)"):
-                for i, meta in enumerate(self.meta):
-                    if set(selected_tags).issubset(set(meta["tags"])):
-                        st.write(f"Chunk {i} - Arquivo: {meta['file']}")
-                        st.code(self.documents[i][:350] + "...", language="markdown")
-                        st.write(f"TAGS: {meta['tags']}")
+                for i in self.meta.ids_com_tags(selected_tags, todas=True):
+                    meta = self.meta[i]
+                    st.write(f"Chunk {i} - Arquivo: {meta['file']}")
+                    st.code(self.documents[i][:350] + "...", language="markdown")
+                    st.write(f"TAGS: {meta['tags']}")
 
         if st.button("Gerar Prévia do Prompt"):
             contexto = self.get_context_for_preview(query, selected_tags)
@@ -275,31 +420,27 @@ class ChatManager:
                 st.session_state["contexto_for_prompt"] = ""
 
     def get_context_for_preview(self, query, selected_tags, return_chunks=False):
-        filtered_idx = [i for i, m in enumerate(self.meta) if set(selected_tags).issubset(set(m["tags"]))]
-        if selected_tags and not filtered_idx:
+        if selected_tags:
+            filtered_idx, bitmap = self.meta.filtro_tags(selected_tags, todas=True)
+        if selected_tags and not len(filtered_idx):
             st.warning("Nenhum documento com as tags selecionadas.")
             return "", []
-        resp = self.llm.embed(query)
-        if isinstance(resp, dict):
-            if "data" in resp and isinstance(resp["data"], list):
-                emb_list = resp["data"][0].get("embedding") or resp["data"][0].get("data")
-            else:
-                emb_list = resp.get("embedding") or resp.get("data")
-        elif isinstance(resp, list):
-            emb_list = resp
+        # Mesmo cache do EmbeddingHandler: a pergunta enviada depois do preview não é embeddada de novo
+        cache = cache_de_perguntas(load_embedding_model_path())
+        emb = cache.obter(query)
+        if emb is None:
+            emb = extrair_embedding(self.llm_embedding.embed(query))  # embedding por token vira a média, como antes
+            cache.guardar(query, emb)
+        q_emb = aplicar_reducao(self.reducao, emb.reshape(1, -1))
+        if selected_tags:
+            D, I = buscar_filtrado(self.index, q_emb, 10, filtered_idx, bitmap, self.vetores_exatos, self.rerank_fator, self.reducao)
         else:
-            raise RuntimeError(f"Formato inesperado de embed(): {type(resp)}")
-        emb_arr = np.array(emb_list, dtype=np.float32)
-        dim = self.index.d
-        emb_arr = emb_arr.reshape(-1, dim)
-        q_emb = emb_arr.mean(axis=0, keepdims=True)
-        D, I = self.index.search(q_emb, 10)
-        raw_hits = I[0]
-        hits = [i for i in raw_hits if i in filtered_idx]
+            D, I = buscar(self.index, q_emb, 10, self.vetores_exatos, self.rerank_fator, self.reducao)
+        hits = [int(i) for i in I[0] if i >= 0]
         if not hits:
             st.warning("Nenhum conteúdo encontrado com as tags selecionadas para sua pergunta.")
             return "", []
-        contexto_chunks = [self.documents[i] for i in hits[:4]]
+        contexto_chunks = self.documents.get_many(hits[:4])
         for idx in hits[:4]:
             st.info(f"Chunk {idx} - TAGS: {self.meta[idx]['tags']} | Arquivo: {self.meta[idx]['file']}")
         contexto = "\n\n".join(contexto_chunks)
@@ -365,18 +506,19 @@ class ChatManager:
                 user = "anonimo"
                 log_prompt(user, prompt_final, query, selected_tags, use_advanced)
 
-                resposta = self.llm(prompt_final, max_tokens=LLAMA_MAX_TOKENS, temperature=0.3)
-                if isinstance(resposta, dict):
-                    final_text = resposta["choices"][0]["text"]
-                    finish_reason = resposta["choices"][0].get("finish_reason", "")
-                else:
-                    final_text = str(resposta)
-                    finish_reason = "unknown"
-                final_text = remove_repetidas(final_text)
                 if mostrou_tabela:
                     st.markdown("**Comentário/explicação:**")
-                st.code(final_text, language="markdown")
+                # Resposta aparece conforme é gerada; linhas repetidas já são filtradas no caminho
+                area = st.empty()
+                metricas = {}
+                prefixo = self.prefixo_fixo(system_prompt, use_advanced, user_full_prompt)
+                final_text = exibir_stream(
+                    gerar_stream(self.llm, prompt_final, metricas, prefixo=prefixo, max_tokens=LLAMA_MAX_TOKENS, temperature=0.3),
+                    lambda texto, parcial: area.code(texto, language="markdown")
+                )
+                finish_reason = metricas["finish_reason"] or "unknown"
                 st.info(f"Motivo de parada do modelo: **{finish_reason}**")
+                exibir_metricas(metricas)
                 if finish_reason == "length":
                     st.warning("⚠️ Resposta truncada por limite de tokens. Considere aumentar LLAMA_MAX_TOKENS ou diminuir contexto.")
 
@@ -394,15 +536,13 @@ class ChatManager:
                     if contexto_web:
                         prompt_web = self.build_prompt(contexto_web, user_prompt, system_prompt, use_advanced, user_full_prompt)
                         log_prompt(user, prompt_web, query, selected_tags, use_advanced)
-                        resposta_web = self.llm(prompt_web, max_tokens=LLAMA_MAX_TOKENS, temperature=0.3)
-                        if isinstance(resposta_web, dict):
-                            final_text_web = resposta_web["choices"][0]["text"]
-                            finish_reason_web = resposta_web["choices"][0].get("finish_reason", "")
-                        else:
-                            final_text_web = str(resposta_web)
-                            finish_reason_web = "unknown"
-                        final_text_web = remove_repetidas(final_text_web)
-                        st.code(final_text_web, language="markdown")
+                        area_web = st.empty()
+                        metricas_web = {}
+                        final_text_web = exibir_stream(
+                            gerar_stream(self.llm, prompt_web, metricas_web, prefixo=prefixo, max_tokens=LLAMA_MAX_TOKENS, temperature=0.3),
+                            lambda texto, parcial: area_web.code(texto, language="markdown")
+                        )
+                        finish_reason_web = metricas_web["finish_reason"] or "unknown"
                         st.info(f"Motivo de parada do modelo (web): **{finish_reason_web}**")
                         if finish_reason_web == "length":
                             st.warning("⚠️ Resposta web truncada por limite de tokens.")
@@ -1,5 +1,7 @@
 import streamlit as st
 from rag.rag_manager import RAGManager
+from rag.model_pool import PoolEsgotado
+from chat.chat_manager import exibir_stream, exibir_metricas, avisar_pool_esgotado
 import pandas as pd
 
 class ChatManager:
@@ -12,7 +14,11 @@ class ChatManager:
         pergunta = st.text_area("Digite sua pergunta:", height=100)
         if st.button("Enviar"):
             with st.spinner("Buscando resposta..."):
-                resposta, fontes, score = self.rag.responder_pergunta(pergunta, return_score=True)
+                metricas = {}
+                try:
+                    resposta, fontes, score = self.rag.responder_pergunta(pergunta, return_score=True, stream=True, metricas=metricas)
+                except PoolEsgotado:
+                    avisar_pool_esgotado()
 
                 lista = None
                 uf_nome = None
@@ -36,9 +42,12 @@ class ChatManager:
                     st.markdown(f"### {titulo}")
                     st.table(df_tabela)
                 else:
-                    st.markdown(f"**Resposta:**\n\n{resposta}")
+                    # Resposta em streaming: o texto aparece conforme os tokens saem do modelo
+                    area = st.empty()
+                    exibir_stream(resposta, lambda texto, parcial: area.markdown(f"**Resposta:**\n\n{texto}{'▌' if parcial else ''}"))
 
                 st.markdown("---")
                 st.markdown(f"**Fontes:** {', '.join(fontes)}")
                 st.markdown(f"**Confiabilidade estimada:** {round(score * 100, 1)}%")
+                exibir_metricas(metricas)
 
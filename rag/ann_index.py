@@ -0,0 +1,379 @@
+import os
+import json
+import math
+import pickle
+import threading
+import numpy as np
+import faiss
+
+INDEX_CONFIG_FILE = "config/index_config.json"
+TIPOS_INDEX = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+CODIFICACOES = ("float32", "float16", "sq8", "pq")
+_SQ_TIPOS = {"float16": "QT_fp16", "sq8": "QT_8bit"}
+DEFAULT_INDEX_CONFIG = {
+    "index_type": "flat",
+    "nlist": None,          # None = automático (~4·√n)
+    "nprobe": 16,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    "pq_m": 64,
+    "pq_nbits": 8,
+    "max_treino": 100000,   # vetores usados no treino (IVF/PQ)
+    "codificacao": "float32",  # como os vetores ficam no índice: float32, float16, sq8 ou pq
+    "rerank_fator": 0,      # > 0: busca k·fator candidatos e reordena com os vetores exatos (vectors.f32)
+    "reducao": None,        # None, "pca" ou "random": reduz a dimensão antes de indexar (e nas consultas)
+    "reducao_dim": 256,
+    "lexico": True,         # também constrói o índice invertido BM25 (lexico.npz) para busca híbrida
+    "rrf_k": 60,            # constante da reciprocal rank fusion entre BM25 e vetores
+}
+DEFAULT_LIMITE_FILTRO_EXATO = 8192  # até quantos ids um filtro por tag é resolvido por força bruta
+
+def carregar_config_index(path=INDEX_CONFIG_FILE, **sobrescritas):
+    config = dict(DEFAULT_INDEX_CONFIG)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    config.update({k: v for k, v in sobrescritas.items() if v is not None})
+    if config["index_type"] not in TIPOS_INDEX:
+        raise ValueError(f"index_type inválido: {config['index_type']} (opções: {', '.join(TIPOS_INDEX)})")
+    if config["codificacao"] not in CODIFICACOES:
+        raise ValueError(f"codificacao inválida: {config['codificacao']} (opções: {', '.join(CODIFICACOES)})")
+    if config["reducao"] not in (None, "pca", "random"):
+        raise ValueError(f"reducao inválida: {config['reducao']} (opções: pca, random)")
+    return config
+
+def usa_pq(config):
+    return config["index_type"] == "ivf_pq" or config.get("codificacao") == "pq"
+
+def e_compactado(config):
+    """True se o índice guarda os vetores com perda (não dá para reconstruí-los exatamente)."""
+    return usa_pq(config) or config.get("codificacao", "float32") != "float32" or bool(config.get("reducao"))
+
+def _nlist_auto(n, nlist=None):
+    # FAISS recomenda >= 39 pontos de treino por centróide
+    nlist = nlist or int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // 39))
+
+def _pq_m_divisor(dim, pq_m):
+    while dim % pq_m:
+        pq_m -= 1
+    return pq_m
+
+def resolver_config(n, dim, config):
+    """Ajusta a configuração ao tamanho do corpus (ex.: IVF/PQ sem dados suficientes para treinar viram flat)."""
+    config = dict(config)
+    tipo = config["index_type"]
+    if tipo in ("ivf_flat", "ivf_pq"):
+        config["nlist"] = _nlist_auto(n, config.get("nlist"))
+        if config["nlist"] < 2:
+            print(f"⚠️ Corpus pequeno demais para {tipo} ({n} vetores); usando flat.")
+            config["index_type"] = "flat"
+            return config
+        config["nprobe"] = min(config["nprobe"], config["nlist"])
+    if usa_pq(config):
+        config["pq_m"] = _pq_m_divisor(dim, config["pq_m"])
+        # Cada sub-quantizador precisa de ~39·2^nbits pontos de treino
+        nbits_max = int(math.log2(max(n // 39, 1)))
+        if nbits_max < 4:
+            if config["index_type"] == "ivf_pq":
+                print(f"⚠️ Vetores insuficientes para treinar PQ ({n}); usando ivf_flat.")
+                config["index_type"] = "ivf_flat"
+            else:
+                print(f"⚠️ Vetores insuficientes para treinar PQ ({n}); usando sq8.")
+                config["codificacao"] = "sq8"
+        else:
+            config["pq_nbits"] = min(config["pq_nbits"], nbits_max)
+    return config
+
+def criar_index_vazio(dim, config):
+    tipo = config["index_type"]
+    codificacao = config.get("codificacao", "float32")
+    qtype = getattr(faiss.ScalarQuantizer, _SQ_TIPOS[codificacao]) if codificacao in _SQ_TIPOS else None
+    if tipo == "flat":
+        if codificacao == "pq":
+            return faiss.IndexPQ(dim, config["pq_m"], config["pq_nbits"], faiss.METRIC_L2)
+        if qtype is not None:
+            return faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+        return faiss.IndexFlatL2(dim)
+    if tipo == "hnsw":
+        if codificacao == "pq":
+            index = faiss.IndexHNSWPQ(dim, config["pq_m"], config["hnsw_m"])
+        elif qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, config["hnsw_m"])
+        else:
+            index = faiss.IndexHNSWFlat(dim, config["hnsw_m"])
+        index.hnsw.efConstruction = config["ef_construction"]
+        return index
+    quantizer = faiss.IndexFlatL2(dim)
+    if tipo == "ivf_pq" or codificacao == "pq":
+        return faiss.IndexIVFPQ(quantizer, dim, config["nlist"], config["pq_m"], config["pq_nbits"])
+    if qtype is not None:
+        return faiss.IndexIVFScalarQuantizer(quantizer, dim, config["nlist"], qtype, faiss.METRIC_L2)
+    return faiss.IndexIVFFlat(quantizer, dim, config["nlist"], faiss.METRIC_L2)
+
+def treinar_index(index, vetores, config, seed=0, transformacao=None):
+    if index.is_trained:
+        return
+    n = len(vetores)
+    if n > config["max_treino"]:
+        amostra = np.random.default_rng(seed).choice(n, config["max_treino"], replace=False)
+        vetores = vetores[np.sort(amostra)]
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    if transformacao is not None:
+        vetores = transformacao.apply(vetores)
+    index.train(vetores)
+
+def aplicar_parametros_busca(index, config):
+    """Aplica nprobe (IVF) ou efSearch (HNSW) da configuração ao índice."""
+    tipo = config.get("index_type", "flat")
+    if tipo in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = config.get("nprobe", DEFAULT_INDEX_CONFIG["nprobe"])
+    elif tipo == "hnsw":
+        index.hnsw.efSearch = config.get("ef_search", DEFAULT_INDEX_CONFIG["ef_search"])
+    return index
+
+def construir_index(vetores, config):
+    """Cria, treina (se preciso) e popula o índice. Retorna (index, config_efetiva)."""
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    n, dim = vetores.shape
+    config = resolver_config(n, dim, config)
+    index = criar_index_vazio(dim, config)
+    treinar_index(index, vetores, config)
+    index.add(vetores)
+    aplicar_parametros_busca(index, config)
+    return index, config
+
+def tamanho_index(index):
+    return int(faiss.serialize_index(index).size)
+
+def reordenar_exato(consultas, I, vetores, k, transformacao=None):
+    """
+    Reordena os candidatos (I, como devolvido pelo FAISS) pela distância L2
+    exata calculada com os vetores em precisão total (ex.: vectors.f32 mapeado).
+    Com redução de dimensão, as consultas já vêm reduzidas e os candidatos são
+    reduzidos na hora (desfaz a perda da quantização, não a da projeção).
+    Retorna (D, I) com k colunas; posições sem candidato ficam com -1.
+    """
+    consultas = np.asarray(consultas, dtype=np.float32)
+    D_out = np.full((len(consultas), k), np.inf, dtype=np.float32)
+    I_out = np.full((len(consultas), k), -1, dtype=np.int64)
+    for q, candidatos in enumerate(I):
+        candidatos = np.unique(candidatos[candidatos >= 0])  # ordem crescente: leitura sequencial do memmap
+        if not len(candidatos):
+            continue
+        base = np.ascontiguousarray(vetores[candidatos], dtype=np.float32)
+        if transformacao is not None:
+            base = transformacao.apply(base)
+        diffs = base - consultas[q]
+        dist = np.einsum("ij,ij->i", diffs, diffs)
+        ordem = np.argsort(dist, kind="stable")[:k]
+        D_out[q, :len(ordem)] = dist[ordem]
+        I_out[q, :len(ordem)] = candidatos[ordem]
+    return D_out, I_out
+
+def buscar(index, consultas, k, vetores=None, rerank_fator=0, transformacao=None):
+    """index.search com re-rank exato opcional de k·rerank_fator candidatos."""
+    consultas = np.ascontiguousarray(consultas, dtype=np.float32)
+    if vetores is None or not rerank_fator:
+        return index.search(consultas, k)
+    _, I = index.search(consultas, k * rerank_fator)
+    return reordenar_exato(consultas, I, vetores, k, transformacao)
+
+def _parametros_busca(index, seletor):
+    """SearchParameters do tipo do índice com o seletor de ids, mantendo nprobe/efSearch configurados."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=seletor, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=seletor, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=seletor)
+
+_lock_mapa_direto = threading.Lock()
+
+def preparar_mapa_direto(index):
+    """
+    IVF precisa do direct map (id -> lista) para reconstruir vetores na busca
+    exata filtrada. Montado uma vez, na carga do índice e sob lock: o índice é
+    compartilhado entre as threads de busca.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return
+    with _lock_mapa_direto:
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+
+def _reconstruir(index, ids):
+    preparar_mapa_direto(index)  # no-op se carregar_index já montou
+    return index.reconstruct_batch(np.ascontiguousarray(ids, dtype=np.int64))
+
+class _Subconjunto:
+    """Vetores de `ids` fatiáveis em blocos: lidos dos exatos (reduzidos se preciso) ou reconstruídos do índice."""
+
+    def __init__(self, index, ids, vetores=None, transformacao=None):
+        self.index = index
+        self.ids = ids
+        self.vetores = vetores
+        self.transformacao = transformacao
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, fatia):
+        ids = self.ids[fatia]
+        if self.vetores is None:
+            return _reconstruir(self.index, ids)
+        base = np.ascontiguousarray(self.vetores[ids], dtype=np.float32)
+        return self.transformacao.apply(base) if self.transformacao is not None else base
+
+def buscar_exato_em(index, consultas, k, ids, vetores=None, transformacao=None):
+    """
+    Top-k só entre `ids`. Com os vetores exatos, força bruta neles (custo
+    proporcional a len(ids)). Sem eles, flat/HNSW buscam no próprio índice
+    com um IDSelectorBatch, sem copiar vetores; IVF (ou índice sem suporte a
+    seletor, ou HNSW que não achou hits suficientes) reconstrói os vetores dos ids.
+    Colunas sem candidato ficam com -1.
+    """
+    consultas = np.ascontiguousarray(consultas, dtype=np.float32)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if vetores is None and len(ids) and faiss.try_extract_index_ivf(index) is None:
+        seletor = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        try:
+            D, I = index.search(consultas, k, params=_parametros_busca(index, seletor))
+        except RuntimeError:
+            pass  # ex.: IndexPQ sem suporte a seletor
+        else:
+            if (I[:, :min(k, len(ids))] >= 0).all():
+                return D, I
+    D_out = np.full((len(consultas), k), np.inf, dtype=np.float32)
+    I_out = np.full((len(consultas), k), -1, dtype=np.int64)
+    if len(ids):
+        D, posicoes = vizinhos_exatos(consultas, _Subconjunto(index, ids, vetores, transformacao), k)
+        D_out[:, :D.shape[1]] = D
+        I_out[:, :D.shape[1]] = ids[posicoes]
+    return D_out, I_out
+
+def buscar_filtrado(index, consultas, k, ids, bitmap=None, vetores=None, rerank_fator=0, transformacao=None, limite_exato=DEFAULT_LIMITE_FILTRO_EXATO):
+    """
+    Top-k restrito a `ids` (ordenados, ex.: os chunks de uma tag), filtrando
+    dentro da busca em vez de depois dela. Até `limite_exato` ids a busca é
+    a de buscar_exato_em (só no subconjunto); acima disso vai ao índice com um
+    IDSelectorBitmap (`bitmap`: um bit por id, little-endian). Se o índice
+    aproximado devolver menos de min(k, len(ids)) hits, completa com buscar_exato_em.
+    """
+    consultas = np.ascontiguousarray(consultas, dtype=np.float32)
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) > limite_exato:
+        if bitmap is None:
+            mascara = np.zeros(index.ntotal, dtype=bool)
+            mascara[ids] = True
+            bitmap = np.packbits(mascara, bitorder="little")
+        seletor = faiss.IDSelectorBitmap(index.ntotal, faiss.swig_ptr(bitmap))
+        rerank = vetores is not None and rerank_fator
+        try:
+            D, I = index.search(consultas, k * rerank_fator if rerank else k, params=_parametros_busca(index, seletor))
+        except RuntimeError:
+            pass  # índice sem suporte a seletor (ex.: IndexPQ): vai para a busca exata
+        else:
+            if rerank:
+                D, I = reordenar_exato(consultas, I, vetores, k, transformacao)
+            if (I[:, :min(k, len(ids))] >= 0).all():
+                return D, I
+    return buscar_exato_em(index, consultas, k, ids, vetores, transformacao)
+
+def vizinhos_exatos(consultas, vetores, k, bloco=8192):
+    """Top-k exato por força bruta, em blocos (serve para memmaps maiores que a RAM)."""
+    consultas = np.asarray(consultas, dtype=np.float32)
+    norma_q = (consultas ** 2).sum(1)[:, None]
+    melhores_D = np.full((len(consultas), 0), np.inf, dtype=np.float32)
+    melhores_I = np.zeros((len(consultas), 0), dtype=np.int64)
+    for inicio in range(0, len(vetores), bloco):
+        base = np.asarray(vetores[inicio:inicio + bloco], dtype=np.float32)
+        D = norma_q - 2 * consultas @ base.T + (base ** 2).sum(1)[None, :]
+        I = np.broadcast_to(np.arange(inicio, inicio + len(base)), D.shape)
+        D = np.concatenate([melhores_D, D], axis=1)
+        I = np.concatenate([melhores_I, I], axis=1)
+        top = np.argsort(D, axis=1, kind="stable")[:, :k]
+        melhores_D = np.take_along_axis(D, top, axis=1)
+        melhores_I = np.take_along_axis(I, top, axis=1)
+    return melhores_D, melhores_I
+
+def recall_at_k(I, referencia):
+    k = referencia.shape[1]
+    return float(np.mean([len(set(r[:k]) & set(g)) / k for r, g in zip(I, referencia)]))
+
+def avaliar_compressao(index, vetores, config, n_consultas=100, k=10, seed=0, transformacao=None):
+    """
+    Compara o índice compactado com a busca exata sobre vectors.f32: bytes
+    economizados e recall@k sem e com re-rank. Consultas são vetores do corpus
+    com um pouco de ruído (reduzidas por `transformacao` antes de ir ao índice).
+    """
+    n, dim = vetores.shape
+    rng = np.random.default_rng(seed)
+    amostra = np.sort(rng.choice(n, min(n_consultas, n), replace=False))
+    consultas = np.asarray(vetores[amostra], dtype=np.float32)
+    consultas = consultas + rng.normal(0, float(np.std(consultas)) * 0.1, consultas.shape).astype(np.float32)
+    k = min(k, n)
+    _, referencia = vizinhos_exatos(consultas, vetores, k)
+    if transformacao is not None:
+        consultas = transformacao.apply(consultas)
+    _, I = index.search(consultas, k)
+    avaliacao = {
+        "bytes_float32": n * dim * 4,
+        "bytes_index": tamanho_index(index),
+        "recall": recall_at_k(I, referencia),
+        "k": k
+    }
+    if config.get("rerank_fator"):
+        _, I = buscar(index, consultas, k, vetores, config["rerank_fator"], transformacao)
+        avaliacao["recall_rerank"] = recall_at_k(I, referencia)
+    return avaliacao
+
+def salvar_faiss(index, path):
+    """Grava o índice no formato nativo do FAISS (escrita atômica via arquivo temporário)."""
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+def faiss_e_pickle_legado(path):
+    # Pickles (protocolo >= 2) começam com 0x80; o formato nativo começa com o fourcc do índice
+    with open(path, "rb") as f:
+        return f.read(1) == b"\x80"
+
+def ler_faiss_com_modo(path, mmap=True):
+    """
+    Como ler_faiss, mas retorna (index, modo), com modo em "pickle", "mmap"
+    (tudo mapeado), "mmap_listas" (só as listas invertidas mapeadas) ou "memoria".
+
+    Índices IVF não abrem com IO_FLAG_MMAP_IFC: o FAISS só mapeia as listas
+    invertidas lendo de um arquivo comum, e com esse flag a leitura passa por
+    um buffer mapeado ("mmap only supported for File objects"). Para eles vale
+    a segunda tentativa, só com IO_FLAG_MMAP: as listas (o grosso do índice)
+    ficam mapeadas e compartilhadas, o quantizador grosso vai para a memória.
+    FAISS antigos sem leitura mapeada caem na carga completa.
+    """
+    if faiss_e_pickle_legado(path):
+        print(f"⚠️ {path} está no formato pickle antigo; rode o indexador para converter.")
+        with open(path, "rb") as f:
+            return pickle.load(f), "pickle"
+    if mmap:
+        tentativas = [("mmap_listas", faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP)]
+        if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            tentativas.insert(0, ("mmap", faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC))
+        erros = []
+        for modo, flags in tentativas:
+            try:
+                return faiss.read_index(path, flags), modo
+            except RuntimeError as e:
+                erros.append(str(e).strip().splitlines()[-1] if str(e).strip() else repr(e))
+        print(f"⚠️ Leitura mapeada de {path} indisponível ({'; '.join(erros)}); carregando em memória.")
+    return faiss.read_index(path), "memoria"
+
+def ler_faiss(path, mmap=True):
+    """
+    Abre o índice somente leitura e mapeado em memória, para que vários
+    processos compartilhem a mesma cópia no page cache (nos IVF, só as listas
+    invertidas; ver ler_faiss_com_modo). Lê também o formato antigo (faiss.index pickled).
+    """
+    return ler_faiss_com_modo(path, mmap)[0]
@@ -0,0 +1,66 @@
+"""
+Responde um lote de perguntas de uma vez (regressão, integração com outros sistemas).
+
+    python -m rag.batch_qa perguntas.jsonl -o respostas.jsonl
+    python -m rag.batch_qa perguntas.csv -o respostas.jsonl --tags portaria_unidades_txt
+
+Entrada JSONL: um objeto por linha com "pergunta" (ou "question") e,
+opcionalmente, "id" e "tags" (lista). CSV: cabeçalho com as mesmas colunas;
+tags separadas por ";". Saída: um JSON por linha com resposta, fontes,
+score, hits e tempos por etapa.
+"""
+import os
+import csv
+import json
+import time
+import argparse
+from rag.rag_manager import RAGManager, DEFAULT_LOTE_PERGUNTAS
+
+def _normalizar(registro, n, tags_padrao):
+    pergunta = (registro.get("pergunta") or registro.get("question") or "").strip()
+    tags = registro.get("tags") or tags_padrao
+    if isinstance(tags, str):
+        tags = [t.strip() for t in tags.split(";") if t.strip()]
+    return {"id": registro.get("id") or n, "pergunta": pergunta, "tags": tags or None}
+
+def ler_perguntas(path, tags_padrao=None):
+    """Lê perguntas de JSONL ou CSV (pela extensão); linhas sem pergunta são ignoradas."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            registros = list(csv.DictReader(f))
+        else:
+            registros = [json.loads(linha) for linha in f if linha.strip()]
+    perguntas = [_normalizar(r, n, tags_padrao) for n, r in enumerate(registros, 1)]
+    return [p for p in perguntas if p["pergunta"]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entrada", help="Arquivo .jsonl ou .csv com as perguntas.")
+    parser.add_argument("-o", "--saida", required=True, help="Arquivo JSONL de saída.")
+    parser.add_argument("--tags", help="Tags padrão (separadas por ;) para perguntas sem tags próprias.")
+    parser.add_argument("-k", type=int, default=20, help="Chunks recuperados por pergunta.")
+    parser.add_argument("--lote", type=int, default=DEFAULT_LOTE_PERGUNTAS, help="Perguntas embeddadas e buscadas juntas.")
+    parser.add_argument("--temperature", type=float, default=0.5)
+    args = parser.parse_args()
+
+    perguntas = ler_perguntas(args.entrada, args.tags)
+    print(f"📥 {len(perguntas)} perguntas lidas de {args.entrada}")
+
+    rag = RAGManager()
+    totais = {}
+    inicio = time.perf_counter()
+    with open(args.saida, "w", encoding="utf-8") as saida:
+        for n, registro in enumerate(rag.responder_lote(perguntas, k=args.k, temperature=args.temperature, lote=args.lote), 1):
+            saida.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+            saida.flush()
+            for etapa, ms in registro["tempos"].items():
+                totais[etapa] = totais.get(etapa, 0.0) + ms
+            print(f"✅ {n}/{len(perguntas)}")
+
+    segundos = time.perf_counter() - inicio
+    print(f"⚡ {len(perguntas)} perguntas em {segundos:.1f}s ({len(perguntas) / max(segundos, 1e-9):.2f}/s)")
+    for etapa, ms in totais.items():
+        print(f"   {etapa:<14} {ms / 1000:>8.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import time
+import numpy as np
+import faiss
+from rag.ann_index import vizinhos_exatos, recall_at_k
+
+REDUCAO_FILE = "reducao.vt"
+TIPOS_REDUCAO = ("pca", "random")
+
+def ajustar_reducao(vetores, tipo, dim_saida, max_treino=100000, seed=0):
+    """
+    Ajusta uma redução de dimensionalidade (PCA ou projeção aleatória ortonormal)
+    numa amostra de `vetores`. Retorna a transformação FAISS já treinada.
+    """
+    n, dim = vetores.shape
+    if tipo not in TIPOS_REDUCAO:
+        raise ValueError(f"Redução inválida: {tipo} (opções: {', '.join(TIPOS_REDUCAO)})")
+    if n > max_treino:
+        amostra = np.random.default_rng(seed).choice(n, max_treino, replace=False)
+        vetores = vetores[np.sort(amostra)]
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    if tipo == "pca":
+        transformacao = faiss.PCAMatrix(dim, dim_saida)
+    else:
+        transformacao = faiss.RandomRotationMatrix(dim, dim_saida)
+        transformacao.init(seed)
+    transformacao.train(vetores)
+    return transformacao
+
+def aplicar_reducao(transformacao, vetores):
+    """Aplica a redução (se houver) a uma matriz (n, dim) ou a um vetor (dim,)."""
+    if transformacao is None:
+        return vetores
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    if vetores.ndim == 1:
+        return transformacao.apply(vetores[None, :])[0]
+    return transformacao.apply(vetores)
+
+def variancia_mantida(transformacao, vetores):
+    """Fração da variância total da amostra que sobrevive à redução."""
+    vetores = np.asarray(vetores, dtype=np.float32)
+    total = float(vetores.var(axis=0).sum())
+    reduzidos = aplicar_reducao(transformacao, vetores)
+    return float(reduzidos.var(axis=0).sum()) / total if total else 1.0
+
+def salvar_reducao(transformacao, db_dir):
+    """Grava a transformação ao lado do índice; sem transformação, remove a antiga."""
+    path = os.path.join(db_dir, REDUCAO_FILE)
+    if transformacao is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = path + ".tmp"
+    faiss.write_VectorTransform(transformacao, tmp_path)
+    os.replace(tmp_path, path)
+
+def carregar_reducao(db_dir="./db"):
+    path = os.path.join(db_dir, REDUCAO_FILE)
+    if not os.path.exists(path):
+        return None
+    return faiss.read_VectorTransform(path)
+
+def _latencia_ms(index, consultas):
+    inicio = time.perf_counter()
+    for q in consultas:
+        index.search(q[None, :], 10)
+    return (time.perf_counter() - inicio) * 1000 / len(consultas)
+
+def avaliar_reducao(transformacao, vetores, n_consultas=100, k=10, max_base=20000, seed=0):
+    """
+    Mede, numa amostra do corpus, a variância mantida, o recall@k da busca
+    reduzida contra a busca exata em dimensão cheia e a latência (flat) antes/depois.
+    """
+    n = len(vetores)
+    rng = np.random.default_rng(seed)
+    base = np.asarray(vetores[np.sort(rng.choice(n, min(n, max_base), replace=False))], dtype=np.float32)
+    consultas = base[rng.choice(len(base), min(n_consultas, len(base)), replace=False)]
+    consultas = consultas + rng.normal(0, float(np.std(consultas)) * 0.1, consultas.shape).astype(np.float32)
+    k = min(k, len(base))
+
+    base_reduzida = aplicar_reducao(transformacao, base)
+    consultas_reduzidas = aplicar_reducao(transformacao, consultas)
+    _, referencia = vizinhos_exatos(consultas, base, k)
+    _, I = vizinhos_exatos(consultas_reduzidas, base_reduzida, k)
+
+    original = faiss.IndexFlatL2(base.shape[1])
+    original.add(base)
+    reduzido = faiss.IndexFlatL2(base_reduzida.shape[1])
+    reduzido.add(base_reduzida)
+    return {
+        "variancia_mantida": variancia_mantida(transformacao, base),
+        "recall": recall_at_k(I, referencia),
+        "k": k,
+        "n_base": len(base),
+        "ms_original": _latencia_ms(original, consultas),
+        "ms_reduzido": _latencia_ms(reduzido, consultas_reduzidas),
+    }
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import argparse
+import hashlib
+import numpy as np
+
+CACHE_DIR = "./db/embedding_cache"
+
+def _slug_modelo(model_name):
+    base = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)[:80]
+    return f"{base}-{hashlib.sha256(model_name.encode('utf-8')).hexdigest()[:8]}"
+
+class EmbeddingCache:
+    """
+    Cache persistente de embeddings chaveado por (chunk_hash, modelo).
+    Cada modelo tem seu diretório com um arquivo float32 append-only
+    (vectors.f32) e a lista de hashes na mesma ordem (keys.txt):
+    a linha i de keys.txt é o hash do vetor i.
+    """
+
+    def __init__(self, model_name, cache_dir=CACHE_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, _slug_modelo(model_name))
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.keys_path = os.path.join(self.dir, "keys.txt")
+        self.info_path = os.path.join(self.dir, "info.json")
+        self.dim = None
+        self.offsets = {}
+        self.n_rows = 0
+        self.hits = 0
+        self.misses = 0
+        self._carregar()
+
+    def _carregar(self):
+        if not os.path.exists(self.info_path):
+            return
+        with open(self.info_path, "r", encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+        chaves = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                chaves = f.read().split()
+        n_vetores = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        self.n_rows = min(len(chaves), n_vetores)
+        if self.n_rows != len(chaves) or self.n_rows != n_vetores:
+            # Escrita interrompida no meio: descarta a cauda desalinhada
+            print(f"⚠️ Cache de embeddings com cauda incompleta; truncando para {self.n_rows} vetores.")
+            self._reescrever_chaves(chaves[:self.n_rows])
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(self.n_rows * 4 * self.dim)
+        for row, chave in enumerate(chaves[:self.n_rows]):
+            self.offsets[chave] = row
+
+    def _reescrever_chaves(self, chaves):
+        with open(self.keys_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{c}\n" for c in chaves))
+
+    def contem(self, chunk_hash):
+        return chunk_hash in self.offsets
+
+    def _vetores(self):
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.n_rows, self.dim))
+
+    def buscar(self, hashes):
+        """
+        Retorna (vetores, posicoes_hit, posicoes_miss): a matriz com os vetores
+        encontrados (na ordem de posicoes_hit) e as posições que faltam calcular.
+        """
+        posicoes_hit, rows, posicoes_miss = [], [], []
+        for i, h in enumerate(hashes):
+            row = self.offsets.get(h)
+            if row is None:
+                posicoes_miss.append(i)
+            else:
+                posicoes_hit.append(i)
+                rows.append(row)
+        self.hits += len(posicoes_hit)
+        self.misses += len(posicoes_miss)
+        if not rows:
+            return np.zeros((0, self.dim or 0), dtype=np.float32), posicoes_hit, posicoes_miss
+        return np.array(self._vetores()[rows]), posicoes_hit, posicoes_miss
+
+    def adicionar(self, hashes, vetores):
+        vetores = np.asarray(vetores, dtype=np.float32)
+        if len(hashes) == 0:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        if self.dim is None:
+            self.dim = int(vetores.shape[1])
+            with open(self.info_path, "w", encoding="utf-8") as f:
+                json.dump({"model_name": self.model_name, "dim": self.dim}, f, indent=2, ensure_ascii=False)
+        elif vetores.shape[1] != self.dim:
+            raise ValueError(f"Dimensão {vetores.shape[1]} diferente da do cache ({self.dim}) para {self.model_name}.")
+        novos = [i for i, h in enumerate(hashes) if h not in self.offsets]
+        if not novos:
+            return
+        # Vetores antes das chaves: uma queda no meio deixa só cauda descartável
+        with open(self.vectors_path, "ab") as f:
+            f.write(vetores[novos].tobytes())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{hashes[i]}\n" for i in novos))
+        for i in novos:
+            self.offsets[hashes[i]] = self.n_rows
+            self.n_rows += 1
+
+    def compactar(self, hashes_vivos=None):
+        """Reescreve o cache só com os hashes vivos (ou todos, sem duplicatas). Retorna vetores removidos."""
+        if self.dim is None:
+            return 0
+        chaves = sorted(
+            (row, h) for h, row in self.offsets.items()
+            if hashes_vivos is None or h in hashes_vivos
+        )
+        vetores = self._vetores()
+        tmp_vectors, tmp_keys = self.vectors_path + ".tmp", self.keys_path + ".tmp"
+        with open(tmp_vectors, "wb") as f:
+            for inicio in range(0, len(chaves), 4096):
+                rows = [row for row, _ in chaves[inicio:inicio + 4096]]
+                f.write(np.asarray(vetores[rows], dtype=np.float32).tobytes())
+        with open(tmp_keys, "w", encoding="utf-8") as f:
+            f.write("".join(f"{h}\n" for _, h in chaves))
+        del vetores
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+        removidos = self.n_rows - len(chaves)
+        self.offsets = {h: row for row, (_, h) in enumerate(chaves)}
+        self.n_rows = len(chaves)
+        return removidos
+
+    def stats(self):
+        consultas = self.hits + self.misses
+        return {
+            "model_name": self.model_name,
+            "entradas": len(self.offsets),
+            "linhas": self.n_rows,
+            "bytes": self.n_rows * 4 * (self.dim or 0),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / consultas, 4) if consultas else 0.0,
+        }
+
+def main():
+    from chat.chat_manager import load_embedding_model_name
+    from rag.index_manager import carregar_index
+
+    parser = argparse.ArgumentParser(description="Cache persistente de embeddings de chunks.")
+    parser.add_argument("comando", choices=["stats", "compactar"])
+    parser.add_argument("--manter-tudo", action="store_true", help="Na compactação, mantém hashes fora do índice atual (só remove duplicatas).")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(load_embedding_model_name())
+    if args.comando == "compactar":
+        hashes_vivos = None
+        if not args.manter_tudo:
+            _, _, meta, _ = carregar_index()
+            hashes_vivos = {m["chunk_hash"] for m in meta}
+        antes = cache.stats()["bytes"]
+        removidos = cache.compactar(hashes_vivos)
+        print(f"🧹 {removidos} vetores removidos; {antes - cache.stats()['bytes']} bytes liberados.")
+    print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from llama_cpp import Llama
+
+DEFAULT_EMBEDDING_WORKERS = 1
+DEFAULT_BATCH_TOKENS = 2048
+
+# Instância do modelo de cada processo worker (criada no initializer do pool)
+_worker_model = None
+
+def extrair_embedding(resp):
+    """
+    Normaliza a saída de Llama.embed() para um vetor float32.
+    Se o modelo devolver um embedding por token, faz mean-pooling.
+    """
+    emb = resp
+    if isinstance(resp, dict):
+        if "data" in resp and isinstance(resp["data"], list):
+            emb = resp["data"][0].get("embedding") or resp["data"][0].get("data")
+        else:
+            emb = resp.get("embedding") or resp.get("data")
+    if emb is None or len(emb) == 0:
+        raise ValueError("Embedding retornado em formato inesperado.")
+    arr = np.asarray(emb, dtype=np.float32)
+    if arr.ndim == 2:
+        arr = arr.mean(axis=0)
+    return arr
+
+def _carregar_modelo(model_path, batch_tokens, n_threads=None, vocab_only=False):
+    return Llama(
+        model_path=model_path,
+        embedding=True,
+        n_ctx=batch_tokens,
+        n_batch=batch_tokens,
+        n_ubatch=batch_tokens,
+        n_threads=n_threads,
+        vocab_only=vocab_only,
+        verbose=False
+    )
+
+def _embed_lote(model, textos):
+    """Embeda um lote numa única chamada; se o lote falhar, tenta texto a texto."""
+    try:
+        resp = model.embed(list(textos))
+        return [extrair_embedding(r) for r in resp]
+    except Exception as e:
+        print(f"⚠️ Lote de {len(textos)} chunks falhou ({e}); refazendo um a um.")
+    vetores = []
+    for texto in textos:
+        try:
+            vetores.append(extrair_embedding(model.embed(texto)))
+        except Exception as e:
+            print(f"❌ Erro ao gerar embedding: {e}")
+            vetores.append(None)
+    return vetores
+
+def _init_worker(model_path, batch_tokens, n_threads):
+    global _worker_model
+    _worker_model = _carregar_modelo(model_path, batch_tokens, n_threads)
+
+def _worker_embed(textos):
+    return _embed_lote(_worker_model, textos)
+
+class EmbeddingEngine:
+    """
+    Gera embeddings em lotes limitados por tokens, opcionalmente distribuídos
+    num pool de processos (cada worker com sua própria instância Llama).
+    A saída sempre respeita a ordem dos textos de entrada.
+    """
+
+    def __init__(self, model_path, workers=DEFAULT_EMBEDDING_WORKERS, batch_tokens=DEFAULT_BATCH_TOKENS, n_threads=None, model=None):
+        self.model_path = model_path
+        self.workers = max(1, int(workers))
+        self.batch_tokens = int(batch_tokens)
+        self.n_threads = n_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.stats = {}
+        self._pool = None
+        if self.workers == 1:
+            self.model = model or _carregar_modelo(model_path, self.batch_tokens, self.n_threads)
+            self._tokenizer = self.model
+        else:
+            # Processo principal só precisa do vocabulário para contar tokens
+            self.model = None
+            self._tokenizer = _carregar_modelo(model_path, self.batch_tokens, vocab_only=True)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_path, self.batch_tokens, self.n_threads)
+            )
+        return self._pool
+
+    def contar_tokens(self, texto):
+        n = len(self._tokenizer.tokenize(texto.encode("utf-8"), add_bos=True))
+        return min(n, self.batch_tokens)  # embed() trunca no n_batch
+
+    def montar_lotes(self, textos):
+        """Agrupa textos consecutivos em lotes de até batch_tokens tokens. Retorna [(inicio, fim, tokens)]."""
+        lotes = []
+        inicio, total = 0, 0
+        for i, texto in enumerate(textos):
+            n = self.contar_tokens(texto)
+            if i > inicio and total + n > self.batch_tokens:
+                lotes.append((inicio, i, total))
+                inicio, total = i, 0
+            total += n
+        if inicio < len(textos):
+            lotes.append((inicio, len(textos), total))
+        return lotes
+
+    def embed(self, textos, max_em_voo=None):
+        """
+        Retorna (embeddings, falhas): matriz [n_ok, dim] na ordem de `textos`
+        e a lista de posições cujo embedding falhou (ausentes da matriz).
+        """
+        inicio_t = time.time()
+        lotes = self.montar_lotes(textos)
+        resultados = [None] * len(textos)
+        total_tokens = 0
+
+        if self.workers == 1:
+            for n, (ini, fim, tokens) in enumerate(lotes, 1):
+                resultados[ini:fim] = _embed_lote(self.model, textos[ini:fim])
+                total_tokens += tokens
+                print(f"🔹 Lote {n}/{len(lotes)}: chunks {ini}-{fim - 1} ({tokens} tokens)")
+        else:
+            # Limita lotes em voo para não serializar o corpus inteiro de uma vez
+            max_em_voo = max_em_voo or self.workers * 2
+            pool = self._get_pool()
+            pendentes = deque()
+            for n, (ini, fim, tokens) in enumerate(lotes, 1):
+                pendentes.append((n, ini, fim, tokens, pool.submit(_worker_embed, textos[ini:fim])))
+                while len(pendentes) >= max_em_voo or (pendentes and n == len(lotes)):
+                    n_p, ini_p, fim_p, tokens_p, fut = pendentes.popleft()
+                    resultados[ini_p:fim_p] = fut.result()
+                    total_tokens += tokens_p
+                    print(f"🔹 Lote {n_p}/{len(lotes)}: chunks {ini_p}-{fim_p - 1} ({tokens_p} tokens)")
+
+        falhas = [i for i, v in enumerate(resultados) if v is None]
+        vetores = [v for v in resultados if v is not None]
+        segundos = max(time.time() - inicio_t, 1e-9)
+        self.stats = {
+            "chunks": len(vetores),
+            "tokens": total_tokens,
+            "segundos": round(segundos, 2),
+            "chunks_s": round(len(vetores) / segundos, 2),
+            "tokens_s": round(total_tokens / segundos, 2),
+        }
+        print(
+            f"⚡ {self.stats['chunks']} embeddings em {self.stats['segundos']}s "
+            f"({self.stats['chunks_s']} chunks/s, {self.stats['tokens_s']} tokens/s, "
+            f"{self.workers} worker(s), lotes de até {self.batch_tokens} tokens)"
+        )
+        if not vetores:
+            return np.zeros((0, 0), dtype=np.float32), falhas
+        return np.vstack(vetores).astype(np.float32), falhas
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
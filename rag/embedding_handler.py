@@ -1,37 +1,61 @@
 import numpy as np
-from llama_cpp import Llama
-from chat.chat_manager import load_model_path  # ou defina diretamente o caminho do modelo
+from chat.chat_manager import load_embedding_model_name, load_embedding_model_path
+from rag.generations import diretorio_atual
+from rag.embedding_engine import EmbeddingEngine, extrair_embedding
+from rag.query_cache import cache_de_perguntas
+from rag.index_manager import verificar_modelo_embedding
+from rag.registry import obter_modelo_embedding
 
 class EmbeddingHandler:
-    def __init__(self):
-        model_path = load_model_path()
-        self.model = Llama(
-            model_path=model_path,
-            embedding=True,
-            n_ctx=2048  # ✅ aumenta a janela de contexto
-        )
+    def __init__(self, db_dir="./db"):
+        # Modelo de embedding (embedding_model_name no model_config.json; sem ele, o de geração),
+        # carregado uma vez por processo e compartilhado entre handlers
+        model_path = self.model_path = load_embedding_model_path()
+        self.model = obter_modelo_embedding()
+        # Falha já na carga se o índice publicado foi feito com outro modelo
+        verificar_modelo_embedding(diretorio_atual(db_dir), load_embedding_model_name(), self.model.n_embd())
+        # Embeddings saem brutos: a redução de dimensão (PCA/projeção) é aplicada pelo
+        # Retriever com a da mesma geração que ele busca
+        self.db_dir = db_dir
+        self._engine = None  # criado no primeiro embeddar_lote, reaproveitando self.model
+        # Cache de embeddings de perguntas (LRU do processo + sqlite em db/), compartilhado com o ChatManager
+        self.cache = cache_de_perguntas(model_path)
 
     def embeddar(self, texto):
         try:
-            resposta = self.model.embed(texto)
-            emb = None
-
-            if isinstance(resposta, dict) and "data" in resposta:
-                emb = resposta["data"][0].get("embedding") or resposta["data"][0].get("data")
-            elif isinstance(resposta, dict) and "embedding" in resposta:
-                emb = resposta["embedding"]
-            elif isinstance(resposta, list):
-                if isinstance(resposta[0], float):
-                    emb = resposta
-                elif isinstance(resposta[0], list):
-                    emb = resposta[0]
-
+            # Pergunta repetida (ou já embeddada no preview) não passa pelo modelo
+            emb = self.cache.obter(texto)
             if emb is None:
-                raise ValueError("Embedding retornado em formato inesperado.")
-
-            return np.array(emb, dtype=np.float32)
+                emb = extrair_embedding(self.model.embed(texto))
+                self.cache.guardar(texto, emb)
+            return emb
 
         except Exception as e:
             print(f"Erro ao gerar embedding com LLaMA: {e}")
-            return np.zeros(4096, dtype=np.float32)
+            return np.zeros(self.model.n_embd(), dtype=np.float32)
+
+    def embeddar_lote(self, textos):
+        """
+        Embeddings de vários textos em lotes por tokens (poucas chamadas ao
+        modelo; os que estão no cache nem vão a ele), brutos como os do embeddar.
+        Retorna (matriz (n, dim), falhas): as posições que falharam ficam com
+        vetor zero, como no embeddar.
+        """
+        brutos = [self.cache.obter(texto) for texto in textos]
+        misses = [p for p, emb in enumerate(brutos) if emb is None]
+        falhas = []
+        if misses:
+            if self._engine is None:
+                self._engine = EmbeddingEngine(self.model_path, batch_tokens=self.model.n_batch, model=self.model)
+            vetores, falhas_miss = self._engine.embed([textos[p] for p in misses])
+            falhas = [misses[f] for f in falhas_miss]
+            for p, emb in zip(sorted(set(misses) - set(falhas)), vetores):
+                brutos[p] = emb
+                self.cache.guardar(textos[p], emb)
+        ok = [p for p, emb in enumerate(brutos) if emb is not None]
+        dim = len(brutos[ok[0]]) if ok else self.model.n_embd()
+        saida = np.zeros((len(textos), dim), dtype=np.float32)
+        if ok:
+            saida[ok] = np.vstack([brutos[p] for p in ok])
+        return saida, falhas
 
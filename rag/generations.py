@@ -0,0 +1,221 @@
+"""
+Gerações do índice: cada indexação grava um diretório novo em db/geracoes/
+e só no fim o ponteiro db/CURRENT passa a apontar para ele (troca atômica).
+Leitores registram um lease (db/leases/<geração>.<id>) enquanto usam uma
+geração, e o indexador enquanto grava a sua; gerações antigas sem lease vivo
+são apagadas, menos a de um journal de indexação que ainda pode ser retomado.
+
+Sem db/CURRENT vale o layout antigo, com os arquivos direto em db/.
+"""
+import os
+import json
+import argparse
+import time
+import uuid
+import shutil
+import socket
+from datetime import datetime
+
+GERACOES_DIR = "geracoes"
+CURRENT_FILE = "CURRENT"
+LEASES_DIR = "leases"
+JOURNAL_FILE = "index_journal.json"  # checkpoint do indexador (rag.index_manager)
+DEFAULT_LEASE_TTL = 900       # segundos sem renovação até um lease ser considerado abandonado
+DEFAULT_INTERVALO_CHECAGEM = 1.0  # segundos entre consultas ao ponteiro
+
+def _sincronizar_diretorio(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def geracao_atual(db_dir):
+    """Nome da geração publicada, ou None no layout antigo."""
+    try:
+        with open(os.path.join(db_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def diretorio_geracao(db_dir, nome):
+    return os.path.join(db_dir, GERACOES_DIR, nome)
+
+def diretorio_atual(db_dir):
+    """Diretório com os arquivos do índice em uso (a geração atual ou o próprio db_dir)."""
+    nome = geracao_atual(db_dir)
+    return diretorio_geracao(db_dir, nome) if nome else db_dir
+
+def nova_geracao(db_dir, ttl=DEFAULT_LEASE_TTL):
+    """
+    Cria o diretório de uma geração ainda não publicada, já com um lease (antes
+    do diretório existir, para o coletor nunca vê-la sem ele).
+    Retorna (nome, diretório, lease).
+    """
+    nome = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    lease = Lease(db_dir, nome, ttl)
+    path = diretorio_geracao(db_dir, nome)
+    os.makedirs(path)
+    return nome, path, lease
+
+def geracao_do_journal(db_dir):
+    """Geração em gravação registrada no journal do indexador, ou None."""
+    try:
+        with open(os.path.join(db_dir, JOURNAL_FILE), "r", encoding="utf-8") as f:
+            return json.load(f).get("geracao")
+    except (FileNotFoundError, ValueError):
+        return None
+
+def publicar(db_dir, nome):
+    """Aponta db/CURRENT para a geração (os.replace: leitores veem a antiga ou a nova, nunca uma mistura)."""
+    gen_dir = diretorio_geracao(db_dir, nome)
+    for arquivo in os.listdir(gen_dir):
+        with open(os.path.join(gen_dir, arquivo), "rb") as f:
+            os.fsync(f.fileno())
+    _sincronizar_diretorio(gen_dir)
+    tmp_path = os.path.join(db_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(nome + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(db_dir, CURRENT_FILE))
+    _sincronizar_diretorio(db_dir)
+
+class Lease:
+    """Marca que este processo está usando uma geração; renovado enquanto ela estiver em uso."""
+
+    def __init__(self, db_dir, nome, ttl=DEFAULT_LEASE_TTL):
+        self.nome = nome
+        self.ttl = ttl
+        leases_dir = os.path.join(db_dir, LEASES_DIR)
+        os.makedirs(leases_dir, exist_ok=True)
+        self.path = os.path.join(leases_dir, f"{nome}.{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(datetime.now().isoformat())
+        self._renovado = time.monotonic()
+
+    def renovar(self):
+        # Barato: só toca o arquivo depois de um terço do TTL
+        if time.monotonic() - self._renovado < self.ttl / 3:
+            return
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            open(self.path, "w").close()
+        self._renovado = time.monotonic()
+
+    def liberar(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def leases_vivos(db_dir, ttl=DEFAULT_LEASE_TTL):
+    """Gerações com pelo menos um lease renovado dentro do TTL (leases vencidos são apagados)."""
+    leases_dir = os.path.join(db_dir, LEASES_DIR)
+    if not os.path.isdir(leases_dir):
+        return set()
+    vivos, agora = set(), time.time()
+    for arquivo in os.listdir(leases_dir):
+        path = os.path.join(leases_dir, arquivo)
+        try:
+            vencido = agora - os.path.getmtime(path) > ttl
+        except FileNotFoundError:
+            continue
+        if vencido:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        else:
+            vivos.add(arquivo.split(".", 1)[0])
+    return vivos
+
+def coletar_geracoes(db_dir, manter=(), ttl=DEFAULT_LEASE_TTL):
+    """
+    Apaga gerações que não são a atual, não estão em `manter`, não têm lease
+    vivo e não são a do journal do indexador (uma execução interrompida ainda
+    pode ser retomada). Retorna os nomes removidos.
+    Leitores que ainda tenham arquivos abertos/mapeados de uma geração apagada
+    continuam funcionando (o conteúdo só some quando eles os fecham).
+    """
+    geracoes_dir = os.path.join(db_dir, GERACOES_DIR)
+    if not os.path.isdir(geracoes_dir):
+        return []
+    protegidas = set(manter) | leases_vivos(db_dir, ttl) | {geracao_atual(db_dir), geracao_do_journal(db_dir)}
+    removidas = []
+    for nome in sorted(os.listdir(geracoes_dir)):
+        if nome not in protegidas:
+            shutil.rmtree(os.path.join(geracoes_dir, nome), ignore_errors=True)
+            removidas.append(nome)
+    return removidas
+
+def abrir_com_lease(db_dir, ttl=DEFAULT_LEASE_TTL):
+    """
+    Lê o ponteiro e registra um lease na geração atual, confirmando que o
+    ponteiro não mudou no meio (senão o coletor poderia apagá-la antes do lease
+    existir). Retorna (nome, diretório, lease); no layout antigo, (None, db_dir, None).
+    """
+    while True:
+        nome = geracao_atual(db_dir)
+        if nome is None:
+            return None, db_dir, None
+        lease = Lease(db_dir, nome, ttl)
+        if geracao_atual(db_dir) == nome:
+            return nome, diretorio_geracao(db_dir, nome), lease
+        lease.liberar()
+
+class PonteiroAtual:
+    """
+    Detecta mudança de db/CURRENT com no máximo um stat() por intervalo. A
+    mudança só é dada como vista em confirmar(), depois que a nova geração
+    carregou; se a carga falhar, a próxima checagem avisa de novo.
+    """
+
+    def __init__(self, db_dir, intervalo=DEFAULT_INTERVALO_CHECAGEM):
+        self.path = os.path.join(db_dir, CURRENT_FILE)
+        self.intervalo = intervalo
+        self._ultima_checagem = 0.0
+        self._assinatura = self._stat()
+        self._vista = self._assinatura
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def mudou(self):
+        agora = time.monotonic()
+        if agora - self._ultima_checagem < self.intervalo:
+            return False
+        self._ultima_checagem = agora
+        self._vista = self._stat()
+        return self._vista != self._assinatura
+
+    def confirmar(self):
+        """A última mudança vista em mudou() já foi carregada."""
+        self._assinatura = self._vista
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerações do índice em db/geracoes.")
+    parser.add_argument("comando", choices=["status", "gc"])
+    parser.add_argument("--db-dir", default="./db")
+    parser.add_argument("--lease-ttl", type=int, default=DEFAULT_LEASE_TTL, help="Segundos até um lease sem renovação expirar.")
+    args = parser.parse_args()
+
+    if args.comando == "gc":
+        removidas = coletar_geracoes(args.db_dir, ttl=args.lease_ttl)
+        print(f"🧹 {len(removidas)} geração(ões) removida(s){': ' + ', '.join(removidas) if removidas else ''}")
+    atual = geracao_atual(args.db_dir)
+    print(f"📌 Atual: {atual or '(layout antigo, sem db/CURRENT)'}")
+    geracoes_dir = os.path.join(args.db_dir, GERACOES_DIR)
+    vivos = leases_vivos(args.db_dir, args.lease_ttl)
+    em_gravacao = geracao_do_journal(args.db_dir)
+    for nome in sorted(os.listdir(geracoes_dir)) if os.path.isdir(geracoes_dir) else []:
+        marcas = [m for m, ok in (("atual", nome == atual), ("em uso", nome in vivos), ("journal", nome == em_gravacao)) if ok]
+        print(f"  {nome} {'(' + ', '.join(marcas) + ')' if marcas else ''}")
+
+if __name__ == "__main__":
+    main()
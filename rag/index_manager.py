@@ -1,12 +1,13 @@
-import re
 import os
 import json
 import faiss
 import pickle
 import numpy as np
+import shutil
 import hashlib
+import multiprocessing
+from collections import deque
 from datetime import datetime
-from llama_cpp import Llama
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     PyPDFLoader,
@@ -16,15 +17,44 @@ from langchain_community.document_loaders import (
     UnstructuredExcelLoader
 )
 from langchain_core.documents import Document
-from chat.chat_manager import load_model_path
+from chat.chat_manager import load_model_config, load_embedding_model_name, load_embedding_model_path
+from rag.embedding_engine import EmbeddingEngine, DEFAULT_EMBEDDING_WORKERS, DEFAULT_BATCH_TOKENS
+from rag.embedding_cache import EmbeddingCache
+from rag.meta_store import MetaStore, META_FILE
+from rag.text_store import ChunkTextStore, ChunkTextList, CHUNKS_FILE, OFFSETS_FILE
+from rag.dim_reduction import REDUCAO_FILE
+from rag.generations import diretorio_atual, diretorio_geracao, nova_geracao, publicar, coletar_geracoes, Lease, JOURNAL_FILE
+from rag.vector_store import carregar_vetores, VECTORS_FILE
+from rag.table_detection import DetectorTabelas, detectar_tabelas
+from rag.index_writer import IndexWriter, METAS_JSONL
+from rag.ann_index import (
+    DEFAULT_INDEX_CONFIG, carregar_config_index, aplicar_parametros_busca, salvar_faiss, faiss_e_pickle_legado,
+    ler_faiss, e_compactado, preparar_mapa_direto
+)
 
-INDEXER_VERSION = "1.9"
+INDEXER_VERSION = "1.10"
 DEFAULT_CHUNK_SIZE = 1000
 DEFAULT_CHUNK_OVERLAP = 200
+DEFAULT_LOADER_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+DEFAULT_LOADER_TIMEOUT = 600  # segundos por arquivo
+DEFAULT_MAX_EM_VOO = 256  # chunks aguardando embedding/gravação
+DEFAULT_CHECKPOINT_CHUNKS = 4096  # chunks entre checkpoints duráveis
+MANIFEST_FILE = "index_manifest.json"
+ARQUIVOS_LAYOUT_ANTIGO = (
+    "faiss.index", CHUNKS_FILE, OFFSETS_FILE, META_FILE, VECTORS_FILE, REDUCAO_FILE, "index_meta.json",
+    MANIFEST_FILE, "tabelas_extraidas.json", "documents.pkl", "meta.pkl"
+)
 
 def text_hash(text):
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
+def file_hash(path, bloco=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for parte in iter(lambda: f.read(bloco), b""):
+            h.update(parte)
+    return h.hexdigest()
+
 def clean_faq(text):
     lines = []
     for line in text.split('\n'):
@@ -45,42 +75,12 @@ def split_text_fixed(text, chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_
     return splitter.split_text(text)
 
 def extrair_tabelas_generico(texto, max_colunas=10, min_colunas=2):
-    linhas = texto.split('\n')
+    """Tabelas de um único texto (sem continuação entre páginas); mantido por compatibilidade."""
     tabelas = []
-    bloco = []
-    padrao_linha_tabela = re.compile(r"^\s*(\d+\.|\.\s*|\|\s*|[A-Z]{2}\s*\.)")
-    for linha in linhas:
-        if padrao_linha_tabela.match(linha) and len(linha.split()) >= min_colunas:
-            bloco.append(linha)
-        else:
-            if len(bloco) >= 2:
-                tabelas.append(list(bloco))
-            bloco = []
-    if len(bloco) >= 2:
-        tabelas.append(list(bloco))
-
-    tabelas_estruturadas = []
-    for tab in tabelas:
-        delimitadores = [r'\s{2,}', r'\t', r'\|', r'\.']
-        melhor_delim = None
-        max_cols = 0
-        for delim in delimitadores:
-            cols = [re.split(delim, l.strip()) for l in tab]
-            num_cols = max(len(c) for c in cols)
-            if num_cols > max_cols:
-                melhor_delim = delim
-                max_cols = num_cols
-        if melhor_delim:
-            rows = [list(map(str.strip, re.split(melhor_delim, l.strip()))) for l in tab]
-            header = None
-            if any(re.search('[A-Za-z]', cel) for cel in rows[0]):
-                header = rows[0]
-                rows = rows[1:]
-            else:
-                header = [f"Coluna_{i+1}" for i in range(len(rows[0]))]
-            if len(header) <= max_colunas:
-                tabelas_estruturadas.append({'header': header, 'rows': rows})
-    return tabelas_estruturadas
+    for tab in detectar_tabelas([texto], max_colunas, min_colunas, multipagina=False):
+        del tab["paginas"]
+        tabelas.append(tab)
+    return tabelas
 
 def tabela_to_chunks(tab, rel_path):
     header = tab['header']
@@ -93,17 +93,139 @@ def tabela_to_chunks(tab, rel_path):
     chunk = f"Tabela extraída ({rel_path}):\n{tabela_md}"
     return [chunk]
 
+def get_loader(path):
+    if path.endswith(".pdf"):
+        return PyPDFLoader(path)
+    elif path.endswith(".docx"):
+        return UnstructuredWordDocumentLoader(path)
+    elif path.endswith(".odt"):
+        return UnstructuredODTLoader(path)
+    elif path.endswith(".csv"):
+        return CSVLoader(path)
+    elif path.endswith(".xlsx") or path.endswith(".xls"):
+        return UnstructuredExcelLoader(path)
+    else:
+        print(f"Formato não suportado: {path}")
+        return None
+
+def processar_arquivo(path, rel_path, tags):
+    """
+    Etapa load → limpeza → tabelas → chunking de um arquivo.
+    Retorna {"suportado", "chunks": [(texto, tags)], "tabelas": [...]} na ordem do documento.
+    """
+    loader = get_loader(path)
+    if not loader:
+        return {"suportado": False, "chunks": [], "tabelas": []}
+
+    file_docs = loader() if callable(loader) else loader.load()
+    chunks, tabelas = [], []
+
+    # CSV = único chunk
+    if path.endswith('.csv'):
+        doc = file_docs[0]
+        lines = doc.page_content.strip().splitlines()
+        tabela_md = "\n".join(lines)
+        chunks.append((f"Tabela extraída ({rel_path}):\n{tabela_md}", tags + ["tabela_extraida"]))
+        return {"suportado": True, "chunks": chunks, "tabelas": tabelas}
+
+    # Outros formatos: padrão
+    def _adicionar_tabelas(tabelas_doc):
+        for tab in tabelas_doc:
+            tab['file'] = rel_path
+            tabelas.append(tab)
+            for chunk_text in tabela_to_chunks(tab, rel_path):
+                chunks.append((chunk_text, tags + ["tabela_extraida"]))
+
+    # Tabelas genéricas (podem continuar de uma página para a outra)
+    detector = DetectorTabelas()
+    for d in file_docs:
+        raw_text = d.page_content
+        _adicionar_tabelas(detector.pagina(raw_text))
+
+        # Chunking padrão (texto puro)
+        clean_text = clean_faq(raw_text)
+        for chunk_text in split_text_fixed(clean_text):
+            chunks.append((chunk_text, tags))
+    _adicionar_tabelas(detector.finalizar())
+    return {"suportado": True, "chunks": chunks, "tabelas": tabelas}
+
+def _processar_arquivo_isolado(path, rel_path, tags):
+    # Um arquivo com defeito não derruba a indexação dos demais
+    try:
+        return processar_arquivo(path, rel_path, tags)
+    except Exception as e:
+        return {"erro": f"{type(e).__name__}: {e}"}
+
+def _coletar(resultado_async, timeout):
+    try:
+        return resultado_async.get(timeout)
+    except multiprocessing.TimeoutError:
+        return {"erro": f"tempo limite de {timeout}s excedido", "timeout": True}
+
+def processar_arquivos(tarefas, workers=DEFAULT_LOADER_WORKERS, timeout=DEFAULT_LOADER_TIMEOUT):
+    """
+    Processa as tarefas (path, rel_path, tags) num pool de processos e gera
+    (path, rel_path, resultado) na MESMA ordem de entrada, para que os ids dos
+    chunks sejam estáveis. O tempo limite conta a partir de quando o resultado
+    do arquivo passa a ser aguardado; um worker travado é encerrado ao final.
+    """
+    if workers <= 1:
+        for path, rel_path, tags in tarefas:
+            yield path, rel_path, _processar_arquivo_isolado(path, rel_path, tags)
+        return
+
+    pool = multiprocessing.get_context("spawn").Pool(workers, maxtasksperchild=20)
+    travou = False
+    pendentes = deque()
+    try:
+        for tarefa in tarefas:
+            pendentes.append((tarefa, pool.apply_async(_processar_arquivo_isolado, tarefa)))
+            # Limita arquivos em voo: resultados grandes não se acumulam na memória
+            while len(pendentes) >= workers * 2:
+                (path, rel_path, _), resultado_async = pendentes.popleft()
+                resultado = _coletar(resultado_async, timeout)
+                travou = travou or resultado.get("timeout", False)
+                yield path, rel_path, resultado
+        while pendentes:
+            (path, rel_path, _), resultado_async = pendentes.popleft()
+            resultado = _coletar(resultado_async, timeout)
+            travou = travou or resultado.get("timeout", False)
+            yield path, rel_path, resultado
+    finally:
+        if travou or pendentes:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
 class IndexManager:
     def __init__(self):
-        self.model = Llama(model_path=load_model_path(), embedding=True)
+        self.engine = None
+        self.embedding_model = load_embedding_model_name()
+        self.embedding_cache = EmbeddingCache(self.embedding_model)
+        self.index_config = carregar_config_index()
+        self.loader_workers = DEFAULT_LOADER_WORKERS
+        self.loader_timeout = DEFAULT_LOADER_TIMEOUT
+        self.max_em_voo = DEFAULT_MAX_EM_VOO
         self.data_dir = "./data/"
         self.tags_file = "./db/tags.json"
         self.db_dir = "./db/"
-        self.chunks = []
-        self.chunk_meta = []
-        self.embeddings = []
+        self.journal_file = os.path.join(self.db_dir, JOURNAL_FILE)
+        self.checkpoint_chunks = DEFAULT_CHECKPOINT_CHUNKS
+        self.meta_anterior = None
+        self.meta_info_anterior = {}
         self.tag_map = self._load_tag_map()
-        self.tabelas_extraidas = []
+
+    def _get_engine(self):
+        # Carregado só quando há algo a embedar (execuções sem mudanças não carregam o modelo)
+        if self.engine is None:
+            config = load_model_config()
+            self.engine = EmbeddingEngine(
+                load_embedding_model_path(),
+                workers=config.get("embedding_workers", DEFAULT_EMBEDDING_WORKERS),
+                batch_tokens=config.get("embedding_batch_tokens", DEFAULT_BATCH_TOKENS)
+            )
+        return self.engine
 
     def _load_tag_map(self):
         with open(self.tags_file) as f:
@@ -112,198 +234,581 @@ class IndexManager:
 
     def _arquivo_tem_chunk_existente(self, caminho_absoluto):
         rel_path = os.path.relpath(caminho_absoluto, self.data_dir).replace("\\", "/")
-        return any(meta["file"] == rel_path for meta in self.chunk_meta)
+        return self.meta_anterior is not None and self.meta_anterior.tem_arquivo(rel_path)
 
-    def indexar_arquivos(self, arquivos):
-        sobrescrever = False
-        if any(self._arquivo_tem_chunk_existente(a) for a in arquivos):
-            resposta = input("⚠️ Arquivos já foram indexados. Deseja sobrescrever os chunks existentes? (s/n): ").strip().lower()
-            sobrescrever = resposta.startswith("s")
+    def _carregar_manifest(self):
+        manifest_file = os.path.join(diretorio_atual(self.db_dir), MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            return {}
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("indexer_version") != INDEXER_VERSION:
+            print(f"♻️ Manifest de outra versão do indexador ({manifest.get('indexer_version')}); reindexando tudo.")
+            return {}
+        return manifest.get("files", {})
+
+    def _salvar_manifest(self, arquivos_manifest, chunk_ids, destino):
+        for rel_path, entrada in arquivos_manifest.items():
+            entrada["chunk_ids"] = list(chunk_ids.get(rel_path, []))
+        manifest = {
+            "indexer_version": INDEXER_VERSION,
+            "updated_at": datetime.now().isoformat(),
+            "files": arquivos_manifest
+        }
+        manifest_file = os.path.join(destino, MANIFEST_FILE)
+        tmp_path = manifest_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, manifest_file)
+
+    def _entrada_manifest(self, path, rel_path, anterior=None):
+        st = os.stat(path)
+        tags = self.tag_map.get(rel_path, [])
+        # mtime e tamanho iguais: reaproveita o hash sem reler o arquivo
+        if anterior and anterior.get("mtime") == st.st_mtime and anterior.get("size") == st.st_size:
+            sha256 = anterior["sha256"]
+        else:
+            sha256 = file_hash(path)
+        return {"sha256": sha256, "mtime": st.st_mtime, "size": st.st_size, "tags": tags}
+
+    def _converter_faiss_legado(self):
+        index_path = os.path.join(self.db_dir, "faiss.index")
+        if os.path.exists(index_path) and faiss_e_pickle_legado(index_path):
+            with open(index_path, "rb") as f:
+                index = pickle.load(f)
+            salvar_faiss(index, index_path)
+            print(f"♻️ {index_path} convertido do pickle para o formato nativo do FAISS.")
+
+    def _carregar_indice_anterior(self):
+        try:
+            index, documents, meta, emb_dim = carregar_index(self.db_dir)
+        except FileNotFoundError:
+            return None
+        self.meta_info_anterior = carregar_index_meta(self.db_dir)
+        if not (index.ntotal == len(documents) == len(meta)):
+            print("⚠️ Índice anterior inconsistente; reindexando tudo.")
+            return None
+        if modelo_embedding_do_indice(self.meta_info_anterior) != self.embedding_model:
+            print(f"♻️ Índice anterior feito com outro modelo de embedding ({modelo_embedding_do_indice(self.meta_info_anterior)}); reindexando tudo.")
+            return None
+        self.meta_anterior = meta
+        vetores = carregar_vetores(diretorio_atual(self.db_dir), emb_dim)
+        if vetores is not None and len(vetores) != index.ntotal:
+            vetores = None
+        return documents, meta, index, vetores
+
+    def _sem_vetor_recuperavel(self, meta, ids, vetores_anteriores):
+        """Ids reaproveitados cujo vetor não sai de vectors.f32, do cache nem (sem perdas) do índice."""
+        if vetores_anteriores is not None:
+            return []
+        if not e_compactado(dict(DEFAULT_INDEX_CONFIG, **self.meta_info_anterior.get("index_config", {}))):
+            return []
+        return [i for i in ids if not self.embedding_cache.contem(meta[i]["chunk_hash"])]
+
+    def _vetores_anteriores(self, index, meta, ids, vetores_anteriores):
+        """
+        Vetores dos chunks reaproveitados: de vectors.f32 do índice anterior;
+        na falta, do cache de embeddings e, por fim, reconstruídos do índice.
+        """
+        if vetores_anteriores is not None:
+            return np.array(vetores_anteriores[ids], dtype=np.float32)
+        hashes = [meta[i]["chunk_hash"] for i in ids]
+        do_cache, posicoes_hit, posicoes_miss = self.embedding_cache.buscar(hashes)
+        vetores = np.zeros((len(ids), self.meta_info_anterior.get("embedding_dim", index.d)), dtype=np.float32)
+        if len(do_cache):
+            vetores[posicoes_hit] = do_cache
+        if posicoes_miss and self.meta_info_anterior.get("index_config", {}).get("index_type") == "ivf_flat":
+            ivf = faiss.extract_index_ivf(index)
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                ivf.make_direct_map()
+        for j in posicoes_miss:
+            vetores[j] = index.reconstruct(int(ids[j]))
+        return vetores
+
+    def _novo_meta(self, chunk_text, rel_path, path, tags):
+        chunk_hash = text_hash(chunk_text)
+        if chunk_hash in self._hashes:
+            return None
+        self._hashes.add(chunk_hash)
+        return {
+            "file": rel_path,
+            "fonte": rel_path,
+            "tags": tags,
+            "content_start": chunk_text[:200],
+            "chunk_hash": chunk_hash,
+            "created_at": datetime.now().isoformat(),
+            "source_path": path,
+            "indexer_version": INDEXER_VERSION
+        }
+
+    def _planejar(self, arquivos, completo):
+        """
+        Compara os arquivos com o manifest e decide o que reaproveitar e o que
+        reprocessar. Retorna (plano, anterior); o plano é serializável e vai no journal.
+        """
+        manifest_anterior = {} if completo else self._carregar_manifest()
+        anterior = self._carregar_indice_anterior() if manifest_anterior else None
+        if anterior is None:
+            manifest_anterior = {}
 
         arquivos_relativos = [
             os.path.relpath(a, self.data_dir).replace("\\", "/")
             for a in arquivos
         ]
         arquivos_com_tags = set(self.tag_map.keys())
-        processados = 0
-        self.tabelas_extraidas = []
+        manifest = {}
+        inalterados = set()
+        pendentes = []
 
         for path, rel_path in zip(arquivos, arquivos_relativos):
             if rel_path not in arquivos_com_tags:
                 print(f"⚠️ Ignorado (sem tags no tags.json): {rel_path}")
                 continue
+            entrada_anterior = manifest_anterior.get(rel_path)
+            manifest[rel_path] = self._entrada_manifest(path, rel_path, entrada_anterior)
+            if (
+                entrada_anterior
+                and entrada_anterior["sha256"] == manifest[rel_path]["sha256"]
+                and entrada_anterior.get("tags") == manifest[rel_path]["tags"]
+            ):
+                inalterados.add(rel_path)
+            else:
+                pendentes.append((path, rel_path))
 
-            loader = self.get_loader(path)
-            if not loader:
-                continue
+        removidos = sorted(set(manifest_anterior) - set(manifest))
+        alterados = [rel_path for _, rel_path in pendentes if rel_path in manifest_anterior]
 
-            file_docs = loader() if callable(loader) else loader.load()
-            tags = self.tag_map.get(rel_path, [])
-
-            # CSV = único chunk
-            if path.endswith('.csv'):
-                doc = file_docs[0]
-                lines = doc.page_content.strip().splitlines()
-                tabela_md = "\n".join(lines)
-                chunk_text = f"Tabela extraída ({rel_path}):\n{tabela_md}"
-                chunk_hash = text_hash(chunk_text)
-                if not sobrescrever and any(m["chunk_hash"] == chunk_hash for m in self.chunk_meta):
-                    continue
-                self.chunks.append(chunk_text)
-                self.chunk_meta.append({
-                    "file": rel_path,
-                    "fonte": rel_path,
-                    "tags": tags + ["tabela_extraida"],
-                    "content_start": chunk_text[:200],
-                    "chunk_hash": chunk_hash,
-                    "created_at": datetime.now().isoformat(),
-                    "source_path": path,
-                    "indexer_version": INDEXER_VERSION
-                })
-                processados += 1
-                continue
+        # Arquivos inalterados sem chunks ou sem vetor recuperável voltam para a fila
+        if anterior is not None:
+            documents, meta, index_anterior, vetores_anteriores = anterior
+            for path, rel_path in zip(arquivos, arquivos_relativos):
+                if rel_path in inalterados and manifest_anterior[rel_path].get("chunk_ids") and not self._arquivo_tem_chunk_existente(path):
+                    print(f"⚠️ Chunks de {rel_path} ausentes no índice; reprocessando.")
+                    inalterados.discard(rel_path)
+                    pendentes.append((path, rel_path))
+            manter = self._ids_reaproveitados(meta, inalterados)
+            sem_vetor = self._sem_vetor_recuperavel(meta, manter, vetores_anteriores)
+            if sem_vetor:
+                arquivos_sem_vetor = {meta[i]["file"] for i in sem_vetor}
+                print(f"⚠️ {len(sem_vetor)} vetores irrecuperáveis; reprocessando {len(arquivos_sem_vetor)} arquivo(s).")
+                inalterados -= arquivos_sem_vetor
+                pendentes.extend((p, r) for p, r in zip(arquivos, arquivos_relativos) if r in arquivos_sem_vetor)
 
-            # Outros formatos: padrão
-            for d in file_docs:
-                raw_text = d.page_content
-
-                # Tabelas genéricas
-                tabelas_doc = extrair_tabelas_generico(raw_text)
-                if tabelas_doc:
-                    for tab in tabelas_doc:
-                        tab['file'] = rel_path
-                    self.tabelas_extraidas.extend(tabelas_doc)
-                    for tab in tabelas_doc:
-                        descritores = tabela_to_chunks(tab, rel_path)
-                        for chunk_text in descritores:
-                            chunk_hash = text_hash(chunk_text)
-                            if not sobrescrever and any(m["chunk_hash"] == chunk_hash for m in self.chunk_meta):
-                                continue
-                            self.chunks.append(chunk_text)
-                            self.chunk_meta.append({
-                                "file": rel_path,
-                                "fonte": rel_path,
-                                "tags": tags + ["tabela_extraida"],
-                                "content_start": chunk_text[:200],
-                                "chunk_hash": chunk_hash,
-                                "created_at": datetime.now().isoformat(),
-                                "source_path": path,
-                                "indexer_version": INDEXER_VERSION
-                            })
-
-                # Chunking padrão (texto puro)
-                clean_text = clean_faq(raw_text)
-                for chunk_text in split_text_fixed(clean_text):
-                    chunk_hash = text_hash(chunk_text)
-                    if not sobrescrever and any(m["chunk_hash"] == chunk_hash for m in self.chunk_meta):
-                        continue
-                    self.chunks.append(chunk_text)
-                    self.chunk_meta.append({
-                        "file": rel_path,
-                        "fonte": rel_path,
-                        "tags": tags,
-                        "content_start": chunk_text[:200],
-                        "chunk_hash": chunk_hash,
-                        "created_at": datetime.now().isoformat(),
-                        "source_path": path,
-                        "indexer_version": INDEXER_VERSION
-                    })
-            processados += 1
-
-        print(f"🧩 {len(self.chunks)} chunks extraídos de {processados} arquivos.")
-
-        # Salva tabelas extraídas em json (opcional)
-        if self.tabelas_extraidas:
-            os.makedirs(self.db_dir, exist_ok=True)
-            tabela_json_path = os.path.join(self.db_dir, "tabelas_extraidas.json")
-            with open(tabela_json_path, "w", encoding="utf-8") as f:
-                json.dump(self.tabelas_extraidas, f, ensure_ascii=False, indent=2)
-            print(f"💾 Tabelas extraídas salvas em: {tabela_json_path}")
-
-        self.create_embeddings()
-        self.save_index()
+        plano = {
+            "manifest": manifest,
+            "inalterados": sorted(inalterados),
+            "pendentes": pendentes,
+            "removidos": removidos,
+            "alterados": alterados
+        }
+        return plano, anterior
 
-    def get_loader(self, path):
-        if path.endswith(".pdf"):
-            return PyPDFLoader(path)
-        elif path.endswith(".docx"):
-            return UnstructuredWordDocumentLoader(path)
-        elif path.endswith(".odt"):
-            return UnstructuredODTLoader(path)
-        elif path.endswith(".csv"):
-            return CSVLoader(path)
-        elif path.endswith(".xlsx") or path.endswith(".xls"):
-            return UnstructuredExcelLoader(path)
-        else:
-            print(f"Formato não suportado: {path}")
+    def _config_alterada(self):
+        """
+        Chaves do index_config pedido que diferem das do índice publicado
+        (tipo, codificação, redução, léxico...): mudou alguma, o índice é
+        reconstruído mesmo sem arquivos novos.
+        """
+        pedido = self.meta_info_anterior.get("index_config_pedido")
+        if pedido is None:
+            # Índices antigos só gravavam o config ajustado ao corpus (nlist, pq_m...): compara o que não é ajustado
+            usado = dict(DEFAULT_INDEX_CONFIG, **self.meta_info_anterior.get("index_config", {}))
+            chaves = ["index_type", "codificacao", "reducao", "lexico"] + (["reducao_dim"] if self.index_config.get("reducao") else [])
+            return [k for k in chaves if self.index_config.get(k) != usado.get(k)]
+        pedido = dict(DEFAULT_INDEX_CONFIG, **pedido)
+        return sorted(k for k in set(pedido) | set(self.index_config) if self.index_config.get(k) != pedido.get(k))
+
+    @staticmethod
+    def _ids_reaproveitados(meta, inalterados):
+        return sorted(int(i) for rel_path in inalterados for i in meta.ids_do_arquivo(rel_path))
+
+    def _carregar_journal(self):
+        """Journal de uma execução interrompida, se ainda for válido para o índice publicado."""
+        if not os.path.exists(self.journal_file):
+            print("ℹ️ Nenhuma execução interrompida para retomar; começando do zero.")
+            return None
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            journal = json.load(f)
+        index_meta_path = os.path.join(diretorio_atual(self.db_dir), "index_meta.json")
+        publicado = None
+        if os.path.exists(index_meta_path):
+            with open(index_meta_path, "r", encoding="utf-8") as f:
+                publicado = json.load(f).get("created_at")
+        if (
+            journal.get("indexer_version") != INDEXER_VERSION or journal.get("indice_anterior") != publicado
+            or not journal.get("geracao") or journal.get("embedding_model") != self.embedding_model
+        ):
+            print("⚠️ Journal de outra versão ou de outro índice publicado; começando do zero.")
+            return None
+        necessarios = [CHUNKS_FILE + ".tmp", CHUNKS_FILE + ".offsets.tmp", METAS_JSONL]
+        if journal["writer"]["vetores"]:
+            necessarios.append(VECTORS_FILE + ".tmp")
+        if journal["tabelas"]["bytes"]:
+            necessarios.append("tabelas_extraidas.json.tmp")
+        staging = diretorio_geracao(self.db_dir, journal["geracao"])
+        faltando = [n for n in necessarios if not os.path.exists(os.path.join(staging, n))]
+        if faltando:
+            print(f"⚠️ Arquivos do checkpoint ausentes ({', '.join(faltando)}); começando do zero.")
             return None
+        return journal
 
-    def create_embeddings(self):
-        self.embeddings = []
-        for i, chunk in enumerate(self.chunks):
-            try:
-                resp = self.model.embed(chunk)
-                emb = None
-                if isinstance(resp, dict) and "data" in resp and isinstance(resp["data"], list):
-                    emb = resp["data"][0].get("embedding") or resp["data"][0].get("data")
-                elif isinstance(resp, dict) and "embedding" in resp:
-                    emb = resp["embedding"]
-                elif isinstance(resp, list):
-                    emb = resp
-                if emb is None:
-                    raise RuntimeError("Embedding inválido")
-                arr = np.array(emb, dtype=np.float32)
-                self.embeddings.append(arr)
-                print(f"🔹 Chunk {i}: shape {arr.shape}, arquivo: {self.chunk_meta[i]['file']}")
-            except Exception as e:
-                print(f"❌ Erro ao gerar embedding do chunk {i}: {e}")
-        print(f"✅ {len(self.embeddings)} embeddings gerados.")
-
-    def save_index(self):
-        if not self.embeddings:
-            print("❌ Nenhum embedding para salvar.")
+    def _checkpoint(self):
+        """Torna durável o progresso da execução e grava o journal (atômico)."""
+        journal = dict(
+            self._journal_base,
+            atualizado_em=datetime.now().isoformat(),
+            writer=self._writer.checkpoint(),
+            tabelas=self._tabelas.checkpoint(),
+            reaproveitados=self._reaproveitados_gravados,
+            arquivos_concluidos=self._concluidos,
+            stats=self.stats
+        )
+        tmp_path = self.journal_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(journal, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_file)
+        self._ultimo_checkpoint = len(self._writer)
+        print(f"💾 Checkpoint: {len(self._writer)} chunks, {len(self._concluidos)} arquivo(s) concluído(s).")
+
+    def _talvez_checkpoint(self):
+        self._lease.renovar()
+        if len(self._writer) - self._ultimo_checkpoint >= self.checkpoint_chunks:
+            self._checkpoint()
+
+    def indexar_arquivos(self, arquivos, completo=False, retomar=False):
+        """
+        Indexa incrementalmente: só arquivos novos ou alterados (hash/tags) são
+        relidos e embedados; chunks de arquivos alterados ou removidos saem do
+        índice e o resto é reaproveitado. `completo=True` reconstrói tudo.
+
+        Tudo corre em streaming (arquivos → chunks → lotes de embeddings →
+        stores/índice), com no máximo `max_em_voo` chunks em memória e um
+        checkpoint durável a cada `checkpoint_chunks` chunks. `retomar=True`
+        continua uma execução interrompida a partir do último checkpoint.
+        """
+        self._converter_faiss_legado()
+        journal = self._carregar_journal() if retomar else None
+        if journal is None and os.path.exists(self.journal_file):
+            print("♻️ Descartando o checkpoint de uma execução anterior.")
+            os.remove(self.journal_file)
+            coletar_geracoes(self.db_dir)
+
+        if journal:
+            plano = journal["plano"]
+            self.index_config = journal["index_config"]
+            anterior = self._carregar_indice_anterior() if plano["inalterados"] else None
+            print(
+                f"⏯️ Retomando execução de {journal['iniciado_em']}: {journal['writer']['textos']['n']} chunks e "
+                f"{len(journal['arquivos_concluidos'])} arquivo(s) já gravados."
+            )
+        else:
+            plano, anterior = self._planejar(arquivos, completo)
+        manifest = dict(plano["manifest"])
+        inalterados = set(plano["inalterados"])
+        pendentes = [tuple(p) for p in plano["pendentes"]]
+
+        print(
+            f"📋 Manifest: {len(pendentes) - len(plano['alterados'])} novo(s), {len(plano['alterados'])} alterado(s), "
+            f"{len(plano['removidos'])} removido(s), {len(inalterados)} inalterado(s)."
+        )
+        config_alterada = self._config_alterada() if anterior is not None else []
+        if not pendentes and not plano["removidos"] and not config_alterada:
+            print("✅ Índice já está atualizado. Nada a fazer.")
             return
-        os.makedirs(self.db_dir, exist_ok=True)
-        embeddings_np = np.vstack(self.embeddings).astype("float32")
-        dim = embeddings_np.shape[1]
-        index = faiss.IndexFlatL2(dim)
-        index.add(embeddings_np)
-        meta_info = {
-            "created_at": datetime.now().isoformat(),
+        if config_alterada:
+            print(f"♻️ Configuração do índice mudou ({', '.join(config_alterada)}); reconstruindo com os vetores guardados.")
+
+        manter = []
+        if anterior is not None:
+            documents, meta, index_anterior, vetores_anteriores = anterior
+            manter = self._ids_reaproveitados(meta, inalterados)
+
+        # A nova geração é gravada num diretório próprio e só vira a atual no fim
+        estado = journal or {}
+        # (com lease, renovado nos checkpoints, para o gc de outro processo não apagá-la no meio)
+        if journal:
+            geracao = journal["geracao"]
+            gen_dir = diretorio_geracao(self.db_dir, geracao)
+            self._lease = Lease(self.db_dir, geracao)
+        else:
+            geracao, gen_dir, self._lease = nova_geracao(self.db_dir)
+        self._writer = writer = IndexWriter(
+            gen_dir, self.index_config, INDEXER_VERSION, estado=estado.get("writer"), embedding_model=self.embedding_model
+        )
+        self._tabelas = tabelas = TabelasWriter(os.path.join(gen_dir, "tabelas_extraidas.json"), estado=estado.get("tabelas"))
+        self._journal_base = {
             "indexer_version": INDEXER_VERSION,
-            "embedding_dim": dim,
-            "n_chunks": len(self.chunks),
-            "n_files": len(set(m["file"] for m in self.chunk_meta)),
-            "files_indexed": list(set(m["file"] for m in self.chunk_meta))
+            "embedding_model": self.embedding_model,
+            "geracao": geracao,
+            "iniciado_em": estado.get("iniciado_em", datetime.now().isoformat()),
+            "indice_anterior": self.meta_info_anterior.get("created_at") if anterior is not None else estado.get("indice_anterior"),
+            "index_config": self.index_config,
+            "plano": plano
         }
-        with open(os.path.join(self.db_dir, "faiss.index"), "wb") as f:
-            pickle.dump(index, f)
-        with open(os.path.join(self.db_dir, "documents.pkl"), "wb") as f:
-            pickle.dump(self.chunks, f)
-        with open(os.path.join(self.db_dir, "meta.pkl"), "wb") as f:
-            pickle.dump(self.chunk_meta, f)
-        with open(os.path.join(self.db_dir, "index_meta.json"), "w", encoding="utf-8") as f:
-            json.dump(meta_info, f, indent=2, ensure_ascii=False)
-        print("💾 Índice salvo com sucesso.")
-
-def carregar_index():
-    index_path = os.path.join("./db", "faiss.index")
-    documents_path = os.path.join("./db", "documents.pkl")
-    meta_path = os.path.join("./db", "meta.pkl")
-    index_meta_path = os.path.join("./db", "index_meta.json")
+        self._reaproveitados_gravados = estado.get("reaproveitados", 0)
+        self._concluidos = list(estado.get("arquivos_concluidos", []))
+        self._aguardando_lote = []
+        self._ultimo_checkpoint = len(writer)
+        self._hashes = writer.chunk_hashes()
+        self.stats = estado.get("stats", {"gerados": 0, "cache": 0, "reaproveitados": 0, "descartados": 0, "processados": 0})
+
+        # 1) Reaproveitados, em blocos lidos do índice anterior
+        if manter:
+            if self._reaproveitados_gravados == 0:
+                for tab in self._carregar_tabelas_extraidas():
+                    if tab.get("file") in inalterados:
+                        tabelas.adicionar(tab)
+            for inicio in range(self._reaproveitados_gravados, len(manter), self.max_em_voo):
+                ids = manter[inicio:inicio + self.max_em_voo]
+                metas = [meta[i] for i in ids]
+                self._hashes.update(m["chunk_hash"] for m in metas)
+                writer.adicionar(documents.get_many(ids), metas, self._vetores_anteriores(index_anterior, meta, ids, vetores_anteriores))
+                self._reaproveitados_gravados = inicio + len(ids)
+                self._talvez_checkpoint()
+            self.stats["reaproveitados"] = len(manter)
+
+        # 2) Novos/alterados: arquivos → chunks → lotes de até max_em_voo chunks
+        #    (numa retomada, arquivos concluídos são pulados, os chunks já gravados
+        #    de um arquivo pela metade caem no filtro de hash e as tabelas dele são
+        #    puladas pela contagem por arquivo do journal)
+        concluidos = set(self._concluidos)
+        lote = []
+        tarefas = [
+            (path, rel_path, self.tag_map.get(rel_path, []))
+            for path, rel_path in pendentes if rel_path not in concluidos
+        ]
+        falhas = []
+        for path, rel_path, resultado in processar_arquivos(tarefas, self.loader_workers, self.loader_timeout):
+            if "erro" in resultado:
+                print(f"❌ Falha ao processar {rel_path}: {resultado['erro']}")
+                manifest.pop(rel_path, None)  # fora do manifest: será tentado de novo na próxima execução
+                falhas.append(rel_path)
+                continue
+            if resultado["suportado"]:
+                # Numa retomada, as tabelas já gravadas de um arquivo pela metade não são repetidas
+                # (a extração é determinística: as primeiras são as mesmas)
+                for tab in resultado["tabelas"][tabelas.por_arquivo.get(rel_path, 0):]:
+                    tabelas.adicionar(tab)
+                for chunk_text, tags in resultado["chunks"]:
+                    meta_chunk = self._novo_meta(chunk_text, rel_path, path, tags)
+                    if meta_chunk is None:
+                        continue
+                    lote.append((chunk_text, meta_chunk))
+                    if len(lote) >= self.max_em_voo:
+                        self._gravar_lote(writer, lote)
+                        lote = []
+                self.stats["processados"] += 1
+            # Só conta como concluído quando todos os seus chunks estiverem gravados
+            if lote:
+                self._aguardando_lote.append(rel_path)
+            else:
+                self._concluidos.append(rel_path)
+        if lote:
+            self._gravar_lote(writer, lote)
+        self._checkpoint()
+
+        n_tabelas = tabelas.fechar()
+        if n_tabelas:
+            print(f"💾 {n_tabelas} tabelas extraídas salvas em: {tabelas.path}")
+        print(
+            f"🧩 {len(writer) - self.stats['reaproveitados']} chunks novos de {self.stats['processados']} arquivos "
+            f"({self.stats['reaproveitados']} reaproveitados, {len(falhas)} falha(s) de leitura)."
+        )
+        print(
+            f"✅ {self.stats['gerados']} embeddings gerados, {self.stats['cache']} do cache, "
+            f"{self.stats['descartados']} chunk(s) descartado(s) sem embedding."
+        )
+        print(f"🗄️ Cache de embeddings: {self.embedding_cache.stats()}")
+
+        if len(writer) == 0:
+            print("❌ Nenhum embedding para salvar.")
+            os.remove(self.journal_file)
+            shutil.rmtree(gen_dir, ignore_errors=True)
+            self._lease.liberar()
+            return
+        self._lease.renovar()
+        writer.finalizar()
+        self._salvar_manifest(manifest, writer.chunk_ids, gen_dir)
+        publicar(self.db_dir, geracao)
+        os.remove(self.journal_file)
+        self._lease.liberar()  # agora é a atual: protegida pelo ponteiro
+        print(f"💾 Índice salvo com sucesso (geração {geracao}).")
+        self._remover_layout_antigo()
+        removidas = coletar_geracoes(self.db_dir)
+        if removidas:
+            print(f"🧹 {len(removidas)} geração(ões) antiga(s) removida(s): {', '.join(removidas)}")
+        if self.engine is not None:
+            self.engine.close()
+
+    def _remover_layout_antigo(self):
+        """Arquivos do índice direto em db/ (antes das gerações) deixam de ser lidos após a publicação."""
+        for nome in ARQUIVOS_LAYOUT_ANTIGO:
+            path = os.path.join(self.db_dir, nome)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _gravar_lote(self, writer, lote):
+        """Embeda um lote (cache primeiro, modelo para os misses) e grava os chunks com vetor."""
+        textos = [t for t, _ in lote]
+        metas = [m for _, m in lote]
+        vetores, ok = self._embedar(textos, [m["chunk_hash"] for m in metas])
+        for i in sorted(set(range(len(lote))) - set(ok)):
+            print(f"❌ Chunk descartado (sem embedding), arquivo: {metas[i]['file']}")
+        if ok:
+            writer.adicionar([textos[i] for i in ok], [metas[i] for i in ok], vetores)
+        self._concluidos.extend(self._aguardando_lote)
+        self._aguardando_lote = []
+        print(f"📥 {len(writer)} chunks gravados.")
+        self._talvez_checkpoint()
+
+    def _embedar(self, textos, hashes):
+        """Retorna (vetores, posicoes_ok) na ordem de `textos`; posições sem embedding ficam de fora."""
+        do_cache, posicoes_hit, posicoes_miss = self.embedding_cache.buscar(hashes)
+        calculados, calculados_ok = np.zeros((0, 0), dtype=np.float32), []
+        if posicoes_miss:
+            calculados, falhas = self._get_engine().embed([textos[i] for i in posicoes_miss])
+            falhas_set = set(falhas)
+            calculados_ok = [i for j, i in enumerate(posicoes_miss) if j not in falhas_set]
+            self.embedding_cache.adicionar([hashes[i] for i in calculados_ok], calculados)
+        self.stats["cache"] += len(posicoes_hit)
+        self.stats["gerados"] += len(calculados_ok)
+        self.stats["descartados"] += len(posicoes_miss) - len(calculados_ok)
+
+        ok = sorted(posicoes_hit + calculados_ok)
+        if not ok:
+            return np.zeros((0, 0), dtype=np.float32), []
+        dim = do_cache.shape[1] if len(do_cache) else calculados.shape[1]
+        vetores = np.zeros((len(textos), dim), dtype=np.float32)
+        if len(do_cache):
+            vetores[posicoes_hit] = do_cache
+        if len(calculados):
+            vetores[calculados_ok] = calculados
+        return vetores[ok], ok
+
+    def _carregar_tabelas_extraidas(self):
+        tabela_json_path = os.path.join(diretorio_atual(self.db_dir), "tabelas_extraidas.json")
+        if not os.path.exists(tabela_json_path):
+            return []
+        with open(tabela_json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def get_loader(self, path):
+        return get_loader(path)
+
+class TabelasWriter:
+    """
+    Grava tabelas_extraidas.json incrementalmente (array JSON escrito item a
+    item). Conta as tabelas gravadas por arquivo, para que uma retomada não
+    repita as de um arquivo que parou no meio.
+    """
+
+    def __init__(self, path, estado=None):
+        self.path = path
+        self._tmp_path = path + ".tmp"
+        self._f = None
+        self.n = 0
+        self.por_arquivo = {}
+        if estado and estado["bytes"]:
+            os.truncate(self._tmp_path, estado["bytes"])
+            self._f = open(self._tmp_path, "a", encoding="utf-8")
+            self.n = estado["n"]
+            self.por_arquivo = dict(estado.get("por_arquivo", {}))
+
+    def _abrir(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._f = open(self._tmp_path, "w", encoding="utf-8")
+        self._f.write("[")
+
+    def adicionar(self, tabela):
+        if self._f is None:
+            self._abrir()
+        self._f.write(",\n" if self.n else "\n")
+        self._f.write(json.dumps(tabela, ensure_ascii=False, indent=2))
+        self.n += 1
+        arquivo = tabela.get("file")
+        self.por_arquivo[arquivo] = self.por_arquivo.get(arquivo, 0) + 1
+
+    def checkpoint(self):
+        if self._f is None:
+            return {"n": 0, "bytes": 0, "por_arquivo": {}}
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        return {"n": self.n, "bytes": os.path.getsize(self._tmp_path), "por_arquivo": self.por_arquivo}
+
+    def fechar(self):
+        if self._f is None:
+            self._abrir()
+        self._f.write("\n]\n")
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+        return self.n
+
+def carregar_index(db_dir="./db", mmap=True):
+    db_dir = diretorio_atual(db_dir)
+    index_path = os.path.join(db_dir, "faiss.index")
+    documents_path = os.path.join(db_dir, CHUNKS_FILE)
+    if not os.path.exists(documents_path):
+        documents_path = os.path.join(db_dir, "documents.pkl")  # formato antigo (lista pickled)
+    meta_path = os.path.join(db_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        meta_path = os.path.join(db_dir, "meta.pkl")  # formato antigo (list-of-dicts)
+    index_meta_path = os.path.join(db_dir, "index_meta.json")
 
     if not all(os.path.exists(p) for p in [index_path, documents_path, meta_path, index_meta_path]):
         raise FileNotFoundError("Algum dos arquivos do índice está ausente. Execute o indexador primeiro.")
 
-    with open(index_path, "rb") as f:
-        index = pickle.load(f)
-    with open(documents_path, "rb") as f:
-        documents = pickle.load(f)
-    with open(meta_path, "rb") as f:
-        meta = pickle.load(f)
-    with open(index_meta_path, "r", encoding="utf-8") as f:
-        meta_info = json.load(f)
+    index = ler_faiss(index_path, mmap=mmap)
+    if documents_path.endswith(".pkl"):
+        with open(documents_path, "rb") as f:
+            documents = ChunkTextList(pickle.load(f))
+    else:
+        documents = ChunkTextStore(db_dir)
+    if meta_path.endswith(".pkl"):
+        with open(meta_path, "rb") as f:
+            meta = MetaStore.from_dicts(pickle.load(f))
+    else:
+        meta = MetaStore.carregar(db_dir)
+    meta.textos = documents
+    meta_info = carregar_index_meta(db_dir)
     emb_dim = meta_info.get("embedding_dim", 4096)
+    aplicar_parametros_busca(index, meta_info.get("index_config", {}))
+    preparar_mapa_direto(index)
 
     return index, documents, meta, emb_dim
 
+def carregar_index_meta(db_dir="./db"):
+    with open(os.path.join(diretorio_atual(db_dir), "index_meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def modelo_embedding_do_indice(meta_info):
+    """Modelo que gerou os vetores do índice; índices antigos não gravavam e usavam o modelo de geração."""
+    return meta_info.get("embedding_model") or load_model_config()["model_name"]
+
+def verificar_modelo_embedding(db_dir, modelo, dim):
+    """
+    Confere, na carga, se o modelo de embedding configurado é o que gerou o
+    índice (nome e dimensão). Vetores de outro modelo não são comparáveis:
+    falha logo em vez de devolver resultados sem sentido.
+    """
+    try:
+        meta_info = carregar_index_meta(db_dir)
+    except FileNotFoundError:
+        return  # ainda não há índice publicado
+    do_indice, dim_indice = modelo_embedding_do_indice(meta_info), meta_info.get("embedding_dim")
+    if do_indice != modelo or (dim_indice is not None and dim_indice != dim):
+        raise ValueError(
+            f"Modelo de embedding configurado ({modelo}, {dim} dims) difere do usado no índice "
+            f"({do_indice}, {dim_indice} dims). Reindexe com: python -m rag.indexer --completo"
+        )
+
+def carregar_rerank(db_dir, emb_dim):
+    """(vetores exatos mapeados, fator) se o índice foi construído com re-rank; senão (None, 0)."""
+    db_dir = diretorio_atual(db_dir)
+    fator = carregar_index_meta(db_dir).get("index_config", {}).get("rerank_fator", 0)
+    vetores = carregar_vetores(db_dir, emb_dim) if fator else None
+    if fator and vetores is None:
+        print(f"⚠️ Re-rank configurado, mas {VECTORS_FILE} não existe em {db_dir}; buscando sem re-rank.")
+    return vetores, fator if vetores is not None else 0
+
@@ -0,0 +1,186 @@
+import os
+import json
+from datetime import datetime
+import numpy as np
+from rag.ann_index import (
+    resolver_config, criar_index_vazio, treinar_index, aplicar_parametros_busca, salvar_faiss,
+    e_compactado, avaliar_compressao
+)
+from rag.dim_reduction import ajustar_reducao, aplicar_reducao, avaliar_reducao, salvar_reducao
+from rag.meta_store import MetaStoreBuilder
+from rag.text_store import ChunkTextWriter, ChunkTextStore
+from rag.lexical_index import construir_lexico, LEXICO_FILE
+from rag.vector_store import VectorWriter
+
+BLOCO_ADD = 8192  # vetores por index.add() ao popular a partir de vectors.f32
+METAS_JSONL = "meta.jsonl.tmp"
+
+class IndexWriter:
+    """
+    Grava um índice em streaming: cada lote de (textos, metas, vetores) vai
+    direto para o text store, o builder de metadados, vectors.f32 e, quando o
+    tipo não exige treino (flat/HNSW), para o índice FAISS. Tipos treinados
+    (IVF/PQ) são treinados e populados em blocos a partir de vectors.f32 ao
+    final. Nada substitui o índice publicado antes de finalizar().
+
+    checkpoint() torna o progresso durável; um IndexWriter criado com o
+    `estado` devolvido continua exatamente dali.
+    """
+
+    def __init__(self, db_dir, index_config, indexer_version, estado=None, embedding_model=None):
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_dir = db_dir
+        self.index_config = index_config
+        self.indexer_version = indexer_version
+        self.embedding_model = embedding_model
+        self.metas = MetaStoreBuilder()
+        self.vetores = None
+        self.index = None
+        self.chunk_ids = {}
+        # Metadados também vão para um JSONL, para que um checkpoint possa remontar o builder
+        self._metas_path = os.path.join(db_dir, METAS_JSONL)
+        if estado is None:
+            self.textos = ChunkTextWriter(db_dir)
+            self._metas_f = open(self._metas_path, "w", encoding="utf-8")
+        else:
+            self._retomar(estado)
+
+    def _retomar(self, estado):
+        self.textos = ChunkTextWriter(self.db_dir, estado=estado["textos"])
+        if estado["vetores"]:
+            # O índice FAISS não entra no checkpoint: é refeito de vectors.f32 em finalizar()
+            self.vetores = VectorWriter(self.db_dir, estado["vetores"]["dim"], estado=estado["vetores"])
+        os.truncate(self._metas_path, estado["metas_bytes"])
+        with open(self._metas_path, "r", encoding="utf-8") as f:
+            for i, linha in enumerate(f):
+                meta = json.loads(linha)
+                self.metas.adicionar(meta)
+                self.chunk_ids.setdefault(meta["file"], []).append(i)
+        if not (len(self.metas) == len(self.textos) == (self.vetores.n if self.vetores else 0)):
+            raise ValueError("Checkpoint inconsistente: textos, metadados e vetores com tamanhos diferentes.")
+        self._metas_f = open(self._metas_path, "a", encoding="utf-8")
+
+    def __len__(self):
+        return len(self.textos)
+
+    def chunk_hashes(self):
+        hashes = self.metas.hashes
+        return {hashes[i:i + 32].hex() for i in range(0, len(hashes), 32)}
+
+    def adicionar(self, textos, metas, vetores):
+        vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+        if self.vetores is None:
+            self.vetores = VectorWriter(self.db_dir, vetores.shape[1])
+            if self.index_config["index_type"] in ("flat", "hnsw") and not self.index_config.get("reducao"):
+                index = criar_index_vazio(vetores.shape[1], self.index_config)
+                # Codificações treinadas (sq8/pq) esperam o fim, como IVF
+                self.index = index if index.is_trained else None
+        for texto, meta in zip(textos, metas):
+            i = self.textos.adicionar(texto)
+            self.metas.adicionar(meta)
+            self.chunk_ids.setdefault(meta["file"], []).append(i)
+            self._metas_f.write(json.dumps({k: v for k, v in meta.items() if k != "content_start"}, ensure_ascii=False) + "\n")
+        self.vetores.adicionar(vetores)
+        if self.index is not None:
+            self.index.add(vetores)
+
+    def checkpoint(self):
+        """Torna durável tudo o que foi adicionado e devolve o estado para retomar (ver `estado`)."""
+        self._metas_f.flush()
+        os.fsync(self._metas_f.fileno())
+        return {
+            "textos": self.textos.checkpoint(),
+            "vetores": self.vetores.checkpoint() if self.vetores else None,
+            "metas_bytes": os.path.getsize(self._metas_path)
+        }
+
+    def _ajustar_reducao(self, vetores):
+        """Ajusta a redução de dimensão configurada (se houver). Retorna (transformacao, info)."""
+        tipo, dim_saida = self.index_config.get("reducao"), self.index_config.get("reducao_dim")
+        n, dim = vetores.shape
+        if not tipo:
+            return None, None
+        if dim_saida >= dim or n < dim_saida:
+            print(f"⚠️ Redução {tipo} para {dim_saida} dims ignorada ({n} vetores de {dim} dims).")
+            return None, None
+        transformacao = ajustar_reducao(vetores, tipo, dim_saida, self.index_config["max_treino"])
+        aval = avaliar_reducao(transformacao, vetores)
+        print(
+            f"📉 Redução {tipo} {dim} → {dim_saida} dims: {aval['variancia_mantida']:.1%} da variância mantida, "
+            f"recall@{aval['k']} {aval['recall']:.3f} contra a busca em {dim} dims."
+        )
+        print(
+            f"⏱️ Busca flat em {aval['n_base']} vetores: {aval['ms_original']:.2f} ms → {aval['ms_reduzido']:.2f} ms por consulta "
+            f"({aval['ms_original'] / max(aval['ms_reduzido'], 1e-9):.1f}x)."
+        )
+        info = {"tipo": tipo, "dim_original": dim, "dim": dim_saida}
+        info.update({k: round(v, 4) if isinstance(v, float) else v for k, v in aval.items()})
+        return transformacao, info
+
+    @staticmethod
+    def _relatar_compressao(index, vetores, config, transformacao=None):
+        aval = avaliar_compressao(index, vetores, config, transformacao=transformacao)
+        economia = 1 - aval["bytes_index"] / aval["bytes_float32"]
+        print(
+            f"💾 Vetores: {aval['bytes_float32'] / 2**20:.1f} MB em float32 → índice com {aval['bytes_index'] / 2**20:.1f} MB "
+            f"({economia:.0%} a menos; vectors.f32 fica em disco, mapeado)."
+        )
+        linha = f"🎯 recall@{aval['k']} contra a busca exata: {aval['recall']:.3f}"
+        if "recall_rerank" in aval:
+            linha += f" | com re-rank (x{config['rerank_fator']}): {aval['recall_rerank']:.3f}"
+        print(linha)
+
+    def finalizar(self):
+        """Fecha os arquivos, conclui o índice FAISS e grava index_meta.json. Retorna o meta_info."""
+        self.textos.fechar()
+        self._metas_f.close()
+        vetores = self.vetores.fechar()
+        n, dim = vetores.shape
+        transformacao, info_reducao = self._ajustar_reducao(vetores)
+        dim_index = transformacao.d_out if transformacao is not None else dim
+        config = resolver_config(n, dim_index, self.index_config)
+        if transformacao is None:
+            config["reducao"] = None
+        index = self.index
+        if index is None or config["index_type"] != self.index_config["index_type"] or config["codificacao"] != self.index_config["codificacao"]:
+            index = criar_index_vazio(dim_index, config)
+            treinar_index(index, vetores, config, transformacao=transformacao)
+            for inicio in range(0, n, BLOCO_ADD):
+                index.add(aplicar_reducao(transformacao, vetores[inicio:inicio + BLOCO_ADD]))
+        aplicar_parametros_busca(index, config)
+        print(f"🧭 Índice {config['index_type']} ({config['codificacao']}, {dim_index} dims) construído com {index.ntotal} vetores.")
+        if e_compactado(config):
+            self._relatar_compressao(index, vetores, config, transformacao)
+
+        salvar_faiss(index, os.path.join(self.db_dir, "faiss.index"))
+        salvar_reducao(transformacao, self.db_dir)
+        info_lexico = None
+        if config.get("lexico", True):
+            info_lexico = construir_lexico(ChunkTextStore(self.db_dir), self.db_dir)
+            print(
+                f"🔤 Índice BM25: {info_lexico['termos']} termos, {info_lexico['postings']} postings, "
+                f"{info_lexico['bytes'] / 2**20:.1f} MB em {info_lexico['segundos']}s."
+            )
+        elif os.path.exists(os.path.join(self.db_dir, LEXICO_FILE)):
+            os.remove(os.path.join(self.db_dir, LEXICO_FILE))
+        self.metas.construir().salvar(self.db_dir)
+        meta_info = {
+            "created_at": datetime.now().isoformat(),
+            "indexer_version": self.indexer_version,
+            "embedding_model": self.embedding_model,
+            "embedding_dim": dim,
+            "index_dim": dim_index,
+            "reducao": info_reducao,
+            "lexico": info_lexico,
+            "index_config": config,
+            "index_config_pedido": self.index_config,  # antes do ajuste ao corpus: é o que a próxima execução compara
+            "n_chunks": n,
+            "n_files": len(self.chunk_ids),
+            "files_indexed": sorted(self.chunk_ids)
+        }
+        tmp_path = os.path.join(self.db_dir, "index_meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta_info, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.db_dir, "index_meta.json"))
+        os.remove(self._metas_path)
+        return meta_info
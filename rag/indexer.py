@@ -1,11 +1,28 @@
 import os
 import json
-from rag.index_manager import IndexManager
+import argparse
+from rag.index_manager import IndexManager, DEFAULT_LOADER_WORKERS, DEFAULT_LOADER_TIMEOUT, DEFAULT_MAX_EM_VOO, DEFAULT_CHECKPOINT_CHUNKS
+from rag.ann_index import TIPOS_INDEX, CODIFICACOES, carregar_config_index
 
 if __name__ == "__main__":
     TAGS_FILE = "./db/tags.json"
     DATA_DIR = "./data/"
 
+    parser = argparse.ArgumentParser(description="Indexa os arquivos listados em db/tags.json.")
+    parser.add_argument("--completo", action="store_true", help="Ignora o manifest e reconstrói o índice do zero.")
+    parser.add_argument("--retomar", "--resume", action="store_true", help="Continua a última execução interrompida a partir do checkpoint.")
+    parser.add_argument("--checkpoint-chunks", type=int, default=DEFAULT_CHECKPOINT_CHUNKS, help="Chunks entre checkpoints duráveis.")
+    parser.add_argument("--index-type", choices=TIPOS_INDEX, help="Tipo de índice FAISS (padrão: config/index_config.json).")
+    parser.add_argument("--codificacao", choices=CODIFICACOES, help="Como os vetores ficam no índice (padrão: config/index_config.json).")
+    parser.add_argument("--rerank-fator", type=int, help="Candidatos por resultado reordenados com os vetores exatos (0 desliga).")
+    parser.add_argument("--reducao", choices=["pca", "random"], help="Redução de dimensão ajustada no corpus e aplicada às consultas.")
+    parser.add_argument("--reducao-dim", type=int, help="Dimensão após a redução (ex.: 256, 512).")
+    parser.add_argument("--sem-lexico", action="store_true", help="Não constrói o índice BM25 (busca só vetorial).")
+    parser.add_argument("--workers-leitura", type=int, default=DEFAULT_LOADER_WORKERS, help="Processos para ler/limpar/chunkar arquivos.")
+    parser.add_argument("--timeout-leitura", type=int, default=DEFAULT_LOADER_TIMEOUT, help="Tempo limite por arquivo (s).")
+    parser.add_argument("--max-em-voo", type=int, default=DEFAULT_MAX_EM_VOO, help="Máximo de chunks em memória aguardando embedding/gravação.")
+    args = parser.parse_args()
+
     with open(TAGS_FILE, "r", encoding="utf-8") as f:
         tags = json.load(f)
 
@@ -17,5 +34,12 @@ if __name__ == "__main__":
 
     indexer = IndexManager()
     indexer.tags_file = TAGS_FILE
-    indexer.indexar_arquivos(arquivos)
-
+    indexer.index_config = carregar_config_index(
+        index_type=args.index_type, codificacao=args.codificacao, rerank_fator=args.rerank_fator,
+        reducao=args.reducao, reducao_dim=args.reducao_dim, lexico=False if args.sem_lexico else None
+    )
+    indexer.loader_workers = args.workers_leitura
+    indexer.loader_timeout = args.timeout_leitura
+    indexer.max_em_voo = args.max_em_voo
+    indexer.checkpoint_chunks = args.checkpoint_chunks
+    indexer.indexar_arquivos(arquivos, completo=args.completo, retomar=args.retomar)
@@ -0,0 +1,179 @@
+import os
+import re
+import math
+import time
+import unicodedata
+from array import array
+from collections import Counter
+import numpy as np
+
+LEXICO_FILE = "lexico.npz"
+DEFAULT_RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TF = 65535  # tf guardado em uint16
+
+# Identificadores como "1424/2025", "SR-01" ou "art.5" ficam inteiros (e também em partes);
+# pontos de milhar saem antes ("9.745" -> "9745", ver _RE_MILHAR)
+_RE_TOKEN = re.compile(r"[a-z0-9]+(?:[/.\-][a-z0-9]+)*")
+_RE_SEPARADOR = re.compile(r"[/.\-]")
+_RE_MILHAR = re.compile(r"(?<=\d)\.(?=\d{3}(?!\d))")  # ponto de milhar: 1.424/2025 -> 1424/2025
+
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por pelo pela pelos pelas para pra
+com sem sob sobre e ou que se ao aos ser foi como mais mas ja nao sim sua seu suas seus
+este esta estes estas esse essa esses essas isso isto aquele aquela qual quais quando onde
+lhe lhes ele ela eles elas me te nosso nossa ha tem entre ate apos desde
+""".split())
+
+def dobrar_acentos(texto):
+    """Minúsculas sem acentos: "Portaria nº 1.424 – São João" -> "portaria no 1.424 – sao joao"."""
+    decomposto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+def tokenizar(texto):
+    """Tokens para o BM25: sem acentos e stopwords; identificadores compostos saem inteiros e em partes."""
+    tokens = []
+    for token in _RE_TOKEN.findall(_RE_MILHAR.sub("", dobrar_acentos(texto))):
+        if _RE_SEPARADOR.search(token):
+            tokens.append(token)
+            tokens.extend(p for p in _RE_SEPARADOR.split(token) if p not in STOPWORDS)
+        elif token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+def construir_lexico(textos, db_dir):
+    """
+    Monta o índice invertido BM25 dos `textos` (na ordem dos ids do FAISS) e
+    grava em LEXICO_FILE: vocabulário ordenado num blob utf-8 e, por termo,
+    uma posting list contígua de (id int32, tf uint16). Retorna estatísticas.
+    """
+    inicio = time.perf_counter()
+    postings = {}
+    doc_len = array("i")
+    for i, texto in enumerate(textos):
+        contagem = Counter(tokenizar(texto))
+        doc_len.append(sum(contagem.values()))
+        for termo, tf in contagem.items():
+            lista = postings.get(termo)
+            if lista is None:
+                lista = postings[termo] = (array("i"), array("H"))
+            lista[0].append(i)
+            lista[1].append(min(tf, MAX_TF))
+
+    termos = sorted(postings)
+    post_ptr = np.zeros(len(termos) + 1, dtype=np.int64)
+    post_ptr[1:] = np.cumsum([len(postings[t][0]) for t in termos])
+    doc_ids = np.empty(post_ptr[-1], dtype=np.int32)
+    tfs = np.empty(post_ptr[-1], dtype=np.uint16)
+    for c, termo in enumerate(termos):
+        ids, tf = postings.pop(termo)
+        doc_ids[post_ptr[c]:post_ptr[c + 1]] = np.frombuffer(ids, dtype=np.int32)
+        tfs[post_ptr[c]:post_ptr[c + 1]] = np.frombuffer(tf, dtype=np.uint16)
+
+    path = os.path.join(db_dir, LEXICO_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            termos=np.frombuffer("\n".join(termos).encode("utf-8"), dtype=np.uint8),
+            post_ptr=post_ptr,
+            doc_ids=doc_ids,
+            tfs=tfs,
+            doc_len=np.frombuffer(doc_len, dtype=np.int32)
+        )
+    os.replace(tmp_path, path)
+    return {
+        "termos": len(termos),
+        "postings": int(post_ptr[-1]),
+        "bytes": os.path.getsize(path),
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+
+class LexicalIndex:
+    """Índice invertido BM25 dos chunks: consulta custa o tamanho das posting lists dos termos da pergunta."""
+
+    def __init__(self, termos, post_ptr, doc_ids, tfs, doc_len):
+        self.post_ptr = post_ptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.n_docs = len(doc_len)
+        self.media_len = float(doc_len.mean()) if len(doc_len) else 0.0
+        self._codigo = {t: c for c, t in enumerate(termos)}
+
+    @classmethod
+    def carregar(cls, db_dir):
+        with np.load(os.path.join(db_dir, LEXICO_FILE)) as dados:
+            blob = dados["termos"].tobytes().decode("utf-8")
+            return cls(
+                blob.split("\n") if blob else [],
+                dados["post_ptr"],
+                dados["doc_ids"],
+                dados["tfs"],
+                dados["doc_len"]
+            )
+
+    def postings(self, termo):
+        """Ids (crescentes) dos chunks que contêm o termo já normalizado."""
+        c = self._codigo.get(termo)
+        if c is None:
+            return self.doc_ids[:0]
+        return self.doc_ids[self.post_ptr[c]:self.post_ptr[c + 1]]
+
+    def ids_exatos(self, identificador):
+        """Chunks que contêm o identificador inteiro (ex.: "1424/2025", "Ceilândia"): um lookup no dicionário."""
+        tokens = tokenizar(identificador)
+        if not tokens:
+            return self.doc_ids[:0]
+        ids = self.postings(tokens[0])
+        for termo in tokens[1:]:
+            if len(ids) == 0:
+                break
+            ids = np.intersect1d(ids, self.postings(termo), assume_unique=True)
+        return ids
+
+    def buscar(self, texto, k, bitmap=None):
+        """
+        Top-k BM25 para o texto. `bitmap` (um bit por chunk, como em
+        MetaStore.filtro_tags) restringe os candidatos. Retorna (ids, scores).
+        """
+        ids_termos, pesos_termos = [], []
+        for termo in set(tokenizar(texto)):
+            c = self._codigo.get(termo)
+            if c is None:
+                continue
+            a, b = self.post_ptr[c], self.post_ptr[c + 1]
+            ids, tf = self.doc_ids[a:b], self.tfs[a:b]
+            if bitmap is not None:
+                dentro = (bitmap[ids >> 3] >> (ids & 7)) & 1 == 1
+                ids, tf = ids[dentro], tf[dentro]
+                if not len(ids):
+                    continue
+            idf = math.log(1 + (self.n_docs - (b - a) + 0.5) / ((b - a) + 0.5))
+            tf = tf.astype(np.float32)
+            norma = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[ids] / self.media_len)
+            ids_termos.append(ids)
+            pesos_termos.append(idf * tf * (BM25_K1 + 1) / norma)
+        if not ids_termos:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        candidatos, posicao = np.unique(np.concatenate(ids_termos), return_inverse=True)
+        scores = np.bincount(posicao, weights=np.concatenate(pesos_termos))
+        k = min(k, len(candidatos))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(candidatos) else np.arange(len(candidatos))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidatos[top].astype(np.int64), scores[top].astype(np.float32)
+
+def carregar_lexico(db_dir="./db"):
+    """LexicalIndex da geração, ou None se o índice foi construído sem ele."""
+    if not os.path.exists(os.path.join(db_dir, LEXICO_FILE)):
+        return None
+    return LexicalIndex.carregar(db_dir)
+
+def fundir_rrf(rankings, k, rrf_k=DEFAULT_RRF_K):
+    """Reciprocal rank fusion: soma 1/(rrf_k + posição) de cada lista de ids. Retorna os k ids fundidos."""
+    scores = {}
+    for ranking in rankings:
+        for posicao, i in enumerate(ranking, 1):
+            scores[int(i)] = scores.get(int(i), 0.0) + 1.0 / (rrf_k + posicao)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
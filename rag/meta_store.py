@@ -0,0 +1,328 @@
+import os
+import json
+from array import array
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta
+import numpy as np
+
+META_FILE = "meta.npz"
+CAMPOS = ("file", "fonte", "tags", "content_start", "chunk_hash", "created_at", "source_path", "indexer_version")
+CAMPOS_ARQUIVO = ("file", "fonte", "source_path")
+MAX_FILTROS_CACHE = 256  # combinações de tags com bitmap guardado
+
+_EPOCH = datetime(1970, 1, 1)
+_MICRO = timedelta(microseconds=1)
+
+def _iso_para_micros(iso):
+    if not iso:
+        return -1
+    return (datetime.fromisoformat(iso).replace(tzinfo=None) - _EPOCH) // _MICRO
+
+def _micros_para_iso(us):
+    return (_EPOCH + timedelta(microseconds=int(us))).isoformat() if us >= 0 else ""
+
+def _postings(codigos, n_codigos, linhas):
+    """Agrupa `linhas` por código: retorna uma lista (um array ordenado de linhas por código)."""
+    ordem = np.argsort(codigos, kind="stable")
+    fronteiras = np.searchsorted(codigos[ordem], np.arange(n_codigos + 1))
+    linhas_ordenadas = linhas[ordem]
+    return [linhas_ordenadas[fronteiras[c]:fronteiras[c + 1]] for c in range(n_codigos)]
+
+class MetaRow(Mapping):
+    """Visão dict-like (somente leitura) de uma linha do MetaStore."""
+
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, store, i):
+        self._store = store
+        self._i = i
+
+    def __getitem__(self, campo):
+        return self._store.valor(self._i, campo)
+
+    def __iter__(self):
+        return iter(self._store.campos())
+
+    def __len__(self):
+        return len(self._store.campos())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class MetaStore(Sequence):
+    """
+    Metadados dos chunks em colunas: arquivos, tags e versões ficam em
+    dicionários internados e cada chunk guarda só códigos inteiros.
+    Acesso por id em O(1) e posting lists por tag/arquivo para filtros.
+    Iterar/indexar devolve MetaRow, compatível com o antigo list-of-dicts.
+    """
+
+    def __init__(self, file_codes, tag_ptr, tag_codes, hashes, created_us, version_codes, arquivos, tags, versoes, recencia=None):
+        self.file_codes = file_codes
+        self.tag_ptr = tag_ptr
+        self.tag_codes = tag_codes
+        self.hashes = hashes
+        self.created_us = created_us
+        self.version_codes = version_codes
+        self.arquivos = arquivos
+        self.tag_nomes = tags
+        self.versoes = versoes
+        self.textos = None  # opcional: fonte de content_start
+        self._codigo_arquivo = {a["file"]: c for c, a in enumerate(arquivos)}
+        self._codigo_tag = {t: c for c, t in enumerate(tags)}
+        self._postings_tag = None
+        self._postings_arquivo = None
+        self._ids_hash = None
+        self._filtros = {}
+        self._recencia = recencia  # (ordem, ptr por tag, posições por tag), ver _get_recencia
+
+    def __len__(self):
+        return len(self.file_codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [MetaRow(self, j) for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return MetaRow(self, i)
+
+    def campos(self):
+        return CAMPOS if self.textos is not None else tuple(c for c in CAMPOS if c != "content_start")
+
+    def valor(self, i, campo):
+        if campo in CAMPOS_ARQUIVO:
+            return self.arquivos[self.file_codes[i]][campo]
+        if campo == "tags":
+            return self.tags_da_linha(i)
+        if campo == "chunk_hash":
+            return self.hashes[i].tobytes().hex()
+        if campo == "created_at":
+            return _micros_para_iso(self.created_us[i])
+        if campo == "indexer_version":
+            return self.versoes[self.version_codes[i]]
+        if campo == "content_start" and self.textos is not None:
+            return self.textos[i][:200]
+        raise KeyError(campo)
+
+    def tags_da_linha(self, i):
+        return [self.tag_nomes[c] for c in self.tag_codes[self.tag_ptr[i]:self.tag_ptr[i + 1]]]
+
+    def tags(self):
+        """Todas as tags presentes no índice, ordenadas."""
+        return sorted(t for t, ids in zip(self.tag_nomes, self._get_postings_tag()) if len(ids))
+
+    def _get_postings_tag(self):
+        if self._postings_tag is None:
+            linhas = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.tag_ptr))
+            self._postings_tag = _postings(self.tag_codes, len(self.tag_nomes), linhas)
+        return self._postings_tag
+
+    def _get_postings_arquivo(self):
+        if self._postings_arquivo is None:
+            self._postings_arquivo = _postings(self.file_codes, len(self.arquivos), np.arange(len(self), dtype=np.int64))
+        return self._postings_arquivo
+
+    def ids_com_tag(self, tag):
+        codigo = self._codigo_tag.get(tag)
+        if codigo is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._get_postings_tag()[codigo]
+
+    def ids_com_tags(self, tags, todas=False):
+        """Ids (ordenados) com qualquer uma das tags, ou com todas se `todas=True`. Sem tags: todos."""
+        if not tags:
+            return np.arange(len(self), dtype=np.int64)
+        listas = [self.ids_com_tag(t) for t in tags]
+        resultado = listas[0]
+        for ids in listas[1:]:
+            resultado = np.intersect1d(resultado, ids, assume_unique=True) if todas else np.union1d(resultado, ids)
+        return resultado
+
+    def filtro_tags(self, tags, todas=False):
+        """
+        (ids, bitmap) das linhas com as tags, para filtrar dentro da busca
+        vetorial: bitmap com um bit por linha (little-endian, formato do
+        faiss.IDSelectorBitmap). Guardado por conjunto de tags.
+        """
+        chave = (frozenset(tags), todas)
+        filtro = self._filtros.get(chave)
+        if filtro is None:
+            ids = self.ids_com_tags(tags, todas)
+            mascara = np.zeros(len(self), dtype=bool)
+            mascara[ids] = True
+            if len(self._filtros) >= MAX_FILTROS_CACHE:
+                self._filtros.clear()
+            filtro = self._filtros[chave] = (ids, np.packbits(mascara, bitorder="little"))
+        return filtro
+
+    def _get_recencia(self):
+        """
+        Ordem de recência (ids do mais novo ao mais antigo; empate pelo id) e,
+        por tag, as posições nessa ordem dos chunks com a tag, crescentes.
+        Gravada no meta.npz pelo indexador; calculada aqui só para índices antigos.
+        """
+        if self._recencia is None:
+            ordem = np.argsort(-self.created_us, kind="stable").astype(np.int64)
+            posicao = np.empty(len(self), dtype=np.int64)
+            posicao[ordem] = np.arange(len(self), dtype=np.int64)
+            linhas = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.tag_ptr))
+            por_tag = np.lexsort((posicao[linhas], self.tag_codes))
+            ptr = np.searchsorted(self.tag_codes[por_tag], np.arange(len(self.tag_nomes) + 1))
+            self._recencia = (ordem, ptr.astype(np.int64), posicao[linhas][por_tag])
+        return self._recencia
+
+    def recentes(self, tags=None, limit=5, inicio=0):
+        """
+        Ids dos chunks mais recentes (com qualquer uma das tags), a partir da
+        posição `inicio` da ordem de recência. Custa O(limit) por tag: cada
+        lista já está ordenada e só os `limit` primeiros de cada uma entram no merge.
+        Retorna (ids, próxima posição ou None se acabou).
+        """
+        ordem, ptr, posicoes = self._get_recencia()
+        if not tags:
+            fim = min(inicio + limit, len(ordem))
+            return ordem[inicio:fim], fim if fim < len(ordem) else None
+        restos = []
+        for tag in tags:
+            codigo = self._codigo_tag.get(tag)
+            if codigo is not None:
+                lista = posicoes[ptr[codigo]:ptr[codigo + 1]]
+                restos.append(lista[np.searchsorted(lista, inicio):])
+        if not restos:
+            return np.zeros(0, dtype=np.int64), None
+        pagina = np.unique(np.concatenate([r[:limit] for r in restos]))[:limit]  # chunk com várias tags conta uma vez
+        if not len(pagina):
+            return np.zeros(0, dtype=np.int64), None
+        proximo = int(pagina[-1]) + 1
+        if not any(len(r) and r[-1] >= proximo for r in restos):
+            proximo = None
+        return ordem[pagina], proximo
+
+    def ids_do_arquivo(self, arquivo):
+        codigo = self._codigo_arquivo.get(arquivo)
+        if codigo is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._get_postings_arquivo()[codigo]
+
+    def tem_arquivo(self, arquivo):
+        return len(self.ids_do_arquivo(arquivo)) > 0
+
+    def arquivos_indexados(self):
+        return [a["file"] for a, ids in zip(self.arquivos, self._get_postings_arquivo()) if len(ids)]
+
+    def id_do_hash(self, chunk_hash):
+        if self._ids_hash is None:
+            self._ids_hash = {h.tobytes(): i for i, h in enumerate(self.hashes)}
+        return self._ids_hash.get(bytes.fromhex(chunk_hash))
+
+    def chunk_hashes(self):
+        return [h.tobytes().hex() for h in self.hashes]
+
+    @classmethod
+    def from_dicts(cls, metas):
+        builder = MetaStoreBuilder()
+        for meta in metas:
+            builder.adicionar(meta)
+        return builder.construir()
+
+    def salvar(self, db_dir):
+        dicionarios = json.dumps(
+            {"arquivos": self.arquivos, "tags": self.tag_nomes, "versoes": self.versoes},
+            ensure_ascii=False
+        ).encode("utf-8")
+        ordem, recencia_ptr, recencia_tag = self._get_recencia()
+        path = os.path.join(db_dir, META_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                file_codes=self.file_codes,
+                tag_ptr=self.tag_ptr,
+                tag_codes=self.tag_codes,
+                hashes=self.hashes,
+                created_us=self.created_us,
+                version_codes=self.version_codes,
+                recencia=ordem,
+                recencia_ptr=recencia_ptr,
+                recencia_tag=recencia_tag,
+                dicionarios=np.frombuffer(dicionarios, dtype=np.uint8)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def carregar(cls, db_dir):
+        with np.load(os.path.join(db_dir, META_FILE)) as dados:
+            dicionarios = json.loads(dados["dicionarios"].tobytes().decode("utf-8"))
+            recencia = None
+            if "recencia" in dados.files:
+                recencia = (dados["recencia"], dados["recencia_ptr"], dados["recencia_tag"])
+            return cls(
+                dados["file_codes"],
+                dados["tag_ptr"],
+                dados["tag_codes"],
+                dados["hashes"],
+                dados["created_us"],
+                dados["version_codes"],
+                dicionarios["arquivos"],
+                dicionarios["tags"],
+                dicionarios["versoes"],
+                recencia
+            )
+
+class MetaStoreBuilder:
+    """
+    Monta um MetaStore incrementalmente, internando arquivos, tags e versões.
+    As colunas crescem em arrays compactos (poucas dezenas de bytes por chunk).
+    """
+
+    def __init__(self):
+        self.arquivos, self.tags, self.versoes = [], [], []
+        self._codigo_arquivo, self._codigo_tag, self._codigo_versao = {}, {}, {}
+        self.file_codes, self.tag_ptr, self.tag_codes = array("i"), array("q", [0]), array("i")
+        self.hashes, self.created_us, self.version_codes = bytearray(), array("q"), array("h")
+
+    def __len__(self):
+        return len(self.file_codes)
+
+    @staticmethod
+    def _internar(valor, lista, codigos):
+        codigo = codigos.get(valor)
+        if codigo is None:
+            codigo = codigos[valor] = len(lista)
+            lista.append(valor)
+        return codigo
+
+    def adicionar(self, meta):
+        arquivo = meta["file"]
+        codigo = self._codigo_arquivo.get(arquivo)
+        if codigo is None:
+            codigo = self._codigo_arquivo[arquivo] = len(self.arquivos)
+            self.arquivos.append({
+                "file": arquivo,
+                "fonte": meta.get("fonte", arquivo),
+                "source_path": meta.get("source_path", "")
+            })
+        self.file_codes.append(codigo)
+        for tag in dict.fromkeys(meta.get("tags", [])):
+            self.tag_codes.append(self._internar(tag, self.tags, self._codigo_tag))
+        self.tag_ptr.append(len(self.tag_codes))
+        chunk_hash = meta.get("chunk_hash")
+        self.hashes += bytes.fromhex(chunk_hash) if chunk_hash else bytes(32)
+        self.created_us.append(_iso_para_micros(meta.get("created_at")))
+        self.version_codes.append(self._internar(meta.get("indexer_version", ""), self.versoes, self._codigo_versao))
+
+    def construir(self):
+        return MetaStore(
+            np.array(self.file_codes, dtype=np.int32),
+            np.array(self.tag_ptr, dtype=np.int64),
+            np.array(self.tag_codes, dtype=np.int32),
+            np.frombuffer(bytes(self.hashes), dtype=np.uint8).reshape(-1, 32),
+            np.array(self.created_us, dtype=np.int64),
+            np.array(self.version_codes, dtype=np.int16),
+            list(self.arquivos),
+            list(self.tags),
+            list(self.versoes)
+        )
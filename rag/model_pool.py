@@ -0,0 +1,119 @@
+"""
+Pool de instâncias Llama: um contexto llama.cpp não aceita chamadas de
+várias threads ao mesmo tempo, e o Streamlit atende cada sessão numa thread.
+O pool tem N instâncias do mesmo modelo e as empresta por ordem de chegada
+(fila justa), com timeout; quem espera demais recebe PoolEsgotado.
+
+    with pool.emprestar() as llm:      # várias chamadas na mesma instância
+        saida = llm(prompt, stream=True)
+    pool.embed(texto)                  # atalho: empresta só durante a chamada
+"""
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_TIMEOUT_POOL = 120  # segundos na fila até desistir
+
+class PoolEsgotado(TimeoutError):
+    """Nenhuma instância do modelo ficou livre dentro do timeout."""
+
+class _Espera:
+    __slots__ = ("evento", "instancia")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.instancia = None
+
+def threads_por_instancia(instancias):
+    """Divide os núcleos entre as instâncias, para N modelos não disputarem os mesmos cores."""
+    return max(1, (os.cpu_count() or 1) // max(1, instancias))
+
+class PoolDeModelos:
+    """
+    N instâncias de um modelo, emprestadas em ordem FIFO. Uma instância
+    devolvida vai direto para o primeiro da fila, então ninguém fura a fila.
+    Chamadas diretas ao pool (pool(prompt), pool.embed(...)) pegam uma
+    instância só durante a chamada; atributos simples (n_batch...) vêm da primeira.
+    """
+
+    def __init__(self, criar, instancias=1, nome="modelo", timeout=DEFAULT_TIMEOUT_POOL):
+        self.nome = nome
+        self.timeout = timeout
+        self._instancias = [criar() for _ in range(max(1, instancias))]
+        self._livres = deque(self._instancias)
+        self._fila = deque()
+        self._lock = threading.Lock()
+        self.atendidos = 0
+        self.timeouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def adquirir(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        inicio = time.perf_counter()
+        with self._lock:
+            if self._livres and not self._fila:
+                self.atendidos += 1
+                return self._livres.popleft()
+            espera = _Espera()
+            self._fila.append(espera)
+        espera.evento.wait(timeout)
+        with self._lock:
+            # Conferido sob o lock: uma devolução pode ter chegado junto com o timeout
+            if espera.instancia is None:
+                self._fila.remove(espera)
+                self.timeouts += 1
+                raise PoolEsgotado(f"Nenhuma instância de {self.nome} livre em {timeout}s ({len(self._fila)} na fila).")
+            esperou = time.perf_counter() - inicio
+            self.atendidos += 1
+            self.espera_total += esperou
+            self.espera_max = max(self.espera_max, esperou)
+            return espera.instancia
+
+    def devolver(self, instancia):
+        with self._lock:
+            if self._fila:
+                espera = self._fila.popleft()
+                espera.instancia = instancia
+                espera.evento.set()
+            else:
+                self._livres.append(instancia)
+
+    @contextmanager
+    def emprestar(self, timeout=None):
+        instancia = self.adquirir(timeout)
+        try:
+            yield instancia
+        finally:
+            self.devolver(instancia)
+
+    def __call__(self, *args, **kwargs):
+        with self.emprestar() as instancia:
+            return instancia(*args, **kwargs)
+
+    def __getattr__(self, nome):
+        if nome.startswith("_"):
+            raise AttributeError(nome)
+        atributo = getattr(self._instancias[0], nome)
+        if not callable(atributo):
+            return atributo
+
+        def chamada(*args, **kwargs):
+            with self.emprestar() as instancia:
+                return getattr(instancia, nome)(*args, **kwargs)
+        return chamada
+
+    def stats(self):
+        with self._lock:
+            return {
+                "modelo": self.nome,
+                "instancias": len(self._instancias),
+                "livres": len(self._livres),
+                "fila": len(self._fila),
+                "atendidos": self.atendidos,
+                "timeouts": self.timeouts,
+                "espera_media_ms": round(self.espera_total / self.atendidos * 1000, 2) if self.atendidos else 0.0,
+                "espera_max_ms": round(self.espera_max * 1000, 2),
+            }
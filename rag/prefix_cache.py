@@ -0,0 +1,232 @@
+"""
+Cache do estado do llama.cpp (KV) para prefixos fixos de prompt: o system
+prompt do chat e o cabeçalho do template do RAGManager. Cada prefixo é
+avaliado uma vez por modelo; o estado (Llama.save_state) fica num LRU em
+memória (limitado em bytes) e em disco (db/prefix_cache/, gravado em
+segundo plano), e cada geração começa com load_state, pulando o prefill
+desses tokens. Só prefixos fixos entram aqui, nunca prompts editados pelo usuário.
+
+    python -m rag.prefix_cache stats
+    python -m rag.prefix_cache limpar
+"""
+import os
+import json
+import pickle
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from rag.query_cache import identidade_modelo
+
+PREFIX_CACHE_DIR = "./db/prefix_cache"
+DEFAULT_MAX_MEMORIA_MB = 1024   # estados em memória por processo (cada um tem o KV e os logits do prefixo)
+DEFAULT_MAX_DISCO_MB = 1024
+DEFAULT_MIN_TOKENS = 16         # prefixos menores não compensam a cópia do estado
+
+def tamanho_estado(estado):
+    """Bytes de um LlamaState: KV/estado do contexto mais os buffers de tokens e logits."""
+    tamanho = getattr(estado, "llama_state_size", 0) or len(getattr(estado, "llama_state", b""))
+    for campo in ("scores", "input_ids"):
+        tamanho += getattr(getattr(estado, campo, None), "nbytes", 0)
+    return tamanho
+
+def _prefixo_comum(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+class PrefixCache:
+    """
+    Estados do llama.cpp por (modelo, n_ctx, texto do prefixo). preparar()
+    deixa uma instância com o prefixo já avaliado antes da geração; o llama.cpp
+    reaproveita os tokens iniciais que batem com o prompt e só avalia o resto.
+    """
+
+    def __init__(self, path=PREFIX_CACHE_DIR, max_memoria_mb=DEFAULT_MAX_MEMORIA_MB, max_disco_mb=DEFAULT_MAX_DISCO_MB, min_tokens=DEFAULT_MIN_TOKENS):
+        self.path = path
+        self.max_memoria_bytes = int(max_memoria_mb * 2**20)
+        self.max_disco_bytes = int(max_disco_mb * 2**20)
+        self.min_tokens = min_tokens
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.hits_residentes = 0
+        self.misses = 0
+        self.tokens_poupados = 0
+        self._lru = OrderedDict()  # chave -> (estado, bytes)
+        self._bytes_memoria = 0
+        self._lock = threading.Lock()
+        # Gravação em disco (pickle de centenas de MB) fora do caminho da pergunta
+        self._gravador = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(path, exist_ok=True)
+
+    def _chave(self, llm, prefixo):
+        return hashlib.sha256(f"{identidade_modelo(llm.model_path)}\n{llm.n_ctx()}\n{prefixo}".encode("utf-8")).hexdigest()
+
+    def _arquivo(self, chave):
+        return os.path.join(self.path, chave + ".state")
+
+    def _obter(self, chave):
+        with self._lock:
+            item = self._lru.get(chave)
+            if item is not None:
+                self._lru.move_to_end(chave)
+                self.hits_memoria += 1
+                return item[0]
+        try:
+            with open(self._arquivo(chave), "rb") as f:
+                estado = pickle.load(f)
+            os.utime(self._arquivo(chave))
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"⚠️ Estado de prefixo ilegível, será recalculado: {e}")
+            return None
+        with self._lock:
+            self.hits_disco += 1
+            self._guardar_memoria(chave, estado)
+        return estado
+
+    def _guardar(self, chave, estado):
+        with self._lock:
+            self._guardar_memoria(chave, estado)
+        self._gravador.submit(self._gravar, chave, estado)
+
+    def _gravar(self, chave, estado):
+        path = self._arquivo(chave)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(estado, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._despejar_disco()
+        except OSError as e:
+            print(f"⚠️ Falha ao gravar estado de prefixo: {e}")
+
+    def _guardar_memoria(self, chave, estado):
+        tamanho = tamanho_estado(estado)
+        if tamanho > self.max_memoria_bytes:
+            return  # maior que o limite inteiro: fica só no disco
+        antigo = self._lru.pop(chave, None)
+        if antigo is not None:
+            self._bytes_memoria -= antigo[1]
+        self._lru[chave] = (estado, tamanho)
+        self._bytes_memoria += tamanho
+        while self._bytes_memoria > self.max_memoria_bytes:
+            _, (_, liberado) = self._lru.popitem(last=False)
+            self._bytes_memoria -= liberado
+
+    def _arquivos(self):
+        arquivos = []
+        for nome in os.listdir(self.path):
+            if nome.endswith(".state"):
+                try:
+                    st = os.stat(os.path.join(self.path, nome))
+                except FileNotFoundError:
+                    continue
+                arquivos.append((st.st_mtime, st.st_size, nome))
+        return sorted(arquivos)
+
+    def _despejar_disco(self):
+        """Acima do limite, apaga os estados usados há mais tempo até 90% dele."""
+        arquivos = self._arquivos()
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, nome in arquivos:
+            if total <= self.max_disco_bytes * 0.9:
+                break
+            try:
+                os.remove(os.path.join(self.path, nome))
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+
+    def preparar(self, llm, prefixo, prompt):
+        """
+        Deixa `llm` (uma instância já emprestada, não o pool) com o estado do
+        prefixo carregado. Retorna quantos tokens do `prompt` a geração
+        reaproveita sem avaliar (no miss, os que acabaram de ser avaliados
+        aqui; só os hits contam em tokens_poupados).
+        """
+        tokens = llm.tokenize(prefixo.encode("utf-8"), special=True)
+        if len(tokens) < self.min_tokens:
+            return 0
+        # O último token do prompt é sempre reavaliado; a fronteira prefixo/contexto pode tokenizar diferente
+        alvo = llm.tokenize(prompt.encode("utf-8"), special=True)
+        poupados = min(_prefixo_comum(tokens, alvo), len(alvo) - 1)
+        if poupados < self.min_tokens:
+            return 0
+
+        # A instância ainda tem o prefixo da geração anterior: nada a restaurar
+        if llm.n_tokens >= len(tokens) and list(llm.input_ids[:len(tokens)]) == tokens:
+            with self._lock:
+                self.hits_residentes += 1
+                self.tokens_poupados += poupados
+            return poupados
+
+        chave = self._chave(llm, prefixo)
+        estado = self._obter(chave)
+        if estado is None:
+            llm.reset()
+            llm.eval(tokens)
+            self._guardar(chave, llm.save_state())
+            with self._lock:
+                self.misses += 1
+            return poupados
+        llm.load_state(estado)
+        with self._lock:
+            self.tokens_poupados += poupados
+        return poupados
+
+    def stats(self):
+        arquivos = self._arquivos()
+        with self._lock:
+            return {
+                "memoria": len(self._lru),
+                "memoria_bytes": self._bytes_memoria,
+                "disco_entradas": len(arquivos),
+                "disco_bytes": sum(tamanho for _, tamanho, _ in arquivos),
+                "hits_residentes": self.hits_residentes,
+                "hits_memoria": self.hits_memoria,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+                "tokens_poupados": self.tokens_poupados,
+            }
+
+    def limpar(self):
+        with self._lock:
+            self._lru.clear()
+            self._bytes_memoria = 0
+        self._gravador.submit(lambda: None).result()  # espera gravações pendentes
+        for _, _, nome in self._arquivos():
+            try:
+                os.remove(os.path.join(self.path, nome))
+            except FileNotFoundError:
+                pass
+
+# Um cache por diretório em cada processo, como o de perguntas
+_caches = {}
+_caches_lock = threading.Lock()
+
+def cache_de_prefixos(path=PREFIX_CACHE_DIR):
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = PrefixCache(path)
+        return cache
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache de estados de prefixo do llama.cpp.")
+    parser.add_argument("comando", choices=["stats", "limpar"])
+    args = parser.parse_args()
+
+    cache = cache_de_prefixos()
+    if args.comando == "limpar":
+        cache.limpar()
+        print("🧹 Cache de prefixos esvaziado.")
+    print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
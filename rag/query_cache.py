@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+QUERY_CACHE_DB = "./db/query_cache.db"
+DEFAULT_MAX_MEMORIA = 2048      # embeddings no LRU de cada processo
+DEFAULT_MAX_DISCO_MB = 256      # tamanho máximo dos vetores no sqlite compartilhado
+
+def normalizar_pergunta(texto):
+    """Chave textual da pergunta: NFC, minúsculas e espaços colapsados."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", texto).casefold()).strip()
+
+def identidade_modelo(model_path):
+    """Identifica o modelo pelo arquivo (nome e tamanho): outro GGUF, outra entrada no cache."""
+    try:
+        return f"{os.path.basename(model_path)}:{os.path.getsize(model_path)}"
+    except OSError:
+        return os.path.basename(model_path)
+
+class QueryEmbeddingCache:
+    """
+    Cache de embeddings de perguntas em dois níveis: LRU em memória (por
+    processo) e um sqlite compartilhado entre processos e reinícios. Chave:
+    sha256(modelo + pergunta normalizada). Guarda o embedding bruto do modelo,
+    antes da redução de dimensão, que muda com a geração do índice.
+    """
+
+    def __init__(self, modelo, path=QUERY_CACHE_DB, max_memoria=DEFAULT_MAX_MEMORIA, max_disco_mb=DEFAULT_MAX_DISCO_MB):
+        self.modelo = modelo
+        self.path = path
+        self.max_memoria = max_memoria
+        self.max_disco_bytes = int(max_disco_mb * 2**20)
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            chave TEXT PRIMARY KEY,
+            modelo TEXT NOT NULL,
+            vetor BLOB NOT NULL,
+            bytes INTEGER NOT NULL,
+            usado REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_usado ON embeddings (usado)")
+        self.conn.commit()
+
+    def _chave(self, texto):
+        return hashlib.sha256(f"{self.modelo}\n{normalizar_pergunta(texto)}".encode("utf-8")).hexdigest()
+
+    def obter(self, texto):
+        """Embedding bruto da pergunta, ou None. Um hit no disco sobe para o LRU."""
+        chave = self._chave(texto)
+        with self._lock:
+            vetor = self._lru.get(chave)
+            if vetor is not None:
+                self._lru.move_to_end(chave)
+                self.hits_memoria += 1
+                return vetor
+            try:
+                linha = self.conn.execute("SELECT vetor FROM embeddings WHERE chave=?", (chave,)).fetchone()
+                if linha is not None:
+                    self.conn.execute("UPDATE embeddings SET usado=?, hits=hits+1 WHERE chave=?", (time.time(), chave))
+                    self.conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Cache de perguntas indisponível: {e}")
+                linha = None
+            if linha is None:
+                self.misses += 1
+                return None
+            self.hits_disco += 1
+            vetor = np.frombuffer(linha[0], dtype=np.float32)
+            self._guardar_memoria(chave, vetor)
+            return vetor
+
+    def guardar(self, texto, vetor):
+        chave = self._chave(texto)
+        vetor = np.ascontiguousarray(vetor, dtype=np.float32)
+        with self._lock:
+            self._guardar_memoria(chave, vetor)
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (chave, modelo, vetor, bytes, usado) VALUES (?, ?, ?, ?, ?)",
+                    (chave, self.modelo, vetor.tobytes(), vetor.nbytes, time.time())
+                )
+                self._despejar_disco()
+                self.conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Falha ao gravar no cache de perguntas: {e}")
+
+    def _guardar_memoria(self, chave, vetor):
+        self._lru[chave] = vetor
+        self._lru.move_to_end(chave)
+        while len(self._lru) > self.max_memoria:
+            self._lru.popitem(last=False)
+
+    def _despejar_disco(self):
+        """Acima do limite, remove os menos usados recentemente até 90% dele."""
+        total = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_disco_bytes:
+            return 0
+        alvo = total - int(self.max_disco_bytes * 0.9)
+        removidos, liberados = 0, 0
+        for chave, n_bytes in self.conn.execute("SELECT chave, bytes FROM embeddings ORDER BY usado").fetchall():
+            if liberados >= alvo:
+                break
+            self.conn.execute("DELETE FROM embeddings WHERE chave=?", (chave,))
+            removidos += 1
+            liberados += n_bytes
+        return removidos
+
+    def stats(self):
+        consultas = self.hits_memoria + self.hits_disco + self.misses
+        with self._lock:
+            entradas, n_bytes = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM embeddings WHERE modelo=?", (self.modelo,)
+            ).fetchone()
+        return {
+            "modelo": self.modelo,
+            "memoria": len(self._lru),
+            "disco_entradas": entradas,
+            "disco_bytes": n_bytes,
+            "hits_memoria": self.hits_memoria,
+            "hits_disco": self.hits_disco,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_memoria + self.hits_disco) / consultas, 4) if consultas else 0.0,
+        }
+
+    def limpar(self):
+        with self._lock:
+            self._lru.clear()
+            self.conn.execute("DELETE FROM embeddings WHERE modelo=?", (self.modelo,))
+            self.conn.commit()
+
+# Um cache por modelo e arquivo em cada processo: o LRU sobrevive aos
+# EmbeddingHandler/ChatManager recriados a cada página do Streamlit.
+_caches = {}
+_caches_lock = threading.Lock()
+
+def cache_de_perguntas(model_path, path=QUERY_CACHE_DB):
+    chave = (identidade_modelo(model_path), path)
+    with _caches_lock:
+        cache = _caches.get(chave)
+        if cache is None:
+            cache = _caches[chave] = QueryEmbeddingCache(chave[0], path)
+        return cache
+
+def main():
+    from chat.chat_manager import load_embedding_model_path
+
+    parser = argparse.ArgumentParser(description="Cache de embeddings de perguntas.")
+    parser.add_argument("comando", choices=["stats", "limpar"])
+    args = parser.parse_args()
+
+    cache = cache_de_perguntas(load_embedding_model_path())
+    if args.comando == "limpar":
+        cache.limpar()
+        print("🧹 Cache de perguntas esvaziado.")
+    print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,44 @@
+import time
 import numpy as np
-from rag.retriever import Retriever
 from rag.embedding_handler import EmbeddingHandler
+from rag.registry import obter_retriever, obter_modelo_geracao
 import os
 
 # Importe a função busca_tabela_estruturada corretamente.
-from chat.chat_manager import busca_tabela_estruturada
+from chat.chat_manager import busca_tabela_estruturada, gerar_stream
+
+DEFAULT_LOTE_PERGUNTAS = 64  # perguntas embeddadas e buscadas juntas
+
+# Início fixo do prompt: avaliado uma vez por modelo e restaurado do cache de prefixos
+PREFIXO_PROMPT = """Responda com base no contexto abaixo. Seja claro, objetivo e cite as fontes quando possível.
+
+### CONTEXTO:
+"""
+
+def _ms(inicio):
+    return round((time.perf_counter() - inicio) * 1000, 2)
+
+def _ratear(tempos, posicoes, etapa, ms):
+    """Divide o tempo de uma etapa feita em lote entre as perguntas que participaram dela."""
+    for p in posicoes:
+        tempos[p][etapa] = round(ms / len(posicoes), 2)
 
 class RAGManager:
     def __init__(self, model=None):
-        self.retriever = Retriever()
+        # Modelos e índice vêm do registro do processo: criar um RAGManager por
+        # rerun do Streamlit custa uma consulta, não uma carga de modelo
+        self.retriever = obter_retriever()
         self.emb_handler = EmbeddingHandler()
-        self.model = model or self.emb_handler.model  # pega da instância
+        self.model = model or obter_modelo_geracao()
         self.max_tokens = 1500  # pode ajustar baseado no modelo local
 
-    def responder_pergunta(self, pergunta, tags=None, return_score=False, temperature=0.5):
+    def responder_pergunta(self, pergunta, tags=None, return_score=False, temperature=0.5, stream=False, metricas=None):
+        """
+        Com stream=True a resposta (fora a tabular) é um gerador do texto
+        parcial, para exibir conforme os tokens saem; `metricas` recebe os
+        tempos de embedding e busca e, ao fim do gerador, ttft_ms e tokens.
+        """
+        metricas = {} if metricas is None else metricas
         # === Busca tabular estruturada antes de tudo ===
         tabular_resultado = busca_tabela_estruturada(pergunta)
         # tabular_resultado pode ser (lista, estado, fonte_csv) ou None
@@ -31,16 +56,23 @@ class RAGManager:
         # === FIM DO PATCH ===
 
         # Gera embedding da pergunta
+        inicio = time.perf_counter()
         emb = self.emb_handler.embeddar(pergunta)
+        metricas["embedding_ms"] = _ms(inicio)
 
         # Busca documentos relevantes
-        documentos = self.retriever.buscar(emb, tags=tags)
+        inicio = time.perf_counter()
+        documentos = self.retriever.buscar(emb, tags=tags, texto=pergunta)
+        metricas["busca_ms"] = _ms(inicio)
 
         # Gera o contexto com os documentos recuperados
         contexto = self._montar_contexto(documentos)
 
         # Gera a resposta com o modelo local
-        resposta = self._gerar_resposta(pergunta, contexto, temperature)
+        if stream:
+            resposta = self._gerar_resposta_stream(pergunta, contexto, temperature, metricas)
+        else:
+            resposta = self._gerar_resposta(pergunta, contexto, temperature)
 
         # Estima confiabilidade
         score = self._estimar_score(documentos)
@@ -51,6 +83,84 @@ class RAGManager:
             return resposta, fontes, score
         return resposta
 
+    def responder_lote(self, perguntas, k=20, temperature=0.5, lote=DEFAULT_LOTE_PERGUNTAS):
+        """
+        Responde várias perguntas ({"id", "pergunta", "tags"}) reaproveitando o
+        trabalho comum: embeddings em lote (perguntas repetidas uma vez só), uma
+        busca matricial por conjunto de tags, texto dos chunks lido uma vez e
+        contexto montado uma vez para perguntas com os mesmos hits.
+        Gera um registro por pergunta, na ordem, com resposta, fontes, score,
+        hits e tempos por etapa (as etapas em lote aparecem rateadas).
+        """
+        for inicio in range(0, len(perguntas), lote):
+            yield from self._responder_bloco(perguntas[inicio:inicio + lote], k, temperature)
+
+    def _responder_bloco(self, perguntas, k, temperature):
+        n = len(perguntas)
+        tempos = [{} for _ in range(n)]
+        registros = [None] * n
+
+        # Busca tabular estruturada, como em responder_pergunta
+        pendentes = []
+        for p, item in enumerate(perguntas):
+            t0 = time.perf_counter()
+            tabular_resultado = busca_tabela_estruturada(item["pergunta"])
+            tempos[p]["tabular_ms"] = _ms(t0)
+            if (
+                tabular_resultado and
+                isinstance(tabular_resultado, tuple) and
+                isinstance(tabular_resultado[0], list) and
+                len(tabular_resultado[0]) > 0
+            ):
+                lista, estado, fonte_csv = tabular_resultado
+                registros[p] = {"resposta": lista, "estado": estado, "fontes": [fonte_csv], "score": 1.0, "hits": []}
+            else:
+                pendentes.append(p)
+
+        # Embeddings em lote: cada texto distinto uma vez
+        textos = list(dict.fromkeys(perguntas[p]["pergunta"] for p in pendentes))
+        t0 = time.perf_counter()
+        embs, falhas = self.emb_handler.embeddar_lote(textos) if textos else (None, [])
+        _ratear(tempos, pendentes, "embedding_ms", _ms(t0))
+        linha = {texto: i for i, texto in enumerate(textos)}
+
+        # Uma busca matricial por conjunto de tags
+        grupos = {}
+        for p in pendentes:
+            grupos.setdefault(tuple(perguntas[p].get("tags") or ()), []).append(p)
+        documentos = {}
+        for tags, membros in grupos.items():
+            t0 = time.perf_counter()
+            resultados = self.retriever.buscar_lote(
+                embs[[linha[perguntas[p]["pergunta"]] for p in membros]], tags=list(tags) or None, k=k,
+                textos=[perguntas[p]["pergunta"] for p in membros]
+            )
+            _ratear(tempos, membros, "busca_ms", _ms(t0))
+            documentos.update(zip(membros, resultados))
+
+        contextos = {}
+        for p in pendentes:
+            docs = documentos[p]
+            t0 = time.perf_counter()
+            chave = tuple(meta["chunk_hash"] for _, meta, _ in docs)  # mesmos hits, mesmo contexto
+            contexto = contextos.get(chave)
+            if contexto is None:
+                contexto = contextos[chave] = self._montar_contexto(docs)
+            tempos[p]["contexto_ms"] = _ms(t0)
+            t0 = time.perf_counter()
+            resposta = self._gerar_resposta(perguntas[p]["pergunta"], contexto, temperature)
+            tempos[p]["geracao_ms"] = _ms(t0)
+            registros[p] = {
+                "resposta": resposta,
+                "fontes": list(dict.fromkeys(doc[1].get("fonte", "Desconhecida") for doc in docs if doc[1])),
+                "score": self._estimar_score(docs),
+                "hits": [{"fonte": meta.get("fonte", "Desconhecida"), "chunk_hash": meta["chunk_hash"], "distancia": float(dist)} for _, meta, dist in docs],
+                "embedding_falhou": linha[perguntas[p]["pergunta"]] in falhas,
+            }
+
+        for item, registro, tempo in zip(perguntas, registros, tempos):
+            yield {"id": item.get("id"), "pergunta": item["pergunta"], **registro, "tempos": tempo}
+
     def _montar_contexto(self, documentos):
         contexto = ""
         for doc, meta, dist in documentos:
@@ -58,24 +168,35 @@ class RAGManager:
             contexto += trecho + "\n\n"
         return contexto.strip()
 
-    def _gerar_resposta(self, pergunta, contexto, temperature=0.5):
-        prompt = f"""Responda com base no contexto abaixo. Seja claro, objetivo e cite as fontes quando possível.
-
-### CONTEXTO:
-{contexto}
+    def _prompt(self, pergunta, contexto):
+        return PREFIXO_PROMPT + f"""{contexto}
 
 ### PERGUNTA:
 {pergunta}
 
 ### RESPOSTA:"""
 
-        resposta = self.model(prompt)
+    def _gerar_resposta(self, pergunta, contexto, temperature=0.5):
+        resposta = self.model(self._prompt(pergunta, contexto), max_tokens=self.max_tokens, temperature=temperature)
         return resposta["choices"][0]["text"].strip()
 
+    def _gerar_resposta_stream(self, pergunta, contexto, temperature=0.5, metricas=None):
+        """Texto parcial da resposta a cada token; o último é o final, igual ao de _gerar_resposta."""
+        return gerar_stream(
+            self.model,
+            self._prompt(pergunta, contexto),
+            metricas,
+            max_linhas=None,
+            prefixo=PREFIXO_PROMPT,
+            max_tokens=self.max_tokens,
+            temperature=temperature
+        )
+
     def _estimar_score(self, documentos):
         if not documentos:
             return 0.0
-        distancia = documentos[0][2]
+        # Depois da fusão RRF o primeiro não é necessariamente o mais próximo: vale a menor distância densa
+        distancia = min(doc[2] for doc in documentos)
         score = max(0.0, min(1.0, 1 - distancia))
         return score
 
@@ -0,0 +1,109 @@
+"""
+Registro do processo: cada modelo (por caminho e parâmetros) e o Retriever
+de cada db_dir são carregados uma única vez e compartilhados entre reruns
+do Streamlit e sessões simultâneas. Cada modelo é um PoolDeModelos com
+generation_instances/embedding_instances instâncias (model_config.json),
+emprestadas por fila justa. Geração e embedding têm pools próprios mesmo
+com o mesmo GGUF (n_ctx e embedding=True diferem). O Retriever carrega cada geração do índice uma
+vez e troca de geração sozinho quando db/CURRENT muda.
+
+    from rag.registry import aquecer, obter_modelo, obter_retriever
+    aquecer()   # no início do app: carrega tudo antes do primeiro clique
+"""
+import time
+import threading
+from llama_cpp import Llama
+from chat.chat_manager import load_model_config, load_model_path, load_embedding_model_path, LLAMA_N_CTX
+from rag.retriever import Retriever
+from rag.model_pool import PoolDeModelos, threads_por_instancia, DEFAULT_TIMEOUT_POOL
+
+_modelos = {}
+_retrievers = {}
+_aquecidos = set()
+_lock = threading.Lock()
+_carregando = {}  # chave -> Lock: cargas diferentes não esperam umas pelas outras
+
+def _lock_de(chave):
+    with _lock:
+        return _carregando.setdefault(chave, threading.Lock())
+
+def obter_modelo(model_path, instancias=1, **parametros):
+    """
+    Pool compartilhado para (caminho, parâmetros); na primeira chamada carrega
+    `instancias` Llamas, dividindo os núcleos entre elas.
+    """
+    chave = (model_path, tuple(sorted(parametros.items())))
+    modelo = _modelos.get(chave)
+    if modelo is not None:
+        return modelo
+    with _lock_de(chave):
+        modelo = _modelos.get(chave)
+        if modelo is None:
+            inicio = time.perf_counter()
+            if instancias > 1:
+                parametros.setdefault("n_threads", threads_por_instancia(instancias))
+            modelo = PoolDeModelos(
+                lambda: Llama(model_path=model_path, **parametros),
+                instancias,
+                nome=model_path,
+                timeout=load_model_config().get("pool_timeout", DEFAULT_TIMEOUT_POOL)
+            )
+            _modelos[chave] = modelo
+            print(f"📦 Modelo {model_path} carregado ({instancias} instância(s)) em {time.perf_counter() - inicio:.1f}s.")
+        return modelo
+
+def _instancias():
+    config = load_model_config()
+    return config.get("generation_instances", 1), config.get("embedding_instances", 1)
+
+def obter_modelo_embedding():
+    return obter_modelo(
+        load_embedding_model_path(),
+        _instancias()[1],
+        embedding=True,
+        n_ctx=load_model_config().get("embedding_n_ctx", 2048)
+    )
+
+def obter_modelo_geracao():
+    """Modelo de geração, com o n_ctx de LLAMA_N_CTX; nunca o pool de embedding, que tem outro contexto."""
+    return obter_modelo(load_model_path(), _instancias()[0], n_ctx=LLAMA_N_CTX, verbose=False)
+
+def estatisticas():
+    """Fila, instâncias livres e tempo de espera de cada pool carregado."""
+    return [modelo.stats() for modelo in list(_modelos.values())]
+
+def obter_retriever(db_dir="./db"):
+    """Retriever compartilhado do db_dir (thread-safe; cada geração do índice é carregada uma vez)."""
+    retriever = _retrievers.get(db_dir)
+    if retriever is not None:
+        return retriever
+    with _lock_de(("retriever", db_dir)):
+        retriever = _retrievers.get(db_dir)
+        if retriever is None:
+            retriever = _retrievers[db_dir] = Retriever(db_dir)
+        return retriever
+
+def aquecer(db_dir="./db"):
+    """
+    Carrega modelos e índice, faz uma consulta de aquecimento (embedding +
+    busca) e avalia o prefixo do template, para que o mmap do índice, os
+    buffers do llama.cpp e o estado do prefixo já estejam prontos no primeiro
+    clique. Idempotente: depois da primeira vez, custa nada.
+    """
+    if db_dir in _aquecidos:
+        return
+    with _lock_de(("aquecer", db_dir)):
+        if db_dir in _aquecidos:
+            return
+        inicio = time.perf_counter()
+        from rag.embedding_handler import EmbeddingHandler
+        obter_modelo_geracao()
+        retriever = obter_retriever(db_dir)
+        retriever.buscar(EmbeddingHandler(db_dir).embeddar("aquecimento"), k=1)
+        # Estado do prefixo do template já pronto (em memória e em disco) para a primeira pergunta
+        from rag.rag_manager import PREFIXO_PROMPT
+        from rag.prefix_cache import cache_de_prefixos
+        with obter_modelo_geracao().emprestar() as llm:
+            cache_de_prefixos().preparar(llm, PREFIXO_PROMPT, PREFIXO_PROMPT + "aquecimento")
+        _aquecidos.add(db_dir)
+        print(f"🔥 Aquecimento concluído em {time.perf_counter() - inicio:.1f}s.")
@@ -1,50 +1,253 @@
+import threading
 import numpy as np
-from rag.index_manager import carregar_index
+from rag.index_manager import carregar_index, carregar_rerank, carregar_index_meta
+from rag.ann_index import buscar, buscar_filtrado, buscar_exato_em
+from rag.lexical_index import carregar_lexico, fundir_rrf, DEFAULT_RRF_K
+from rag.dim_reduction import carregar_reducao, aplicar_reducao
+from rag.generations import abrir_com_lease, coletar_geracoes, PonteiroAtual, DEFAULT_INTERVALO_CHECAGEM
+
+DEFAULT_CANDIDATOS_FUSAO = 50  # candidatos de cada ranking (vetorial e BM25) na fusão
+
+class GeracaoCarregada:
+    """Tudo o que uma busca precisa de uma geração do índice; nunca é alterado depois de criado."""
+
+    def __init__(self, db_dir):
+        self.db_dir = db_dir
+        self.lease = None
+        self.nome, gen_dir, self.lease = abrir_com_lease(db_dir)
+        try:
+            # Carrega índice FAISS, documentos e metadados
+            self.index, self.docs, self.meta, self.emb_dim = carregar_index(gen_dir)
+            # Vetores exatos (mapeados) para re-rank, se o índice for compactado com rerank_fator
+            self.vetores_exatos, self.rerank_fator = carregar_rerank(gen_dir, self.emb_dim)
+            # Redução de dimensão da geração: aplicada às consultas (brutas) e aos vetores exatos do re-rank
+            self.reducao = carregar_reducao(gen_dir)
+            # Índice BM25 (None se a geração foi construída sem ele) e constante da fusão
+            self.lexico = carregar_lexico(gen_dir)
+            self.rrf_k = carregar_index_meta(gen_dir).get("index_config", {}).get("rrf_k", DEFAULT_RRF_K)
+        except Exception:
+            # Carga falhou: o lease não pode ficar segurando a geração até vencer
+            self.liberar()
+            raise
+
+    def liberar(self):
+        """Solta o lease e apaga as gerações que ficaram sem uso (esta, se já foi substituída)."""
+        if self.lease is not None:
+            self.lease.liberar()
+            self.lease = None
+            try:
+                coletar_geracoes(self.db_dir)
+            except OSError as e:
+                print(f"⚠️ Falha ao remover gerações antigas do índice: {e}")
+
+    def __del__(self):
+        self.liberar()
 
 class Retriever:
-    def __init__(self):
-        # Carrega índice FAISS, documentos e metadados
-        self.index, self.docs, self.meta, self.emb_dim = carregar_index()
+    def __init__(self, db_dir="./db", intervalo_checagem=DEFAULT_INTERVALO_CHECAGEM):
+        self.db_dir = db_dir
+        # O ponteiro é observado antes de abrir: uma publicação no meio da carga é vista na próxima busca
+        self._ponteiro = PonteiroAtual(db_dir, intervalo_checagem)
+        self._lock = threading.Lock()
+        self._geracao = GeracaoCarregada(db_dir)
 
-    def buscar(self, pergunta_emb_np, tags=None, k=20):
+    # Atalhos para a geração atual (compatíveis com o uso anterior de retriever.index/docs/meta)
+    @property
+    def index(self):
+        return self._geracao.index
+
+    @property
+    def docs(self):
+        return self._geracao.docs
+
+    @property
+    def meta(self):
+        return self._geracao.meta
+
+    @property
+    def emb_dim(self):
+        return self._geracao.emb_dim
+
+    def geracao(self):
         """
-        Busca os documentos mais semelhantes a partir de um embedding numpy.
-        Retorna lista de tuplas: (documento, metadados, distância)
+        Geração a usar na próxima busca. Se db/CURRENT mudou, carrega a nova e
+        troca a referência; buscas em andamento seguem com a antiga, que é
+        liberada (lease e mmaps) quando a última delas termina e então apagada.
         """
-        D, I = self.index.search(np.array([pergunta_emb_np]), k=k)
-        resultados = []
+        atual = self._geracao
+        if self._ponteiro.mudou():
+            with self._lock:
+                if self._geracao is atual:
+                    try:
+                        self._geracao = GeracaoCarregada(self.db_dir)
+                        self._ponteiro.confirmar()
+                        print(f"🔄 Índice recarregado (geração {self._geracao.nome}).")
+                    except (FileNotFoundError, OSError) as e:
+                        # Ponteiro não confirmado: a próxima checagem tenta carregar de novo
+                        print(f"⚠️ Falha ao carregar a nova geração do índice; mantendo a atual: {e}")
+                atual = self._geracao
+        elif atual.lease is not None:
+            atual.lease.renovar()
+        return atual
 
-        for idx, i in enumerate(I[0]):
-            if i < len(self.docs):  # proteção contra índices inválidos
-                doc = self.docs[i]
-                metadados = self.meta[i]
-                distancia = D[0][idx]
-                if not tags or any(tag in metadados.get("tags", []) for tag in tags):
-                    resultados.append((doc, metadados, distancia))
+    @staticmethod
+    def _consultas(g, perguntas_emb_np):
+        """
+        Embeddings brutos (n, dim) -> consultas no espaço do índice, com a
+        redução da mesma geração que vai ser buscada. None se a dimensão não bate.
+        """
+        consultas = np.asarray(perguntas_emb_np, dtype=np.float32)
+        dim = g.reducao.d_in if g.reducao is not None else g.index.d
+        if consultas.ndim != 2 or consultas.shape[1] != dim:
+            print(f"⚠️ Embeddings com formato {consultas.shape}, índice espera (n, {dim}); ignorando a busca.")
+            return None
+        return aplicar_reducao(g.reducao, consultas)
 
-        return resultados
+    @staticmethod
+    def _hits(g, D, I):
+        # proteção contra índices inválidos (FAISS devolve -1)
+        return [(int(i), D[0][idx]) for idx, i in enumerate(I[0]) if 0 <= i < len(g.docs)]
 
-    def explorar_sem_pergunta(self, tags=None, limit=5):
+    @staticmethod
+    def _fundir(g, consultas, D, I, textos, k, bitmap=None):
         """
-        Retorna documentos recentes com base nas tags solicitadas,
-        ou os mais novos se não houver filtro.
+        Funde, por reciprocal rank fusion, o ranking vetorial (D, I) com o BM25
+        de cada texto. Hits que só o BM25 achou recebem a distância exata ao
+        embedding, para o score continuar comparável. Retorna hits por consulta.
+        """
+        saida = []
+        for q, texto in enumerate(textos):
+            vetoriais = Retriever._hits(g, D[q:q + 1], I[q:q + 1])
+            if g.lexico is None or not texto:
+                saida.append(vetoriais[:k])
+                continue
+            lexicos, _ = g.lexico.buscar(texto, len(I[q]), bitmap)
+            ids = fundir_rrf([[i for i, _ in vetoriais], lexicos], k, g.rrf_k)
+            distancias = dict(vetoriais)
+            faltando = np.array(sorted(set(ids) - distancias.keys()), dtype=np.int64)
+            if len(faltando):
+                D_l, I_l = buscar_exato_em(g.index, consultas[q:q + 1], len(faltando), faltando, g.vetores_exatos, g.reducao)
+                distancias.update(zip(I_l[0].tolist(), D_l[0]))
+            saida.append([(i, distancias[i]) for i in ids])
+        return saida
+
+    @staticmethod
+    def _resultados(g, hits):
+        # Lê do disco só o texto dos chunks que entram no resultado
+        docs = g.docs.get_many([i for i, _ in hits])
+        return [(doc, g.meta[i], distancia) for doc, (i, distancia) in zip(docs, hits)]
+
+    def buscar(self, pergunta_emb_np, tags=None, k=20, texto=None):
         """
+        Busca os documentos mais semelhantes a partir de um embedding numpy bruto
+        (a redução de dimensão da geração buscada é aplicada aqui).
+        Com o `texto` da pergunta (e o índice BM25 disponível), a busca é
+        híbrida: o ranking vetorial é fundido com o lexical (RRF), o que traz
+        identificadores exatos como "1424/2025" ou nomes de municípios.
+        Retorna lista de tuplas: (documento, metadados, distância)
+        """
+        return self.buscar_lote([pergunta_emb_np], tags=tags, k=k, textos=[texto])[0]
+
+    def buscar_lote(self, perguntas_emb_np, tags=None, k=20, textos=None):
+        """
+        Várias consultas numa única busca matricial (uma chamada ao índice
+        para todas). O texto de um chunk que aparece em vários resultados é
+        lido do disco uma vez só. `textos` (um por consulta) liga a fusão
+        com o BM25, como em buscar(). Retorna uma lista de resultados como os de buscar().
+        """
+        g = self.geracao()
+        consultas = self._consultas(g, perguntas_emb_np)
+        if consultas is None:
+            return [[] for _ in range(len(perguntas_emb_np))]
+        hibrida = g.lexico is not None and textos is not None and any(textos)
+        # Na busca híbrida cada ranking contribui com mais candidatos do que os k finais
+        k_busca = max(k, DEFAULT_CANDIDATOS_FUSAO) if hibrida else k
+        bitmap = None
         if tags:
-            docs_filtrados = [
-                (doc, meta) for doc, meta in zip(self.docs, self.meta)
-                if any(tag in meta.get("tags", []) for tag in tags)
-            ]
+            # Filtro dentro da busca: k hits válidos sempre que houver k chunks com as tags
+            ids, bitmap = g.meta.filtro_tags(tags)
+            D, I = buscar_filtrado(g.index, consultas, k_busca, ids, bitmap, g.vetores_exatos, g.rerank_fator, g.reducao)
+        else:
+            D, I = buscar(g.index, consultas, k_busca, g.vetores_exatos, g.rerank_fator, g.reducao)
+        if hibrida:
+            hits = self._fundir(g, consultas, D, I, textos, k, bitmap)
         else:
-            docs_filtrados = list(zip(self.docs, self.meta))
+            hits = [self._hits(g, D[q:q + 1], I[q:q + 1]) for q in range(len(consultas))]
+        unicos = sorted({i for h in hits for i, _ in h})
+        textos = dict(zip(unicos, g.docs.get_many(unicos)))
+        return [[(textos[i], g.meta[i], distancia) for i, distancia in h] for h in hits]
+
+    def buscar_identificador(self, identificador, tags=None, limit=20):
+        """
+        Chunks que contêm o identificador exato ("1424/2025", nome de APS ou de
+        município), direto das posting lists do BM25, mais recentes primeiro.
+        Retorna lista de tuplas: (documento, metadados, 0.0)
+        """
+        g = self.geracao()
+        if g.lexico is None:
+            return []
+        ids = g.lexico.ids_exatos(identificador).astype(np.int64)
+        if tags:
+            ids = np.intersect1d(ids, g.meta.ids_com_tags(tags), assume_unique=True)
+        ids = ids[np.argsort(-g.meta.created_us[ids], kind="stable")[:limit]]
+        return [(doc, g.meta[i], 0.0) for doc, i in zip(g.docs.get_many(ids), ids)]
 
-        # Ordena por data de criação (decrescente)
-        docs_ordenados = sorted(
-            docs_filtrados,
-            key=lambda d: d[1].get("created_at", ""),
-            reverse=True
-        )
+    def buscar_por_camadas(self, pergunta_emb_np, camadas, k=20, completar=False):
+        """
+        Busca priorizada por camadas de tags (lista ordenada; cada camada é uma
+        tag ou lista de tags), ordenando por camada e depois por distância.
+        Sem `completar`, responde só com a primeira camada que tem chunks (e
+        com a busca geral se nenhuma tiver); com `completar`, preenche os k
+        com as camadas seguintes.
 
-        return [d[0] for d in docs_ordenados[:limit]]
+        As camadas vazias são descartadas pelas postings, sem buscar, e as
+        que cabem inteiras no que falta dos k são ordenadas por força bruta;
+        no máximo uma camada vai de fato ao índice.
+        Retorna lista de tuplas: (documento, metadados, distância)
+        """
+        g = self.geracao()
+        consulta = self._consultas(g, [pergunta_emb_np])
+        if consulta is None:
+            return []
+        hits, vistos = [], np.zeros(0, dtype=np.int64)
+        for camada in camadas:
+            ids = g.meta.ids_com_tags([camada] if isinstance(camada, str) else camada)
+            if completar:
+                ids = np.setdiff1d(ids, vistos, assume_unique=True)  # cada chunk conta na melhor camada
+                vistos = np.union1d(vistos, ids)
+            if not len(ids):
+                continue
+            D, I = buscar_filtrado(g.index, consulta, k - len(hits), ids, None, g.vetores_exatos, g.rerank_fator, g.reducao)
+            hits.extend(self._hits(g, D, I))
+            if not completar or len(hits) >= k:
+                break
+        if not hits:
+            # Nenhuma camada com chunks: busca geral (sem filtro)
+            D, I = buscar(g.index, consulta, k, g.vetores_exatos, g.rerank_fator, g.reducao)
+            hits = self._hits(g, D, I)
+        return self._resultados(g, hits)
+
+    def explorar_sem_pergunta(self, tags=None, limit=5, cursor=None):
+        """
+        Retorna documentos recentes com base nas tags solicitadas,
+        ou os mais novos se não houver filtro.
+        """
+        return self.explorar_pagina(tags, limit, cursor)[0]
+
+    def explorar_pagina(self, tags=None, limit=5, cursor=None):
+        """
+        Uma página dos documentos mais recentes (com as tags), lida da ordem de
+        recência gravada pelo indexador, sem reordenar. Retorna (documentos,
+        cursor da próxima página ou None). O cursor vale para a geração do
+        índice em que foi emitido; depois de uma troca, a paginação recomeça.
+        """
+        g = self.geracao()
+        inicio = 0
+        if cursor:
+            nome, posicao = cursor.rsplit(":", 1)
+            inicio = int(posicao) if nome == (g.nome or "") else 0
+        ids, proximo = g.meta.recentes(tags, limit, inicio)
+        return g.docs.get_many(ids), f"{g.nome or ''}:{proximo}" if proximo is not None else None
 
     def buscar_prioridade_portaria(self, pergunta_emb_np, k=20):
         """
@@ -57,11 +260,5 @@ class Retriever:
             "portaria_unidades_manual",    # Depois busca regex/manual
             "portaria_unidades_tabular",   # Por último busca tabelas estruturadas
         ]
-        for tag in prioridade_tags:
-            resultados = self.buscar(pergunta_emb_np, tags=[tag], k=k)
-            if resultados:
-                # Retorna assim que encontrar pelo menos 1 chunk relevante
-                return resultados
-        # Se nada encontrado, retorna busca geral (sem filtro)
-        return self.buscar(pergunta_emb_np, tags=None, k=k)
-
+        # Uma única passada: a primeira camada com chunks responde; sem nenhuma, busca geral
+        return self.buscar_por_camadas(pergunta_emb_np, prioridade_tags, k=k)
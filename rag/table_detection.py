@@ -0,0 +1,141 @@
+import re
+
+DEFAULT_MAX_COLUNAS = 10
+DEFAULT_MIN_COLUNAS = 2
+
+# Mesmas regras do antigo extrair_tabelas_generico, compiladas uma única vez.
+# A linha candidata é procurada a partir do "\n" que a precede: com prefixo
+# literal o re varre a página inteira em C, sem um match() por linha.
+_RE_LINHA_TABELA = re.compile(r"\n[^\S\n]*(?:\d+\.|\.|\||[A-Z]{2}[^\S\n]*\.)[^\n]*")
+_RE_ESPACOS = re.compile(r"\s{2,}")
+_RE_LETRA = re.compile(r"[A-Za-z]")
+_RE_NUMERO_PAGINA = re.compile(r"^\s*(p[áa]g(ina|\.)?\s*)?\d+(\s*(/|de)\s*\d+)?\s*$", re.IGNORECASE)
+
+# Ordem de desempate dos delimitadores (o primeiro com mais colunas vence)
+_DELIMITADORES = ("espacos", "\t", "|", ".")
+
+def _dividir(linha, delim):
+    partes = _RE_ESPACOS.split(linha) if delim == "espacos" else linha.split(delim)
+    return [p.strip() for p in partes]
+
+def _e_ruido(linha):
+    """Linhas toleradas entre páginas sem quebrar uma tabela (vazias ou número de página)."""
+    return not linha.strip() or _RE_NUMERO_PAGINA.match(linha) is not None
+
+def _so_ruido(texto, pos):
+    """True se a partir de `pos` (um "\n") a página só tem ruído; para na primeira linha útil."""
+    while pos < len(texto):
+        fim = texto.find("\n", pos + 1)
+        fim = len(texto) if fim < 0 else fim
+        if not _e_ruido(texto[pos + 1:fim]):
+            return False
+        pos = fim
+    return True
+
+class DetectorTabelas:
+    """
+    Detecta tabelas em passada única: uma varredura da página entrega só as
+    linhas candidatas, cada uma tem as colunas por delimitador contadas uma
+    vez (sem dividir), o placar de delimitadores do bloco é atualizado a cada
+    linha e só no fim do bloco as linhas são divididas, já com o delimitador
+    escolhido.
+
+    Alimentado página a página (`pagina(texto)`), emite cada tabela assim
+    que ela termina. Com `multipagina=True`, um bloco que chega ao fim da
+    página continua na seguinte (ignorando linhas vazias, número de página
+    e o cabeçalho repetido). Chame `finalizar()` ao fim do documento.
+    """
+
+    def __init__(self, max_colunas=DEFAULT_MAX_COLUNAS, min_colunas=DEFAULT_MIN_COLUNAS, multipagina=True):
+        self.max_colunas = max_colunas
+        self.min_colunas = min_colunas
+        self.multipagina = multipagina
+        self.n_pagina = 0
+        self._limpar()
+
+    def _limpar(self):
+        self._bloco = []
+        self._placar = [0, 0, 0, 0]
+        self._pagina_inicio = None
+        self._pagina_fim = None
+
+    def _acrescentar(self, linha):
+        linha = linha.strip()
+        if not self._bloco:
+            self._pagina_inicio = self.n_pagina
+        self._bloco.append(linha)
+        self._pagina_fim = self.n_pagina
+        placar = self._placar
+        n = len(_RE_ESPACOS.findall(linha)) + 1
+        if n > placar[0]:
+            placar[0] = n
+        for i, delim in ((1, "\t"), (2, "|"), (3, ".")):
+            n = linha.count(delim) + 1
+            if n > placar[i]:
+                placar[i] = n
+
+    def _fechar(self):
+        tabela = None
+        if len(self._bloco) >= 2:
+            melhor = max(range(len(_DELIMITADORES)), key=lambda i: (self._placar[i], -i))
+            rows = [_dividir(linha, _DELIMITADORES[melhor]) for linha in self._bloco]
+            if any(_RE_LETRA.search(cel) for cel in rows[0]):
+                header, rows = rows[0], rows[1:]
+            else:
+                header = [f"Coluna_{i+1}" for i in range(len(rows[0]))]
+            if len(header) <= self.max_colunas:
+                tabela = {"header": header, "rows": rows, "paginas": [self._pagina_inicio, self._pagina_fim]}
+        self._limpar()
+        return tabela
+
+    def _inicio_continuacao(self, texto):
+        """Posição (do "\n") onde a tabela pendente continuaria: após ruído e cabeçalho repetido."""
+        pos = 0
+        while pos < len(texto):
+            fim = texto.find("\n", pos + 1)
+            fim = len(texto) if fim < 0 else fim
+            linha = texto[pos + 1:fim]
+            if _e_ruido(linha):
+                pos = fim
+                continue
+            if linha.strip() == self._bloco[0]:
+                pos = fim
+            break
+        return pos
+
+    def pagina(self, texto):
+        """Processa a próxima página; gera as tabelas que terminam nela."""
+        self.n_pagina += 1
+        texto = "\n" + texto
+        min_colunas = self.min_colunas
+        # Posição em que a próxima linha precisa começar para continuar o bloco
+        esperado = self._inicio_continuacao(texto) if self._bloco else -1
+        for m in _RE_LINHA_TABELA.finditer(texto, max(esperado, 0)):
+            linha = m.group()[1:]
+            if len(linha.split(None, min_colunas - 1)) < min_colunas:
+                continue  # não conta como linha de tabela: quebra a adjacência
+            if self._bloco and m.start() != esperado:
+                tabela = self._fechar()
+                if tabela:
+                    yield tabela
+            self._acrescentar(linha)
+            esperado = m.end()
+
+        if self._bloco:
+            if not (self.multipagina and _so_ruido(texto, esperado)):
+                tabela = self._fechar()
+                if tabela:
+                    yield tabela
+
+    def finalizar(self):
+        if self._bloco:
+            tabela = self._fechar()
+            if tabela:
+                yield tabela
+
+def detectar_tabelas(paginas, max_colunas=DEFAULT_MAX_COLUNAS, min_colunas=DEFAULT_MIN_COLUNAS, multipagina=True):
+    """Gera as tabelas ({header, rows, paginas}) de uma sequência de textos de página."""
+    detector = DetectorTabelas(max_colunas, min_colunas, multipagina)
+    for texto in paginas:
+        yield from detector.pagina(texto)
+    yield from detector.finalizar()
@@ -0,0 +1,130 @@
+import os
+import mmap
+import zlib
+from array import array
+from collections.abc import Sequence
+import numpy as np
+
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks_offsets.npy"
+_MAGIC = b"CHK1"
+_HEADER = 8  # magic (4) + compressão (1) + padding (3)
+
+class ChunkTextList(list):
+    """Textos em memória (documents.pkl antigo) com a mesma interface do ChunkTextStore."""
+
+    def get_many(self, ids):
+        return [self[int(i)] for i in ids]
+
+class ChunkTextStore(Sequence):
+    """
+    Texto dos chunks num único blob mapeado em memória (chunks.bin) mais um
+    array de offsets (chunks_offsets.npy). Cada chunk é lido e, se for o caso,
+    descomprimido só quando acessado.
+    """
+
+    def __init__(self, db_dir):
+        with open(os.path.join(db_dir, CHUNKS_FILE), "rb") as f:
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._blob[:4] != _MAGIC:
+            raise ValueError(f"{CHUNKS_FILE} inválido em {db_dir}.")
+        self.comprimido = self._blob[4:5] == b"Z"
+        self.offsets = np.load(os.path.join(db_dir, OFFSETS_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _ler(self, i):
+        dados = self._blob[_HEADER + int(self.offsets[i]):_HEADER + int(self.offsets[i + 1])]
+        if self.comprimido:
+            dados = zlib.decompress(dados)
+        return dados.decode("utf-8")
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._ler(j) for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._ler(i)
+
+    def get_many(self, ids):
+        """Busca vários chunks (ex.: top-k) lendo o blob em ordem crescente de offset."""
+        ids = [int(i) for i in ids]
+        textos = {i: self[i] for i in sorted(set(ids))}
+        return [textos[i] for i in ids]
+
+def _sincronizar(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+class ChunkTextWriter:
+    """
+    Grava o ChunkTextStore de forma incremental; os arquivos só aparecem em fechar().
+    checkpoint() torna durável o que foi gravado até ali e devolve o estado
+    que, passado de volta em `estado`, retoma a escrita daquele ponto.
+    """
+
+    def __init__(self, db_dir, comprimir=True, estado=None):
+        self.db_dir = db_dir
+        self.comprimir = comprimir
+        self.path = os.path.join(db_dir, CHUNKS_FILE)
+        self._tmp_path = self.path + ".tmp"
+        self._offsets_tmp_path = self.path + ".offsets.tmp"  # uint64 crus, gravados a cada checkpoint
+        if estado is None:
+            self._f = open(self._tmp_path, "wb")
+            self._f.write(_MAGIC + (b"Z" if comprimir else b"N") + b"\0" * 3)
+            self.offsets = array("Q", [0])
+            open(self._offsets_tmp_path, "wb").close()
+        else:
+            self._retomar(estado["n"])
+        self._offsets_duraveis = len(self)
+
+    def _retomar(self, n):
+        offsets = array("Q")
+        with open(self._offsets_tmp_path, "rb") as f:
+            offsets.frombytes(f.read(8 * n))
+        if len(offsets) != n:
+            raise ValueError(f"Checkpoint de {CHUNKS_FILE} incompleto: {len(offsets)} de {n} offsets.")
+        self.offsets = array("Q", [0]) + offsets
+        os.truncate(self._offsets_tmp_path, 8 * n)
+        with open(self._tmp_path, "rb") as f:
+            self.comprimir = f.read(_HEADER)[4:5] == b"Z"
+        os.truncate(self._tmp_path, _HEADER + self.offsets[-1])
+        self._f = open(self._tmp_path, "ab")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def adicionar(self, texto):
+        dados = texto.encode("utf-8")
+        if self.comprimir:
+            dados = zlib.compress(dados, 6)
+        self._f.write(dados)
+        self.offsets.append(self.offsets[-1] + len(dados))
+        return len(self.offsets) - 2
+
+    def checkpoint(self):
+        _sincronizar(self._f)
+        with open(self._offsets_tmp_path, "ab") as f:
+            f.write(self.offsets[self._offsets_duraveis + 1:].tobytes())
+            _sincronizar(f)
+        self._offsets_duraveis = len(self)
+        return {"n": len(self)}
+
+    def fechar(self):
+        self._f.close()
+        offsets_path = os.path.join(self.db_dir, OFFSETS_FILE)
+        with open(offsets_path + ".tmp", "wb") as f:
+            np.save(f, np.array(self.offsets, dtype=np.uint64))
+        os.replace(self._tmp_path, self.path)
+        os.replace(offsets_path + ".tmp", offsets_path)
+        os.remove(self._offsets_tmp_path)
+
+def salvar_textos(textos, db_dir, comprimir=True):
+    writer = ChunkTextWriter(db_dir, comprimir=comprimir)
+    for texto in textos:
+        writer.adicionar(texto)
+    writer.fechar()
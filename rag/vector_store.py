@@ -0,0 +1,51 @@
+import os
+import numpy as np
+
+VECTORS_FILE = "vectors.f32"
+
+class VectorWriter:
+    """
+    Grava vetores float32 em modo append (vectors.f32); o arquivo só aparece em fechar().
+    checkpoint()/`estado` funcionam como no ChunkTextWriter.
+    """
+
+    def __init__(self, db_dir, dim, estado=None):
+        self.dim = int(dim)
+        self.path = os.path.join(db_dir, VECTORS_FILE)
+        self._tmp_path = self.path + ".tmp"
+        self.n = 0
+        if estado is None:
+            self._f = open(self._tmp_path, "wb")
+        else:
+            self.n = estado["n"]
+            if os.path.getsize(self._tmp_path) < self.n * 4 * self.dim:
+                raise ValueError(f"Checkpoint de {VECTORS_FILE} incompleto.")
+            os.truncate(self._tmp_path, self.n * 4 * self.dim)
+            self._f = open(self._tmp_path, "ab")
+
+    def adicionar(self, vetores):
+        vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+        if vetores.shape[1] != self.dim:
+            raise ValueError(f"Vetor com dimensão {vetores.shape[1]}, esperado {self.dim}.")
+        self._f.write(vetores.tobytes())
+        self.n += len(vetores)
+
+    def checkpoint(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        return {"n": self.n, "dim": self.dim}
+
+    def fechar(self):
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+        return carregar_vetores(os.path.dirname(self.path), self.dim)
+
+def carregar_vetores(db_dir, dim):
+    """Vetores em precisão total, mapeados em memória (n, dim); None se o arquivo não existir."""
+    path = os.path.join(db_dir, VECTORS_FILE)
+    if not os.path.exists(path):
+        return None
+    n = os.path.getsize(path) // (4 * dim)
+    if n == 0:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(n, dim))